@@ -0,0 +1,20 @@
+#!/bin/bash
+# Run the evaluation script as a Slurm array job; each task handles one deterministic shard of the cases of every model
+# (the shard index and count come from SLURM_ARRAY_TASK_ID / SLURM_ARRAY_TASK_COUNT, see llm_pipeline/sharding.py)
+#
+# Usage:
+#   sbatch --array=0-7 array_submit.sh evaluate_accuracy.py
+#   sbatch --dependency=afterok:<array job id> array_submit.sh evaluate_accuracy.py --merge-shards
+
+#SBATCH --job-name=eval-array
+#SBATCH --time=1-
+#SBATCH --mail-type=ALL
+#SBATCH --mem=8G
+#SBATCH --partition=day
+#SBATCH --output=/gpfs/radev/project/xu_hua/kwj9/psychiatry_llm/evaluation_of_sota/jama_submission_12152025/psychiatry-frontier-llm-evaluation/code/top_5_accuracy/script_versions/calculate_accuracy/slurm_logs/%x-%A_%a.out
+
+module reset
+module load miniconda
+conda activate mh-eval
+
+python "$@"
@@ -1,7 +1,12 @@
 # Calculate accuracy metrics for model-predicted diagnoses against ground truth (n=196) using hybrid fuzzy + LLM approach
+import argparse
 import re
-from rapidfuzz import fuzz
-from openai import OpenAI
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from rapidfuzz import fuzz, process
 from dotenv import load_dotenv
 from pydantic import BaseModel
 import os
@@ -9,6 +14,18 @@ import json
 import pandas as pd
 from tqdm import tqdm
 
+sys.path.append("..")  # Make the shared llm_pipeline package importable
+from llm_pipeline.adapters import responses_usage
+from llm_pipeline.bootstrap_stats import write_bootstrap
+from llm_pipeline.diagnosis_index import DiagnosisIndex
+from llm_pipeline.eval_manifest import case_digest, load_manifest, merge_manifests, save_manifest
+from llm_pipeline.embedding_tier import DEFAULT_EMBEDDING_MODEL, EmbeddingTier, load_sentence_encoder, report_calibration
+from llm_pipeline.judge_cache import DEFAULT_JUDGE_CACHE_PATH, BATCH_JUDGE_PROMPT, JUDGE_PROMPT, JudgeCache, format_batch_prompt, prompt_version
+from llm_pipeline.http_clients import add_pool_arguments, configure_pool_from_args, openai_client, report_connection_stats
+from llm_pipeline.sharding import add_shard_arguments, check_coverage, find_shard_files, resolve_shard, select_shard, shard_suffix
+from llm_pipeline.telemetry import TelemetryStore
+from llm_pipeline.threshold_sweep import DEFAULT_THRESHOLDS, plot_sweep, sweep_table
+
 # Define constants for DataFrame columns of interest
 COL_TRUE = 'diagnosis'
 COL_PRED = 'model_diagnosis'
@@ -16,8 +33,62 @@ COL_PRED = 'model_diagnosis'
 # Load API key from environment variable
 load_dotenv()
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Record latency, tokens and estimated cost of every judge call (report: python -m llm_pipeline.telemetry report --kind judge)
+telemetry = TelemetryStore()
+
+# Parse command-line options (an array job evaluates one shard of the cases per task, then --merge-shards combines them)
+parser = argparse.ArgumentParser(description="Calculate hybrid fuzzy + LLM accuracy metrics for model-predicted diagnoses")
+add_shard_arguments(parser)
+add_pool_arguments(parser)
+parser.add_argument("--judge-cache-path", default=DEFAULT_JUDGE_CACHE_PATH,
+                    help="SQLite store of LLM-judge verdicts, shared across models, runs and processes")
+parser.add_argument("--no-judge-cache", action="store_true",
+                    help="Keep judge verdicts in memory for this run only")
+parser.add_argument("--workers", type=int, default=1,
+                    help="Cases judged concurrently (default: 1, the serial path); pairs in flight are never asked twice")
+parser.add_argument("--parallel-files", action="store_true",
+                    help="With --workers > 1, also evaluate the model files concurrently")
+parser.add_argument("--fuzzy-workers", type=int, default=-1,
+                    help="CPU cores for the fuzzy tier's one-shot scoring of all pairs (default: -1, all cores)")
+parser.add_argument("--check-determinism", action="store_true",
+                    help="Re-score every case serially from the judge cache and fail if any per-case result differs")
+parser.add_argument("--diagnosis-index", action="store_true",
+                    help="Resolve exact, subtype and clear-mismatch pairs from the local ICD-10/DSM-5-TR index "
+                         "(llm_pipeline/diagnosis_index.py) before asking the judge")
+parser.add_argument("--embedding-tier", action="store_true",
+                    help="Accept/reject pairs by sentence-embedding cosine similarity before asking the judge "
+                         "(needs sentence-transformers)")
+parser.add_argument("--embedding-model", default=DEFAULT_EMBEDDING_MODEL)
+parser.add_argument("--embedding-accept", type=float, default=0.95, help="Cosine similarity at or above which a pair matches")
+parser.add_argument("--embedding-reject", type=float, default=0.3, help="Cosine similarity at or below which it does not")
+parser.add_argument("--embedding-shadow", action="store_true",
+                    help="Only log similarities against judge verdicts (for calibrating the thresholds); decide nothing")
+parser.add_argument("--metrics", nargs="+", choices=["top1", "hit_rate", "recall", "mrr"],
+                    default=["top1", "hit_rate", "recall", "mrr"],
+                    help="Metrics to compute; judge calls that cannot change any of them are skipped (default: all four)")
+parser.add_argument("--full-matrix", action="store_true",
+                    help="Judge every (true, pred) cell and save each case's match matrix in the detailed CSV (audits)")
+parser.add_argument("--rescore-all", action="store_true",
+                    help="Score every case again instead of reusing unchanged cases from the per-case manifest")
+parser.add_argument("--bootstrap-resamples", type=int, default=10000,
+                    help="Case resamples for the bootstrap CIs and paired model differences (0 skips them)")
+parser.add_argument("--bootstrap-seed", type=int, default=0)
+parser.add_argument("--threshold-sweep", action="store_true",
+                    help="Instead of the usual results, score every case once and write the metrics for every fuzzy "
+                         "threshold in --sweep-range, with the judge on and off (table + one plot per model)")
+parser.add_argument("--sweep-range", nargs=2, type=int, default=[DEFAULT_THRESHOLDS[0], DEFAULT_THRESHOLDS[-1]],
+                    metavar=("LOW", "HIGH"), help="Fuzzy thresholds of the sweep, inclusive (default: 70 100)")
+parser.add_argument("--judge-mode", choices=["pair", "batch"], default="pair",
+                    help="'pair': one judge call per unresolved (true, pred) pair; "
+                         "'batch': one call per case for its whole unresolved true x pred matrix")
+args = parser.parse_args()
+shard = resolve_shard(args)
+if args.threshold_sweep and (shard is not None or args.merge_shards):
+    parser.error("--threshold-sweep scores every case in one run; it cannot be combined with sharding")
+
+# Initialize the OpenAI client (pooled keep-alive connections, so judge calls skip repeated TLS handshakes)
+configure_pool_from_args(args)
+client = openai_client(async_=False)
 
 
 # Helper functions: Parse ground truth diagnoses and model-predicted diagnoses strings from DataFrame into lists
@@ -65,16 +136,136 @@ def parse_model_predicted_diagnoses(model_diagnoses_str) -> list:
     return diagnoses
 
 
+# TIER 1 scores for a whole run: token_set_ratio of every (true, pred) pair the cases need, in one native call
+class FuzzyScores:
+    def __init__(self, pairs, workers=-1):
+        pairs = list(dict.fromkeys(pairs))  # Unique normalized (true, pred) pairs
+        if pairs and hasattr(process, "cpdist"):  # rapidfuzz >= 3.6; float64 keeps scores identical to fuzz.token_set_ratio
+            scores = process.cpdist([t for t, _ in pairs], [p for _, p in pairs], scorer=fuzz.token_set_ratio,
+                                    dtype=np.float64, workers=workers)
+        else:
+            scores = [fuzz.token_set_ratio(t, p) for t, p in pairs]
+        self.scores = dict(zip(pairs, map(float, scores)))
+
+    @classmethod
+    def from_cases(cls, frames, workers=-1):
+        """Scores for every (true, pred) pair of every case in the given DataFrames."""
+        pairs = []
+        for cases_df in frames:
+            for true_str, pred_str in zip(cases_df[COL_TRUE], cases_df[COL_PRED]):
+                y_true = [item.lower().strip() for item in parse_ground_truth_diagnoses(true_str)]
+                y_pred = [item.lower().strip() for item in parse_model_predicted_diagnoses(pred_str)]
+                pairs += [(t, p) for t in y_true for p in y_pred]
+        return cls(pairs, workers)
+
+    def score(self, t, p):
+        score = self.scores.get((t, p))
+        return fuzz.token_set_ratio(t, p) if score is None else score  # Pairs outside the run are scored on the spot
+
+
+# Summary rows and detailed-result columns of the metrics
+METRICS = {
+    "top1": ("Top-1 Accuracy", "hybrid_top1"),
+    "hit_rate": ("Top-5 Accuracy", "hybrid_hit_rate"),
+    "recall": ("Recall@5", "hybrid_recall"),
+    "mrr": ("Mean Reciprocal Rank", "hybrid_mrr"),
+}
+
+
+def needed_cells(matrix, metrics):
+    """
+    Open cells (None) of a match matrix whose verdict can still change one of the requested metrics, in rank order.
+    Top-1, hit rate and MRR only depend on the first prediction that matches anything, so columns after a known match
+    never need the judge; recall only needs one match per true diagnosis, so neither do rows that already have one.
+    """
+    n_pred = len(matrix[0]) if matrix else 0
+    found_rows = {i for i, row in enumerate(matrix) if True in row}
+    matched_cols = [j for j in range(n_pred) if any(row[j] is True for row in matrix)]
+    first_match_col = matched_cols[0] if matched_cols else n_pred
+    cells = []
+    for j in range(n_pred):
+        for i, row in enumerate(matrix):
+            if row[j] is not None:
+                continue
+            if ("mrr" in metrics and j < first_match_col) \
+                    or ("top1" in metrics and j == 0 and first_match_col != 0) \
+                    or ("hit_rate" in metrics and not matched_cols) \
+                    or ("recall" in metrics and i not in found_rows):
+                cells.append((i, j))
+    return cells
+
+
 # Compare ground truth and predicted diagnoses using hybrid fuzzy + LLM approach for one case
 # Define hybrid evaluator class for one case
 class HybridEvaluator:
-    def __init__(self, fuzzy_threshold=90, llm_model="gpt-5-mini"):
+    def __init__(self, fuzzy_threshold=90, llm_model="gpt-5-mini", telemetry=None, experiment=None, cache=None,
+                 batch=False, fuzzy_scores=None, index=None, embeddings=None, metrics=None):
         self.fuzzy_threshold = fuzzy_threshold
         self.llm_model = llm_model
-        self.cache = {}  # The cache prevents paying for the same comparison twice. Structure: {"True Term || Pred Term": True/False}
+        self.batch = batch  # One judge call per case (see match_matrix) instead of one per pair
+        self.fuzzy_scores = fuzzy_scores  # Optional FuzzyScores precomputed for the run
+        self.index = index  # Optional DiagnosisIndex tier between fuzzy matching and the judge
+        self.embeddings = embeddings  # Optional EmbeddingTier for the pairs neither the index nor the cache resolve
+        self.tier_hits = {"fuzzy": 0, "index_match": 0, "index_mismatch": 0, "cache": 0,
+                          "embedding_match": 0, "embedding_mismatch": 0}  # Pairs resolved without a judge call
+        # The cache prevents paying for the same comparison twice, across models, runs and processes
+        # Keyed by (normalized true term, normalized pred term, judge model, prompt version); see llm_pipeline/judge_cache.py
+        self.cache = cache if cache is not None else JudgeCache(":memory:")
+        # Batched verdicts come from a different prompt, so they are cached under their own version
+        self.prompt_version = prompt_version(BATCH_JUDGE_PROMPT if batch else JUDGE_PROMPT)
+        # Metrics the matrix is needed for; cells that cannot change them are never judged (None: every cell)
+        self.metrics = None if metrics is None else set(metrics)
         self.llm_calls = 0
+        self.skipped_cells = 0  # Cells left unjudged because no requested metric depends on them
+        self.failures = {}  # case_id -> cells scored as no match because their judge call failed (not cached)
+        self.lock = threading.Lock()  # Guards the counters when cases are judged concurrently
+        self.telemetry = telemetry  # Optional TelemetryStore; one record per judge call
+        self.experiment = experiment  # Label for telemetry records
+
+    def resolve_locally(self, t, p):
+        """True/False from the fuzzy tier, the diagnosis index or the judge cache, or None when the judge has to be asked."""
+        # TIER 1: Fuzzy String Matching (Free & Fast)
+        # token_set_ratio handles reordering (e.g. "Type 2 Diabetes" == "Diabetes Type 2")
+        fuzzy_score = self.fuzzy_scores.score(t, p) if self.fuzzy_scores is not None else fuzz.token_set_ratio(t, p)
+        if fuzzy_score >= self.fuzzy_threshold:
+            self._count("fuzzy")
+            return True
 
-    def check_match(self, true_diag, pred_diag):
+        # Optional canonical tier: same DSM-5-TR entity or subtype (match), different chapters (mismatch)
+        if self.index is not None:
+            verdict = self.index.compare(t, p)
+            if verdict is not None:
+                self._count("index_match" if verdict else "index_mismatch")
+                return verdict
+
+        # TIER 2: LLM Judge (Semantic), answered from the cache when this pair was judged before
+        verdict = self.cache.get(t, p, self.llm_model, self.prompt_version)
+        if verdict is not None:
+            self._count("cache")
+            self._observe(t, p, verdict)
+            return verdict
+
+        # Optional embedding tier: only the band between its reject and accept thresholds goes to the judge
+        if self.embeddings is not None:
+            verdict = self.embeddings.compare(t, p)
+            if verdict is not None:
+                self._count("embedding_match" if verdict else "embedding_mismatch")
+        return verdict
+
+    def _observe(self, t, p, verdict):
+        """Log a judge verdict against the embedding similarity, for calibrating the embedding thresholds."""
+        if self.embeddings is not None:
+            self.embeddings.observe(t, p, verdict)
+
+    def _count(self, tier):
+        with self.lock:
+            self.tier_hits[tier] += 1
+
+    def _fail(self, case_id):
+        with self.lock:
+            self.failures[case_id] = self.failures.get(case_id, 0) + 1
+
+    def check_match(self, true_diag, pred_diag, case_id=None):
         """
         Returns True if match, False if not.
         Uses Fuzzy first, then falls back to LLM.
@@ -83,48 +274,146 @@ class HybridEvaluator:
         t = true_diag.lower().strip()
         p = pred_diag.lower().strip()
 
-        # 2. TIER 1: Fuzzy String Matching (Free & Fast)
-        # token_set_ratio handles reordering (e.g. "Type 2 Diabetes" == "Diabetes Type 2")
-        fuzzy_score = fuzz.token_set_ratio(t, p)
-        if fuzzy_score >= self.fuzzy_threshold:
-            return True
-
-        # 3. TIER 2: LLM Judge (Semantic)
-        # Only runs if fuzzy score is low (e.g., < 95)
-        # Check cache first
-        cache_key = f"{t} || {p}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
-
-        # Call the LLM to act as a strict medical adjudicator
+        # 2. Fuzzy tier and cached verdicts; wait instead of asking while another worker is judging this pair
+        while True:
+            resolved = self.resolve_locally(t, p)
+            if resolved is not None:
+                return resolved
+            waiting = self.cache.claim(t, p, self.llm_model, self.prompt_version)
+            if waiting is None:
+                break
+            waiting.wait()
+
+        # 3. Call the LLM to act as a strict medical adjudicator
         # print(f"Fuzzy threshold exceeded. Invoking LLM for: '{t}' vs '{p}'")
-        is_match = self._ask_llm(t, p)
+        try:
+            is_match = self._ask_llm(t, p, case_id)
+            with self.lock:
+                self.llm_calls += 1
+            if is_match is None:
+                self._fail(case_id)
+                return False  # Failed call: count as no match, but do not cache it so the next run asks again
+
+            # Update Cache
+            self.cache.put(t, p, self.llm_model, self.prompt_version, is_match)
+            self._observe(t, p, is_match)
+            return is_match
+        finally:
+            self.cache.release(t, p, self.llm_model, self.prompt_version)
+
+    def open_cells(self, matrix):
+        """Cells that still need a verdict: the ones the requested metrics depend on, or every open cell."""
+        if self.metrics is None:
+            return [(i, j) for i, row in enumerate(matrix) for j, cell in enumerate(row) if cell is None]
+        return needed_cells(matrix, self.metrics)
+
+    def match_matrix(self, y_true, y_pred, case_id=None):
+        """
+        matrix[i][j] is True if y_pred[j] matches y_true[i]. Every cell is first tried on the free tiers (fuzzy,
+        index, cache, embeddings); the judge then only sees cells the requested metrics depend on, which stay None
+        when skipped. In batch mode those cells go to the judge in one call for the case; each cell's verdict is
+        still cached on its own.
+        """
+        if not self.batch and self.metrics is None:
+            return [[self.check_match(true_item, pred_item, case_id) for pred_item in y_pred] for true_item in y_true]
+
+        y_true = [item.lower().strip() for item in y_true]
+        y_pred = [item.lower().strip() for item in y_pred]
+        matrix = [[self.resolve_locally(t, p) for p in y_pred] for t in y_true]
+        while True:
+            unresolved = self.open_cells(matrix)
+            if not unresolved:
+                skipped = sum(cell is None for row in matrix for cell in row)
+                with self.lock:
+                    self.skipped_cells += skipped
+                return matrix
+
+            if not self.batch:
+                # One pair at a time in rank order, so every verdict can make the remaining cells unnecessary
+                i, j = unresolved[0]
+                matrix[i][j] = self.check_match(y_true[i], y_pred[j], case_id)
+                continue
+
+            # Cells another worker is already judging are waited for instead of asked again
+            owned, waiting = [], []
+            for i, j in unresolved:
+                event = self.cache.claim(y_true[i], y_pred[j], self.llm_model, self.prompt_version)
+                if event is None:
+                    owned.append((i, j))
+                else:
+                    waiting.append((i, j, event))
+
+            if owned:
+                # Ask only about the rows and columns that still have open cells
+                rows = sorted({i for i, _ in owned})
+                cols = sorted({j for _, j in owned})
+                try:
+                    verdicts = self._ask_llm_batch([y_true[i] for i in rows], [y_pred[j] for j in cols], case_id)
+                    with self.lock:
+                        self.llm_calls += 1
+                    for i, j in owned:
+                        is_match = None if verdicts is None else verdicts[rows.index(i)][cols.index(j)]
+                        if is_match is None:
+                            self._fail(case_id)
+                            matrix[i][j] = False  # Failed call: count as no match, but do not cache it
+                            continue
+                        self.cache.put(y_true[i], y_pred[j], self.llm_model, self.prompt_version, is_match)
+                        self._observe(y_true[i], y_pred[j], is_match)
+                        matrix[i][j] = is_match
+                finally:
+                    for i, j in owned:
+                        self.cache.release(y_true[i], y_pred[j], self.llm_model, self.prompt_version)
+
+            # Verdicts of the other workers; cells whose call failed stay open and are asked on the next pass
+            for i, j, event in waiting:
+                event.wait()
+                matrix[i][j] = self.cache.get(y_true[i], y_pred[j], self.llm_model, self.prompt_version)
+
+    def _ask_llm_batch(self, true_items, pred_items, case_id=None):
+        """Verdict matrix (rows: true_items, columns: pred_items) from one judge call, or None if the call failed."""
+        prompt = format_batch_prompt(true_items, pred_items)
 
-        # Update Cache
-        self.cache[cache_key] = is_match
-        self.llm_calls += 1
-        return is_match
+        # Define response schema
+        class DiagnosisMatchMatrix(BaseModel):
+            matches: list[list[bool]]  # matches[i][j]: predicted diagnosis j matches true diagnosis i
 
-    def _ask_llm(self, t, p):
+        # Call the LLM judge
+        start = time.perf_counter()
+        response = None
+        try:
+            response = client.responses.parse(
+                model=self.llm_model,
+                input=[{"role": "user", "content": prompt}],
+                text_format=DiagnosisMatchMatrix,
+            )
+            matches = response.output_parsed.matches
+            if len(matches) != len(true_items) or any(len(row) != len(pred_items) for row in matches):
+                raise ValueError(f"expected a {len(true_items)}x{len(pred_items)} matrix, got "
+                                 f"{len(matches)} rows of {[len(row) for row in matches]}")
+            return matches
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            return None
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.record("judge", self.llm_model, case_id=case_id, experiment=self.experiment,
+                                      outcome="ok" if response is not None else "error",
+                                      latency=time.perf_counter() - start, usage=responses_usage(response))
+
+    def _ask_llm(self, t, p, case_id=None):
         # Define prompt for LLM-as-a-judge
-        prompt = f"""
-
-        Your task is to act as a strict medical adjudicator specializing in psychiatry and identify whether the predicted diagnosis is clinically equivalent to (or a valid subclass of) the true diagnosis. Your standards are exacting, and you must consider the nuances of each diagnosis carefully. As much as possible, adhere to the diagnostic language laid out in the DSM-5-TR, and utilize the included ICD-10 F-codes to aid your determination.
-
-        True Diagnosis: "{t}"
-        Predicted Diagnosis: "{p}"
-
-        Return JSON ONLY: {{ "match": <true/false> }}
-        """
+        prompt = JUDGE_PROMPT.format(true_diagnosis=t, predicted_diagnosis=p)
 
         # Define response schema
         class DiagnosisMatch(BaseModel):
             match: bool  # True if match, False if not
 
         # Call the LLM judge
+        start = time.perf_counter()
+        response = None
         try:
             response = client.responses.parse(
-                model="gpt-5-mini",
+                model=self.llm_model,
                 input=[
                     {
                           "role": "user",
@@ -137,124 +426,373 @@ class HybridEvaluator:
             return result.get("match", False)  # Default to False if key missing
         except Exception as e:
             print(f"LLM Error: {e}")
-            return False
+            return None
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.record("judge", self.llm_model, case_id=case_id, experiment=self.experiment,
+                                      outcome="ok" if response is not None else "error",
+                                      latency=time.perf_counter() - start, usage=responses_usage(response))
 
 
-# Load cases from JSON to Pandas DataFrame
-model_results_path = "../../../../results/top_5_accuracy/predicted_diagnoses/memorization_experiment/fictitious_only"
-models = os.listdir(model_results_path)
+# Write the summary and detailed CSVs for one model (from a full run or from merged shards)
+def save_results(model, final_df, results_df):
+    # 1. Aggregate Statistics
+    computed = [(label, column) for label, column in METRICS.values() if column in results_df]  # See --metrics
+    stats = {
+        "Metric": [label for label, _ in computed],
+        "Score": [results_df[column].mean() for _, column in computed]
+    }
+    stats_df = pd.DataFrame(stats)
 
-# Evaluate all models inside the folder
-for model in models:
-    # Load model results to a Pandas DataFrame
-    results_path = os.path.join(model_results_path, model)
+    # Display nicely formatted percentages
+    print("\n=== FINAL DIAGNOSTIC PERFORMANCE (Mean Scores) ===")
+    stats_df.style.format({"Score": "{:.2%}"})
 
-    with open(results_path, 'r') as f:
-        cases = json.load(f)
+    # Export summary statistics to CSV
+    stats_df.to_csv(f"{summary_stats_path}{model}_diagnostic_performance_summary.csv", index=False)
+    print(f"\nSaved performance summary to '{summary_stats_path}{model}_diagnostic_performance_summary.csv'")
 
-    cases_df = pd.DataFrame(cases)
+    # 2. Inspecting Failures
+    # Return rows where Hit Rate was 0 (Total Misses)
+    misses = final_df[final_df['hybrid_hit_rate'] == 0] if 'hybrid_hit_rate' in final_df else final_df.iloc[:0]
+    print(f"\nTotal Cases Completely Missed: {len(misses)}")
+    if len(misses) > 0:
+        print("Example Miss:")
+        print(misses[[COL_TRUE, COL_PRED]].iloc[0])
 
-    # Initialize Evaluator
-    evaluator = HybridEvaluator(fuzzy_threshold=90, llm_model="gpt-5-mini")
+    # 3. Export detailed results to CSV
+    final_df.to_csv(f"{detailed_results_path}{model}_diagnostic_evaluation_results_detailed.csv", index=False)
+    print(f"\nSaved detailed results to '{detailed_results_path}{model}_diagnostic_evaluation_results_detailed.csv'")
 
-    results = []
 
-    # Iterate through DataFrame
-    print(f"Starting evaluation for {model}...")
-    for index, row in tqdm(cases_df.iterrows(), total=len(cases_df)):
+# Score one case (a DataFrame row); None when it has no ground truth
+def evaluate_case(evaluator, row):
+    # 1. Parse Data
+    y_true = parse_ground_truth_diagnoses(row[COL_TRUE])
+    y_pred = parse_model_predicted_diagnoses(row[COL_PRED])
+
+    # If no ground truth, skip
+    if not y_true:
+        return None
+
+    # 2. Analyze Matches
+    # THE HYBRID CHECK for the (true, pred) pairs the metrics need: matches[true_idx][rank_idx] (None: not judged)
+    matches = evaluator.match_matrix(y_true, y_pred, case_id=row['case_id'])
+
+    # We map which TRUE diagnoses were found in the PRED list
+    found_indices = set()
+    first_match_rank = None  # For MRR
+
+    # Iterate through predictions (Order matters for Rank!)
+    for rank_idx, pred_item in enumerate(y_pred):
+        current_rank = rank_idx + 1  # 1-based rank
+
+        # Check against ALL true items
+        is_this_pred_correct = False
 
-        # Sanity check: Ensure no missing ground-truth diagnoses
-        assert cases_df["diagnosis"].notna().all(), "Missing ground-truth diagnoses detected"
+        for true_idx, true_item in enumerate(y_true):
+            if matches[true_idx][rank_idx]:
+                is_this_pred_correct = True
+                found_indices.add(true_idx)
 
-        # 1. Parse Data
-        y_true = parse_ground_truth_diagnoses(row[COL_TRUE])
-        y_pred = parse_model_predicted_diagnoses(row[COL_PRED])
+        # If this prediction was a match, and it's the first one we've seen...
+        if is_this_pred_correct and first_match_rank is None:
+            first_match_rank = current_rank
 
-        # If no ground truth, skip
-        if not y_true:
-            continue
+    # 3. Calculate Metrics
 
-        # 2. Analyze Matches
-        # We map which TRUE diagnoses were found in the PRED list
-        found_indices = set()
-        first_match_rank = None  # For MRR
+    # Hybrid Recall@5: % of true diagnoses found
+    recall_score = len(found_indices) / len(y_true)
 
-        # Iterate through predictions (Order matters for Rank!)
-        for rank_idx, pred_item in enumerate(y_pred):
-            current_rank = rank_idx + 1  # 1-based rank
+    # Hybrid Hit Rate: Did we find at least one?
+    hit_rate = 1.0 if len(found_indices) > 0 else 0.0
 
-            # Check against ALL true items
-            is_this_pred_correct = False
+    # Hybrid MRR: 1 / Rank of first match
+    mrr_score = (1 / first_match_rank) if first_match_rank else 0.0
+
+    # Hybrid Top-1: Did the very first prediction match *any* truth?
+    # We can check if Rank 1 was the first match
+    top1_score = 1.0 if first_match_rank == 1 else 0.0
+
+    scores = {"top1": top1_score, "hit_rate": hit_rate, "recall": recall_score, "mrr": mrr_score}
+    result = {"case_id": row['case_id'], "y_true": y_true, "y_pred": y_pred}
+    # Only the requested metrics: the cells the others depend on may not have been judged
+    result.update({METRICS[metric][1]: scores[metric] for metric in METRICS if metric in args.metrics})
+    if args.full_matrix:
+        result["match_matrix"] = matches  # Every cell's verdict, for audits
+    return result
+
+
+# Score every case in file order, serially or on a thread pool (results are returned in file order either way)
+def evaluate_cases(evaluator, cases_df, pool=None):
+    # Sanity check: Ensure no missing ground-truth diagnoses
+    assert cases_df["diagnosis"].notna().all(), "Missing ground-truth diagnoses detected"
+
+    rows = [row for _, row in cases_df.iterrows()]
+    if pool is None:
+        scored = (evaluate_case(evaluator, row) for row in rows)
+    else:
+        scored = pool.map(lambda row: evaluate_case(evaluator, row), rows)
+    return [result for result in tqdm(scored, total=len(rows)) if result is not None]
 
-            for true_idx, true_item in enumerate(y_true):
-                # THE HYBRID CHECK
-                if evaluator.check_match(true_item, pred_item):
-                    is_this_pred_correct = True
-                    found_indices.add(true_idx)
 
-            # If this prediction was a match, and it's the first one we've seen...
-            if is_this_pred_correct and first_match_rank is None:
-                first_match_rank = current_rank
+# Evaluator with this run's tiers and judge settings; keyword arguments override them
+def new_evaluator(**settings):
+    options = dict(fuzzy_threshold=FUZZY_THRESHOLD, llm_model=JUDGE_MODEL, telemetry=telemetry,
+                   experiment=os.path.basename(model_results_path), cache=judge_cache, batch=args.judge_mode == "batch",
+                   fuzzy_scores=fuzzy_scores, index=diagnosis_index, embeddings=embedding_tier,
+                   metrics=None if args.full_matrix else args.metrics)
+    options.update(settings)
+    return HybridEvaluator(**options)
 
-        # 3. Calculate Metrics
 
-        # Hybrid Recall@5: % of true diagnoses found
-        recall_score = len(found_indices) / len(y_true)
+# Re-score the cases serially (verdicts now come from the judge cache) and require identical per-case results
+def check_determinism(evaluator, cases_df, results):
+    # A failed call is not cached, so the serial pass would ask the judge again and could get a different verdict
+    failed = sum(evaluator.failures.values())
+    if failed:
+        raise AssertionError(f"Determinism check not possible: {failed} judge calls failed in the concurrent pass "
+                             f"(cases {sorted(evaluator.failures)}); rerun once the judge answers reliably")
 
-        # Hybrid Hit Rate: Did we find at least one?
-        hit_rate = 1.0 if len(found_indices) > 0 else 0.0
+    # Separate evaluator, so the serial pass does not add to the run's judge call, tier and telemetry totals
+    checker = new_evaluator(telemetry=None)
+    serial = evaluate_cases(checker, cases_df)
+    with judge_cache.lock:
+        judge_cache.hits -= checker.tier_hits["cache"]  # Re-reads of this run's verdicts are not reported as cache hits
+    if checker.llm_calls or checker.failures:
+        raise AssertionError(f"Serial pass needed {checker.llm_calls} judge calls for cells the concurrent pass "
+                             f"did not judge (cases {sorted(checker.failures)} failed)")
+    mismatched = [a["case_id"] for a, b in zip(results, serial) if a != b]
+    if len(serial) != len(results) or mismatched:
+        raise AssertionError(f"Concurrent and serial results differ for cases {mismatched} "
+                             f"({len(results)} vs {len(serial)} scored cases)")
+    print(f"Determinism check passed: {len(results)} cases identical to the serial path (all verdicts from the "
+          f"local tiers and the judge cache).")
 
-        # Hybrid MRR: 1 / Rank of first match
-        mrr_score = (1 / first_match_rank) if first_match_rank else 0.0
 
-        # Hybrid Top-1: Did the very first prediction match *any* truth?
-        # We can check if Rank 1 was the first match
-        top1_score = 1.0 if first_match_rank == 1 else 0.0
+# Per-case digests of everything the scores depend on (see llm_pipeline/eval_manifest.py)
+def case_digests(cases_df):
+    return {case_id: case_digest(parse_ground_truth_diagnoses(true_str), parse_model_predicted_diagnoses(pred_str), run_config)
+            for case_id, true_str, pred_str in zip(cases_df["case_id"], cases_df[COL_TRUE], cases_df[COL_PRED])}
 
-        results.append({
-            "case_id": row['case_id'],
-            "y_true": y_true,
-            "y_pred": y_pred,
-            "hybrid_top1": top1_score,
-            "hybrid_hit_rate": hit_rate,
-            "hybrid_recall": recall_score,
-            "hybrid_mrr": mrr_score
-        })
+
+def manifest_path(model, shard=None):
+    if shard is None:
+        return f"{detailed_results_path}manifests/{model}_manifest.json"
+    return f"{manifest_shard_prefix(model)}_{shard_suffix(shard)}.json"
+
+
+def manifest_shard_prefix(model):
+    return f"{detailed_results_path}manifests/shards/{model}_manifest"
+
+
+# Cases of a model file whose digest differs from the last run's manifest (all of them with --rescore-all)
+def changed_cases(model, cases_df):
+    previous = {} if args.rescore_all else load_manifest(manifest_path(model))
+    digests = case_digests(cases_df)
+    changed = [previous.get(str(case_id), {}).get("digest") != digests[case_id] for case_id in cases_df["case_id"]]
+    return cases_df[changed], previous, digests
+
+
+# Evaluate one model file; returns (final_df, results_df)
+def evaluate_model(model, cases_df, pool=None):
+    # Only new or changed cases are scored; the others come from the manifest of the last run
+    pending_df, previous, digests = pending_cases[model]
+
+    # Initialize Evaluator
+    evaluator = new_evaluator()
+
+    # Iterate through DataFrame
+    print(f"Starting evaluation for {model}: scoring {len(pending_df)} of {len(cases_df)} cases "
+          f"({len(cases_df) - len(pending_df)} unchanged since the last run)...")
+    scored = evaluate_cases(evaluator, pending_df, pool)
+    if args.check_determinism:
+        check_determinism(evaluator, pending_df, scored)
+
+    # Merge the fresh results with the unchanged ones, in file order, and record them all for the next run
+    scored = {result["case_id"]: result for result in scored}
+    pending_ids = set(pending_df["case_id"])
+    results, entries = [], {}
+    for case_id in cases_df["case_id"]:
+        result = scored.get(case_id) if case_id in pending_ids else previous[str(case_id)]["result"]
+        # Cases with a failed (uncached) judge call stay out of the manifest, so the next run scores them again
+        if case_id not in evaluator.failures:
+            entries[str(case_id)] = {"digest": digests[case_id], "result": result}  # result None: no ground truth
+        if result is not None:
+            results.append(result)
+    save_manifest(manifest_path(model, shard), entries)
+    if evaluator.failures:
+        print(f"{len(evaluator.failures)} cases had failed judge calls (scored as no match for now); "
+              f"the next run scores them again.")
 
     results_df = pd.DataFrame(results)
     final_df = cases_df.merge(results_df, on="case_id", how="left", suffixes=("", "_eval"))
-    print(f"Done! Made {evaluator.llm_calls} calls to LLM.")
+    print(f"Done! Made {evaluator.llm_calls} calls to LLM for {model} ({judge_cache.hits} judge cache hits so far, "
+          f"{evaluator.skipped_cells} cells skipped as irrelevant to the metrics).")
+    print("Pairs resolved without a judge call: " + ", ".join(f"{tier} {count}" for tier, count in evaluator.tier_hits.items()))
+    return final_df, results_df
+
+
+# Fuzzy score matrix and the verdicts of the later tiers for every (true, pred) cell of one case; None without ground truth
+def sweep_case(evaluator, row):
+    y_true = parse_ground_truth_diagnoses(row[COL_TRUE])
+    y_pred = parse_model_predicted_diagnoses(row[COL_PRED])
+    if not y_true:
+        return None
+    verdicts = evaluator.match_matrix(y_true, y_pred, case_id=row['case_id'])
+    scores = [[fuzzy_scores.score(t.lower().strip(), p.lower().strip()) for p in y_pred] for t in y_true]
+    return scores, verdicts
+
+
+# Metrics of one model file for every threshold of the sweep, from a single scoring pass; returns a tidy DataFrame
+def sweep_model(model, cases_df, pool=None):
+    # Every cell below the highest threshold is resolved by the index, cache, embeddings or judge (no metric-based
+    # skipping); cells at or above it match at every threshold of the sweep anyway
+    low, high = args.sweep_range
+    evaluator = new_evaluator(fuzzy_threshold=high, metrics=None)
+    print(f"Threshold sweep for {model}: scoring {len(cases_df)} cases once for thresholds {low}-{high}...")
+    rows = [row for _, row in cases_df.iterrows()]
+    matrices = (sweep_case(evaluator, row) for row in rows) if pool is None \
+        else pool.map(lambda row: sweep_case(evaluator, row), rows)
+    cases = [case for case in tqdm(matrices, total=len(rows)) if case is not None]
+    print(f"Done! Made {evaluator.llm_calls} calls to LLM for {model} ({judge_cache.hits} judge cache hits so far).")
+    return sweep_table(model, cases, thresholds=list(range(low, high + 1)),
+                       labels={metric: label for metric, (label, _) in METRICS.items()})
+
+
+# Output folders for the summary and detailed results
+summary_stats_path = "../../../../results/top_5_accuracy/accuracy_metrics/memorization_experiment/summarized_results/"
+detailed_results_path = "../../../../results/top_5_accuracy/accuracy_metrics/memorization_experiment/detailed_results/"
 
-    # 1. Aggregate Statistics
-    stats = {
-        "Metric": ["Top-1 Accuracy", "Top-5 Accuracy", "Recall@5", "Mean Reciprocal Rank"],
-        "Score": [
-            results_df['hybrid_top1'].mean(),
-            results_df['hybrid_hit_rate'].mean(),
-            results_df['hybrid_recall'].mean(),
-            results_df['hybrid_mrr'].mean()
-        ]
-    }
-    stats_df = pd.DataFrame(stats)
+# Load cases from JSON to Pandas DataFrame
+model_results_path = "../../../../results/top_5_accuracy/predicted_diagnoses/memorization_experiment/fictitious_only"
+models = [f for f in os.listdir(model_results_path) if f.endswith(".json")]  # Skip sub-folders such as shards/
+
+# Evaluator settings; together with each case's diagnoses they decide whether a case has to be scored again
+FUZZY_THRESHOLD = 90
+JUDGE_MODEL = "gpt-5-mini"
+
+# Judge verdicts persist across models and reruns, so re-evaluating only pays for pairs never judged before
+judge_cache = JudgeCache(":memory:" if args.no_judge_cache else args.judge_cache_path)
+
+# Local ICD-10/DSM-5-TR canonicalization tier (opt-in, since it can disagree with the judge on borderline pairs)
+diagnosis_index = DiagnosisIndex() if args.diagnosis_index else None
+
+# Local sentence-embedding tier (opt-in; skipped with a message when sentence-transformers is unavailable)
+embedding_tier = None
+if args.embedding_tier or args.embedding_shadow:
+    encoder = load_sentence_encoder(args.embedding_model)
+    if encoder is not None:
+        embedding_tier = EmbeddingTier(encoder, accept=args.embedding_accept, reject=args.embedding_reject,
+                                       shadow=args.embedding_shadow, model_name=args.embedding_model)
+
+# Everything besides the diagnoses that changes a case's scores (recorded in the per-case manifest)
+run_config = {
+    "fuzzy_threshold": FUZZY_THRESHOLD,
+    "judge_model": JUDGE_MODEL,
+    "prompt_version": prompt_version(BATCH_JUDGE_PROMPT if args.judge_mode == "batch" else JUDGE_PROMPT),
+    "diagnosis_index": diagnosis_index.version if diagnosis_index is not None else None,
+    "embedding": None if embedding_tier is None or embedding_tier.shadow
+                 else [embedding_tier.model_name, embedding_tier.accept, embedding_tier.reject],
+    "metrics": sorted(args.metrics),
+    "full_matrix": args.full_matrix,
+}
+
+# Optional worker pool shared by every model file; the judge cache deduplicates pairs that are in flight
+pool = ThreadPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+evaluated = {}  # model -> (final_df, results_df) when the files are evaluated concurrently
+
+
+def load_cases(model):
+    # Load model results to a Pandas DataFrame
+    with open(os.path.join(model_results_path, model), 'r') as f:
+        return pd.DataFrame(json.load(f))
+
+
+if args.threshold_sweep:
+    # One scoring pass over every case of every model; the metrics of each threshold are derived from it
+    all_cases = {model: load_cases(model) for model in models}
+    fuzzy_scores = FuzzyScores.from_cases(all_cases.values(), workers=args.fuzzy_workers)
+    if embedding_tier is not None:
+        embedding_tier.encode([text for pair in fuzzy_scores.scores for text in pair])
+    sweep = pd.concat([sweep_model(model, cases_df, pool) for model, cases_df in all_cases.items()], ignore_index=True)
+    sweep.to_csv(f"{summary_stats_path}threshold_sweep.csv", index=False)
+    print(f"Saved threshold sweep to '{summary_stats_path}threshold_sweep.csv'")
+    for model, rows in sweep.groupby("model", sort=False):
+        if plot_sweep(rows, f"{summary_stats_path}{model}_threshold_sweep.png", current_threshold=FUZZY_THRESHOLD):
+            print(f"Saved threshold sweep plot to '{summary_stats_path}{model}_threshold_sweep.png'")
+
+elif not args.merge_shards:
+    # Only evaluate this task's shard of the cases (all cases when not sharded)
+    shard_cases = {model: select_shard(load_cases(model), shard) for model in models}
+    pending_cases = {model: changed_cases(model, cases_df) for model, cases_df in shard_cases.items()}
+
+    # Fuzzy tier for every pair of the run at native speed; only pairs below the threshold reach the judge
+    start = time.perf_counter()
+    fuzzy_scores = FuzzyScores.from_cases([pending_df for pending_df, _, _ in pending_cases.values()],
+                                          workers=args.fuzzy_workers)
+    print(f"Fuzzy tier: scored {len(fuzzy_scores.scores)} unique pairs in {time.perf_counter() - start:.2f}s.")
+
+    if embedding_tier is not None:
+        # Embed every diagnosis string of the run in one batch; vectors are memoized for the whole run
+        start = time.perf_counter()
+        embedding_tier.encode([text for pair in fuzzy_scores.scores for text in pair])
+        print(f"Embedding tier: embedded {len(embedding_tier.vectors)} unique diagnoses in {time.perf_counter() - start:.2f}s.")
+
+    if pool is not None and args.parallel_files:
+        with ThreadPoolExecutor(max_workers=len(models) or 1) as files_pool:
+            evaluated = dict(zip(models, files_pool.map(
+                lambda model: evaluate_model(model, shard_cases[model], pool), models)))
+
+# Evaluate all models inside the folder (the threshold sweep above writes its own outputs instead)
+scored = {}  # model -> per-case results, for the bootstrap CIs once every model is done
+for model in ([] if args.threshold_sweep else models):
+    cases_df = load_cases(model)
+    shard_prefix = f"{detailed_results_path}shards/{model}_diagnostic_evaluation_results_detailed"
+
+    if args.merge_shards:
+        # Combine the detailed results of every shard; each case must be covered exactly once
+        shard_paths = find_shard_files(shard_prefix, ".csv", args.num_shards)
+        final_df = pd.concat([pd.read_csv(path) for path in shard_paths], ignore_index=True)
+        check_coverage(cases_df["case_id"].tolist(), final_df["case_id"].tolist())
+        final_df = cases_df[["case_id"]].merge(final_df, on="case_id", how="left")  # Back to the original case order
+        print(f"Merged {len(shard_paths)} shards for {model}.")
+        try:
+            # The merged manifest lets the next full or sharded run reuse every unchanged case
+            merge_manifests(find_shard_files(manifest_shard_prefix(model), ".json", args.num_shards), manifest_path(model))
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Manifest not merged ({e}); the next run scores {model} from scratch.")
+        scored[model] = final_df.dropna(subset=["y_true"])  # Cases without ground truth were not scored
+        save_results(model, final_df, scored[model])
+        continue
+
+    if model in evaluated:
+        final_df, results_df = evaluated[model]
+    else:
+        final_df, results_df = evaluate_model(model, shard_cases[model], pool)
 
-    # Display nicely formatted percentages
-    print("\n=== FINAL DIAGNOSTIC PERFORMANCE (Mean Scores) ===")
-    stats_df.style.format({"Score": "{:.2%}"})
+    if shard is not None:
+        # Summary metrics are only computed once all shards are merged
+        os.makedirs(os.path.dirname(shard_prefix), exist_ok=True)
+        final_df.to_csv(f"{shard_prefix}_{shard_suffix(shard)}.csv", index=False)
+        print(f"Saved shard results to '{shard_prefix}_{shard_suffix(shard)}.csv'")
+        continue
 
-    # Export summary statistics to CSV
-    summary_stats_path = "../../../../results/top_5_accuracy/accuracy_metrics/memorization_experiment/summarized_results/"
-    stats_df.to_csv(f"{summary_stats_path}{model}_diagnostic_performance_summary.csv", index=False)
-    print(f"\nSaved performance summary to '{summary_stats_path}{model}_diagnostic_performance_summary.csv'")
+    scored[model] = results_df
+    save_results(model, final_df, results_df)
 
-    # 2. Inspecting Failures
-    # Return rows where Hit Rate was 0 (Total Misses)
-    misses = final_df[final_df['hybrid_hit_rate'] == 0]
-    print(f"\nTotal Cases Completely Missed: {len(misses)}")
-    if len(misses) > 0:
-        print("Example Miss:")
-        print(misses[[COL_TRUE, COL_PRED]].iloc[0])
+if pool is not None:
+    pool.shutdown()
 
-    # 3. Export detailed results to CSV
-    detailed_results_path = "../../../../results/top_5_accuracy/accuracy_metrics/memorization_experiment/detailed_results/"
-    final_df.to_csv(f"{detailed_results_path}{model}_diagnostic_evaluation_results_detailed.csv", index=False)
-    print(f"\nSaved detailed results to '{detailed_results_path}{model}_diagnostic_evaluation_results_detailed.csv'")
\ No newline at end of file
+# Uncertainty of every summary metric and of every model-vs-model difference (paired on the same cases)
+if scored and args.bootstrap_resamples > 0:
+    write_bootstrap(scored, summary_stats_path, metrics={column: label for label, column in METRICS.values()},
+                    resamples=args.bootstrap_resamples, seed=args.bootstrap_seed)
+
+# Agreement of the embedding thresholds with every judge verdict seen in this run
+if embedding_tier is not None:
+    calibration_suffix = f"_{shard_suffix(shard)}" if shard is not None else ""
+    report_calibration(embedding_tier, f"{detailed_results_path}embedding_calibration{calibration_suffix}.csv")
+
+# Connection reuse across all judge calls of this run
+report_connection_stats()
@@ -1,95 +1,110 @@
 # Generate top-5 differential diagnoses (n=196) using Claude Opus 4.5
-import json
-import pandas as pd
-from tqdm import tqdm
-import anthropic
+import sys
 from dotenv import load_dotenv
-import datetime
+
+sys.path.append("..")  # Make the shared llm_pipeline package importable
+from llm_pipeline.adapters import AnthropicAdapter
+from llm_pipeline.batch_mode import AnthropicBatchBackend
+from llm_pipeline.http_clients import anthropic_client, configure_pool_from_args, report_connection_stats
+from llm_pipeline.runner import build_arg_parser, load_dataset, load_prompts, generate_dataset, generate_dataset_batch, open_cache, open_checkpoint, open_rate_limits, open_telemetry, open_hedging, open_circuit_breaker, estimate_dataset, save_predictions, merge_shards
+from llm_pipeline.estimator import print_estimate
+from llm_pipeline.sharding import resolve_shard, select_shard
 
 # Load API key from .env file
 load_dotenv()
 
+# Parse command-line options
+parser = build_arg_parser("Generate top-5 differential diagnoses using Claude Opus 4.5", batch=True)
+parser.add_argument("--max-tokens", type=int, default=20000,
+                    help="Max output tokens (Claude Opus 4.5 allows 64k; above ~21k requires --stream or --batch)")
+parser.add_argument("--thinking-budget", type=int, default=19000,
+                    help="Extended thinking budget; must be smaller than --max-tokens")
+args = parser.parse_args()
+if args.max_tokens > 21333 and not (args.stream or args.batch):
+    parser.error("--max-tokens above 21333 requires --stream (or --batch); non-streaming calls this long are rejected by the SDK")
+if args.thinking_budget >= args.max_tokens:
+    parser.error("--thinking-budget must be smaller than --max-tokens")
+
+# Pooled HTTP connections shared by every API client in this process (keep-alive, HTTP/2 when available)
+configure_pool_from_args(args)
+
 # Import the vignette dataset
 dataset_path = "../../../datasets/combined/combined_jama.json"
-dataset_name = str(dataset_path).split("/")[-1].split(".")[0]  # Extract the dataset name
-with open(dataset_path, "r") as f:
-    combined = json.load(f)
-dataset = pd.DataFrame(combined)  # Convert to DataFrame
+dataset_name, dataset = load_dataset(dataset_path)
+
+# Restrict this run to one shard of the cases (--shard-index/--num-shards or a Slurm array task)
+shard = resolve_shard(args)
+dataset = select_shard(dataset, shard)
+
+# Predicted diagnoses (and the JSONL checkpoint used by --resume) are written here
+output_dir = "../../../results/top_5_accuracy/predicted_diagnoses"
 
 # Define system instructions and user prompt
-with open("../../prompts/top_5_accuracy/system_prompt.txt") as f:
-    system_prompt = f.read()
-
-with open("../../prompts/top_5_accuracy/user_prompt.txt") as f:
-    user_prompt = f.read()
-
-
-# Generate differential diagnosis for one case using Claude Opus 4.5
-def generate_top5_diagnoses(client, model, system_prompt, user_prompt, vignette):
-    # Prepare API call parameters
-    # Anthropic Claude: Make API call and create response object
-    if model.startswith("claude"):
-        response = client.messages.create(
-            model=model,
-            max_tokens=20000,  # Max output for Claude Opus 4.5 is 64k but >20k requires streaming
-            system=system_prompt,
-            # Extended thinking mode is not compatible with temperature, top_p, or top_k sampling
-            thinking={
-                "type": "enabled",
-                "budget_tokens": 19000  # Allocate tokens for thinking - model may not use entire budget
-            },
-            messages=[
-                {
-                    "role": "user", 
-                    "content": user_prompt + "\n<vignette>\n" + vignette + "\n</vignette>"
-                }
-            ]
-        )
-
-        # Handle model refusal to answer
-        if response.stop_reason == "refusal":
-            reasoning = "N/A"
-            answer = "Model refused to answer the prompt."
-            return reasoning, answer
-
-        # Extract the response content
-        for block in response.content:
-            if block.type == "text":  # Extract differential diagnosis block
-                answer = block.text
-            elif block.type == "thinking":  # Extract summarized thinking block
-                reasoning = block.thinking
-            elif block.type == "redacted_thinking":  # Handle redacted thinking block
-                print(f"Redacted thinking detected for \"{vignette[:30]}...\"")
-                reasoning = block.thinking
-
-    return reasoning, answer
-
-
-# Initialize Anthropic client
-anthropic_client = anthropic.Anthropic()
+system_prompt, user_prompt = load_prompts("../../prompts/top_5_accuracy")
+
+# Initialize Anthropic async client (SDK retries disabled; the engine retries instead)
 model = "claude-opus-4-5-20251101"
+adapter = AnthropicAdapter(anthropic_client(max_retries=0),
+                           model,
+                           max_tokens=args.max_tokens,  # Max output for Claude Opus 4.5 is 64k but >~21k requires streaming
+                           thinking_budget=args.thinking_budget,  # Allocate tokens for thinking - model may not use entire budget
+                           # Temperature not compatible with extended thinking mode
+                           prompt_caching=not args.no_prompt_caching,  # Shared system/user prompt prefix is cached across vignettes
+                           stream=args.stream,  # Assemble thinking/text blocks from the event stream (needed for large budgets)
+                           )
+
+# Predict tokens, cost and wall time from past runs (telemetry, earlier result files); --dry-run stops here
+estimate = estimate_dataset(args, dataset, system_prompt, user_prompt, model)
+if args.dry_run:
+    print_estimate(estimate)
+    sys.exit(0)
+
+# Open the on-disk response cache (reused only with --reuse-cache; cached refusals/filter hits are always reused)
+cache = open_cache(args, adapter)
+
+# Client-side rate limits and inline retries (backoff with jitter, Retry-After aware)
+rate_limiter, retry_policy = open_rate_limits(args)
+
+# Append every completed case to a crash-safe checkpoint (continued with --resume)
+checkpoint = open_checkpoint(args, output_dir, model, dataset_name, shard)
+
+# Record latency, queue wait, tokens and estimated cost of every call (report: python -m llm_pipeline.telemetry report)
+telemetry = open_telemetry(args)
+
+# Optionally hedge the slowest calls with a duplicate request (--hedge-percentile; capped by --hedge-budget/--hedge-max-cost)
+hedge_policy = open_hedging(args, model, telemetry)
+
+# Pause this model's queue while its endpoint keeps failing (--breaker-threshold/--breaker-cooldown, --no-circuit-breaker)
+circuit_breaker = open_circuit_breaker(args, adapter)
 
 print("***********************************************")
 print(f"Processing model {model} on dataset {dataset_name}...")
 
-# Process each case sequentially
-pbar = tqdm(dataset.iterrows(), total=dataset.shape[0])  # Progress bar for tracking
-
-for index, row in pbar:
-    pbar.set_description(f"Generating differential diagnoses for case {index + 1} out of {dataset.shape[0]} (case {row['case_id']})")
-    reasoning, answer = generate_top5_diagnoses(anthropic_client,
-                                                model,
-                                                system_prompt,
-                                                user_prompt,
-                                                row["vignette"],
-                                                # Temperature not compatible with extended thinking mode
-                                                )
-    dataset.loc[index, "model_thoughts"] = reasoning
-    dataset.loc[index, "model_diagnosis"] = answer
-    print(f"Completed case {index + 1} out of {dataset.shape[0]} (case {row['case_id']}).")
-
-# Save to a JSON file
-output_path = f"../../../results/top_5_accuracy/predicted_diagnoses/predicted_diagnoses_{model}_{dataset_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-dataset.to_json(output_path, orient="records", indent=2)
+if args.merge_shards:
+    # Combine the shard outputs of a Slurm array job (checks that every case is covered exactly once)
+    dataset = merge_shards(dataset, model, dataset_name, output_dir, num_shards=args.num_shards)
+elif args.batch:
+    # Submit all remaining cases through the Anthropic Message Batches API (lower price, higher rate limits)
+    dataset = generate_dataset_batch(AnthropicBatchBackend(anthropic_client(async_=False)),
+                                     adapter, dataset, system_prompt, user_prompt,
+                                     poll_interval=args.batch_poll_interval,
+                                     cache=cache, reuse_cache=args.reuse_cache,
+                                     checkpoint=checkpoint,
+                                     telemetry=telemetry, experiment=args.experiment or dataset_name,
+                                     reuse_terminal=not args.retry_refusals)
+else:
+    # Process all remaining cases concurrently; failed or empty responses are retried inline
+    dataset = generate_dataset(adapter, dataset, system_prompt, user_prompt, max_concurrency=args.max_concurrency,
+                               cache=cache, reuse_cache=args.reuse_cache,
+                               checkpoint=checkpoint,
+                               rate_limiter=rate_limiter, retry_policy=retry_policy,
+                               telemetry=telemetry, experiment=args.experiment or dataset_name,
+                               hedge_policy=hedge_policy, circuit_breaker=circuit_breaker,
+                               reuse_terminal=not args.retry_refusals,
+                               schedule=None if args.file_order else estimate.seconds)  # Longest-expected cases first
+
+# Save to a JSON file (built from the checkpoint)
+output_path = save_predictions(dataset, model, dataset_name, output_dir, shard=shard)
 print("***********************************************")
 print(f"{model} predicted diagnoses for calculation of top-5 accuracy saved to JSON.")
+report_connection_stats()
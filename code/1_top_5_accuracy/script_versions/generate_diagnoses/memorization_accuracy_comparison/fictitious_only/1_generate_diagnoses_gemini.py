@@ -1,100 +1,89 @@
 # Generate top-5 differential diagnoses (n=196) using Gemini 3 Pro
-import json
-import pandas as pd
-from tqdm import tqdm
-from google import genai
-from google.genai import types
+import sys
 from dotenv import load_dotenv
-import datetime
+
+sys.path.append("../../..")  # Make the shared llm_pipeline package importable
+from llm_pipeline.adapters import GeminiAdapter
+from llm_pipeline.http_clients import configure_pool_from_args, gemini_client, report_connection_stats
+from llm_pipeline.runner import build_arg_parser, load_dataset, load_prompts, generate_dataset, open_cache, open_checkpoint, open_rate_limits, open_telemetry, open_hedging, open_circuit_breaker, estimate_dataset, save_predictions, merge_shards
+from llm_pipeline.estimator import print_estimate
+from llm_pipeline.sharding import resolve_shard, select_shard
 
 # Load API key from .env file
 load_dotenv()
 
+# Parse command-line options
+args = build_arg_parser("Generate top-5 differential diagnoses using Gemini 3 Pro").parse_args()
+
+# Pooled HTTP connections shared by every API client in this process (keep-alive, HTTP/2 when available)
+configure_pool_from_args(args)
+
 # Import the vignette dataset
 dataset_path = "../../../../../../datasets/combined/fictitious_only.json"
-dataset_name = str(dataset_path).split("/")[-1].split(".")[0]  # Extract the dataset name
-with open(dataset_path, "r") as f:
-    combined = json.load(f)
-dataset = pd.DataFrame(combined)  # Convert to DataFrame
+dataset_name, dataset = load_dataset(dataset_path)
 
-# Define system instructions and user prompt
-with open("../../../../../prompts/top_5_accuracy/system_prompt.txt") as f:
-    system_prompt = f.read()
+# Restrict this run to one shard of the cases (--shard-index/--num-shards or a Slurm array task)
+shard = resolve_shard(args)
+dataset = select_shard(dataset, shard)
 
-with open("../../../../../prompts/top_5_accuracy/user_prompt.txt") as f:
-    user_prompt = f.read()
+# Predicted diagnoses (and the JSONL checkpoint used by --resume) are written here
+output_dir = "../../../../../../results/top_5_accuracy/predicted_diagnoses"
 
+# Define system instructions and user prompt
+system_prompt, user_prompt = load_prompts("../../../../../prompts/top_5_accuracy")
 
-# Generate differential diagnosis for one case using Gemini 3 Pro
-def generate_top5_diagnoses(client, model, system_prompt, user_prompt, vignette, temperature):
-    response = client.models.generate_content(
-                model=model,
-                contents=user_prompt + "\n<vignette>\n" + vignette + "\n</vignette>",  # User prompt with inserted vignette
-                config=types.GenerateContentConfig(
-                    thinking_config=types.ThinkingConfig(
-                        thinking_level="high",  # Use thinking_level for Gemini 3, not thinking_budget since it may result in subpar performance
-                        include_thoughts=True  # Include thought summaries in parts/thought within `response` parameters
-                        ),
-                    system_instruction=system_prompt,  # System prompt
-                    temperature=temperature  # Model temperature
-                ),
-            )
-
-    # Handle content filter triggering
-    prompt_feedback = getattr(response, "prompt_feedback", None)  # Check if prompt_feedback exists
-    if prompt_feedback and getattr(prompt_feedback, "block_reason", None):  # If block_reason exists within prompt_feedback
-        block_reason = prompt_feedback.block_reason  # Get the block_reason object
-        block_name = block_reason.name if getattr(block_reason, "name", None) else str(block_reason)  # Safely get the name attribute or convert to string
-        print("Content filter triggered:", block_name)
-        print("Skipping case...")
-        reasoning = "Content filter triggered."
-        answer = "Content filter triggered."
-        return reasoning, answer
-
-    # Iterate through response object to extract thought summary and differential diagnosis list
-    for part in response.parts:
-        if not part.text:
-            continue
-        if part.thought:
-            reasoning = part.text  # Extract thought summary
-        else:
-            answer = part.text  # Extract differential diagnosis list
-
-    return reasoning, answer
-
-
-# Initialize Gemini 3 Pro client
-google_client = genai.Client()
+# Initialize Gemini 3 Pro async client (on the shared connection pool)
 model = "gemini-3-pro-preview"
+adapter = GeminiAdapter(gemini_client().aio,
+                        model,
+                        thinking_level="high",  # Use thinking_level for Gemini 3, not thinking_budget since it may result in subpar performance
+                        temperature=1,  # Google advises keeping temperature at 1 for Gemini 3 to avoid messing with reasoning behavior
+                        stream=args.stream,  # Stream the response (avoids HTTP read timeouts on long reasoning calls)
+                        )
+
+# Predict tokens, cost and wall time from past runs (telemetry, earlier result files); --dry-run stops here
+estimate = estimate_dataset(args, dataset, system_prompt, user_prompt, model)
+if args.dry_run:
+    print_estimate(estimate)
+    sys.exit(0)
+
+# Open the on-disk response cache (reused only with --reuse-cache; cached refusals/filter hits are always reused)
+cache = open_cache(args, adapter)
+
+# Client-side rate limits and inline retries (backoff with jitter, Retry-After aware)
+rate_limiter, retry_policy = open_rate_limits(args)
+
+# Append every completed case to a crash-safe checkpoint (continued with --resume)
+checkpoint = open_checkpoint(args, output_dir, model, dataset_name, shard)
+
+# Record latency, queue wait, tokens and estimated cost of every call (report: python -m llm_pipeline.telemetry report)
+telemetry = open_telemetry(args)
+
+# Optionally hedge the slowest calls with a duplicate request (--hedge-percentile; capped by --hedge-budget/--hedge-max-cost)
+hedge_policy = open_hedging(args, model, telemetry)
+
+# Pause this model's queue while its endpoint keeps failing (--breaker-threshold/--breaker-cooldown, --no-circuit-breaker)
+circuit_breaker = open_circuit_breaker(args, adapter)
 
 print("***********************************************")
 print(f"Processing model {model} on dataset {dataset_name}...")
 
-# Process each case sequentially
-pbar = tqdm(dataset.iterrows(), total=dataset.shape[0])  # Progress bar for tracking
-
-for index, row in pbar:
-    pbar.set_description(f"Generating differential diagnoses for case {index + 1} out of {dataset.shape[0]} (case {row['case_id']})")
-    reasoning, answer = generate_top5_diagnoses(google_client,
-                                                model,
-                                                system_prompt,
-                                                user_prompt,
-                                                row["vignette"],
-                                                1,  # Google advises keeping temperature at 1 for Gemini 3 to avoid messing with reasoning behavior
-                                                )
-
-    if "Content filter triggered." in reasoning or "Content filter triggered." in answer:
-        dataset.loc[index, "model_thoughts"] = reasoning
-        dataset.loc[index, "model_diagnosis"] = answer
-        print(f"Content filter triggered for case {index + 1} out of {dataset.shape[0]} (case {row['case_id']}).")
-
-    else:
-        dataset.loc[index, "model_thoughts"] = reasoning
-        dataset.loc[index, "model_diagnosis"] = answer
-        print(f"Completed case {index + 1} out of {dataset.shape[0]} (case {row['case_id']}).")
-
-# Save to a JSON file
-output_path = f"../../../../../../results/top_5_accuracy/predicted_diagnoses/predicted_diagnoses_{model}_{dataset_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-dataset.to_json(output_path, orient="records", indent=2)
+if args.merge_shards:
+    # Combine the shard outputs of a Slurm array job (checks that every case is covered exactly once)
+    dataset = merge_shards(dataset, model, dataset_name, output_dir, num_shards=args.num_shards)
+else:
+    # Process all remaining cases concurrently; failed or empty responses are retried inline
+    dataset = generate_dataset(adapter, dataset, system_prompt, user_prompt, max_concurrency=args.max_concurrency,
+                               cache=cache, reuse_cache=args.reuse_cache,
+                               checkpoint=checkpoint,
+                               rate_limiter=rate_limiter, retry_policy=retry_policy,
+                               telemetry=telemetry, experiment=args.experiment or dataset_name,
+                               hedge_policy=hedge_policy, circuit_breaker=circuit_breaker,
+                               reuse_terminal=not args.retry_refusals,
+                               schedule=None if args.file_order else estimate.seconds)  # Longest-expected cases first
+
+# Save to a JSON file (built from the checkpoint)
+output_path = save_predictions(dataset, model, dataset_name, output_dir, shard=shard)
 print("***********************************************")
 print(f"{model} predicted diagnoses for calculation of top-5 accuracy saved to JSON.")
+report_connection_stats()
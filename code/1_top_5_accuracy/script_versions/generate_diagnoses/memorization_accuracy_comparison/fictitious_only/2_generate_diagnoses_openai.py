@@ -1,158 +1,102 @@
 # Generate top-5 differential diagnoses (n=196) using GPT-5.2
-import json
-import os
-import pandas as pd
-from tqdm import tqdm
-from openai import OpenAI
+import sys
 from dotenv import load_dotenv
-import datetime
+
+sys.path.append("../../..")  # Make the shared llm_pipeline package importable
+from llm_pipeline.adapters import OpenAIAdapter
+from llm_pipeline.batch_mode import OpenAIBatchBackend
+from llm_pipeline.http_clients import configure_pool_from_args, openai_client, report_connection_stats
+from llm_pipeline.runner import build_arg_parser, load_dataset, load_prompts, generate_dataset, generate_dataset_batch, open_cache, open_checkpoint, open_rate_limits, open_telemetry, open_hedging, open_circuit_breaker, estimate_dataset, save_predictions, merge_shards
+from llm_pipeline.estimator import print_estimate
+from llm_pipeline.sharding import resolve_shard, select_shard
 
 # Load API key from .env file
 load_dotenv()
 
+# Parse command-line options
+args = build_arg_parser("Generate top-5 differential diagnoses using GPT-5.2", batch=True).parse_args()
+
+# Pooled HTTP connections shared by every API client in this process (keep-alive, HTTP/2 when available)
+configure_pool_from_args(args)
+
 # Import the vignette dataset
 dataset_path = "../../../../../../datasets/combined/fictitious_only.json"
-dataset_name = str(dataset_path).split("/")[-1].split(".")[0]  # Extract the dataset name
-with open(dataset_path, "r") as f:
-    combined = json.load(f)
-dataset = pd.DataFrame(combined)  # Convert to DataFrame
+dataset_name, dataset = load_dataset(dataset_path)
+
+# Restrict this run to one shard of the cases (--shard-index/--num-shards or a Slurm array task)
+shard = resolve_shard(args)
+dataset = select_shard(dataset, shard)
+
+# Predicted diagnoses (and the JSONL checkpoint used by --resume) are written here
+output_dir = "../../../../../../results/top_5_accuracy/predicted_diagnoses"
 
 # Define system instructions and user prompt
-with open("../../../../../prompts/top_5_accuracy/system_prompt.txt") as f:
-    system_prompt = f.read()
-
-with open("../../../../../prompts/top_5_accuracy/user_prompt.txt") as f:
-    user_prompt = f.read()
-
-
-# Generate differential diagnosis for one case using GPT-5.2
-def generate_top5_diagnoses(client, model: str, system_prompt: str, user_prompt: str, vignette: str) -> tuple:
-    # Prepare API call parameters
-    # OpenAI: Make API call and create response object
-    if model.startswith("gpt"):
-        response = client.responses.create(
-            model=model,  # gpt-5.2-pro is way too expensive; use gpt-5.2
-            reasoning={
-                "effort": "xhigh",  # Favors even more complete reasoning
-                "summary": "detailed"  # Give as much detail as possible in thinking block
-            },
-            text={
-                "verbosity": "low"  # To keep the model on task for diagnosis
-            },
-            input=[
-                {
-                    "role": "developer",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": user_prompt + "\n<vignette>\n" + vignette + "\n</vignette>"
-                }
-            ]
-        )
-
-    # Handle content filter triggering
-    prompt_feedback = getattr(response, "incomplete_details", None)
-    if prompt_feedback and getattr(prompt_feedback, "reason", None):
-        block_reason = prompt_feedback.reason
-        block_name = block_reason.name if getattr(block_reason, "name", None) else str(block_reason)
-        print("Content filter triggered:", block_name)
-        reasoning = "Content filter triggered."
-        answer = "Content filter triggered."
-        return reasoning, answer
-
-    # Extract reasoning and answer from response object
-    # Handle different output array lengths dynamically
-    if len(response.output) == 1:
-        # Only differential diagnosis present
-        reasoning = None
-        answer = response.output[0].content[0].text
-    elif len(response.output) >= 2:
-        # Extract the thought summary by concatenating all thinking blocks using newlines and a list comprehension
-        reasoning = "\n\n".join([block.text for block in response.output[0].summary])
-
-        # Extract the differential diagnosis list
-        answer = response.output[1].content[0].text
-    else:
-        # Handle unexpected cases
-        reasoning = None
-        answer = None
-
-    return reasoning, answer
-
-
-# Initialize Gemini 3 Pro client
-openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-model = "gpt-5.2"
+system_prompt, user_prompt = load_prompts("../../../../../prompts/top_5_accuracy")
+
+# Initialize OpenAI async client (SDK retries disabled; the engine retries instead)
+model = "gpt-5.2"  # gpt-5.2-pro is way too expensive; use gpt-5.2
+adapter = OpenAIAdapter(openai_client(max_retries=0),
+                        model,
+                        reasoning_effort="xhigh",  # Favors even more complete reasoning
+                        reasoning_summary="detailed",  # Give as much detail as possible in thinking block
+                        verbosity="low",  # To keep the model on task for diagnosis
+                        # Temperature not supported with reasoning effort set to high
+                        prompt_caching=not args.no_prompt_caching,  # Shared system/user prompt prefix is cached across vignettes
+                        stream=args.stream,  # Stream the response (avoids HTTP read timeouts on long reasoning calls)
+                        )
+
+# Predict tokens, cost and wall time from past runs (telemetry, earlier result files); --dry-run stops here
+estimate = estimate_dataset(args, dataset, system_prompt, user_prompt, model)
+if args.dry_run:
+    print_estimate(estimate)
+    sys.exit(0)
+
+# Open the on-disk response cache (reused only with --reuse-cache; cached refusals/filter hits are always reused)
+cache = open_cache(args, adapter)
+
+# Client-side rate limits and inline retries (backoff with jitter, Retry-After aware)
+rate_limiter, retry_policy = open_rate_limits(args)
+
+# Append every completed case to a crash-safe checkpoint (continued with --resume)
+checkpoint = open_checkpoint(args, output_dir, model, dataset_name, shard)
+
+# Record latency, queue wait, tokens and estimated cost of every call (report: python -m llm_pipeline.telemetry report)
+telemetry = open_telemetry(args)
+
+# Optionally hedge the slowest calls with a duplicate request (--hedge-percentile; capped by --hedge-budget/--hedge-max-cost)
+hedge_policy = open_hedging(args, model, telemetry)
+
+# Pause this model's queue while its endpoint keeps failing (--breaker-threshold/--breaker-cooldown, --no-circuit-breaker)
+circuit_breaker = open_circuit_breaker(args, adapter)
 
 print("***********************************************")
 print(f"Processing model {model} on dataset {dataset_name}...")
 
-# Process each case sequentially
-pbar = tqdm(dataset.iterrows(), total=dataset.shape[0])  # Progress bar for tracking
-
-for index, row in pbar:
-    pbar.set_description(f"Generating differential diagnoses for case {index + 1} out of {dataset.shape[0]} (case {row['case_id']})")
-    reasoning, answer = generate_top5_diagnoses(openai_client,
-                                                model,
-                                                system_prompt,
-                                                user_prompt,
-                                                row["vignette"],
-                                                # Temperature not supported with reasoning effort set to high 
-                                                )
-    dataset.loc[index, "model_thoughts"] = reasoning
-    dataset.loc[index, "model_diagnosis"] = answer
-    print(f"Completed case {index + 1} out of {dataset.shape[0]} (case {row['case_id']}).")
-
-# Check for missing or empty values and rerun until none remain
-max_iterations = 10  # Prevent infinite loop
-iteration = 0
-
-while iteration < max_iterations:
-    # Check for missing or empty values
-    missing_values = dataset[
-        (dataset["model_thoughts"].isnull()) | 
-        (dataset["model_thoughts"] == "") |
-        (dataset["model_diagnosis"].isnull()) | 
-        (dataset["model_diagnosis"] == "")
-    ]
-
-    if missing_values.empty:
-        print("No missing or empty values found in the results.")
-        break
-
-    iteration += 1
-    print(f"\n=== Iteration {iteration} ===")
-    print(f"Missing or empty values found in {len(missing_values)} cases:")
-    print(missing_values[["case_id", "model_thoughts", "model_diagnosis"]])
-
-    # Get all indices with missing values
-    missing_indices = missing_values.index.tolist()
-    print(f"Rerunning {len(missing_indices)} cases with missing data: {missing_indices}")
-
-    for index_to_rerun in missing_indices:
-        print(f"\nRerunning case {index_to_rerun} (case_id: {dataset.iloc[index_to_rerun]['case_id']})")
-        try:
-            reasoning, answer = generate_top5_diagnoses(openai_client,
-                                                            model,
-                                                            system_prompt,
-                                                            user_prompt,
-                                                            dataset.iloc[index_to_rerun]["vignette"],
-                                                        )
-
-            dataset.loc[index_to_rerun, "model_thoughts"] = reasoning
-            dataset.loc[index_to_rerun, "model_diagnosis"] = answer
-            print(f"Successfully completed case {index_to_rerun}")
-
-        except Exception as e:
-            print(f"Error processing case {index_to_rerun}: {str(e)}")
-            continue
-
-print(f"\nCompleted after {iteration} iteration(s).")
-
-
-# Save to a JSON file
-output_path = f"../../../../../../results/top_5_accuracy/predicted_diagnoses/predicted_diagnoses_{model}_{dataset_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-dataset.to_json(output_path, orient="records", indent=2)
+if args.merge_shards:
+    # Combine the shard outputs of a Slurm array job (checks that every case is covered exactly once)
+    dataset = merge_shards(dataset, model, dataset_name, output_dir, num_shards=args.num_shards)
+elif args.batch:
+    # Submit all remaining cases through the OpenAI Batch API (lower price, higher rate limits)
+    dataset = generate_dataset_batch(OpenAIBatchBackend(openai_client(async_=False)),
+                                     adapter, dataset, system_prompt, user_prompt,
+                                     poll_interval=args.batch_poll_interval,
+                                     cache=cache, reuse_cache=args.reuse_cache,
+                                     checkpoint=checkpoint,
+                                     telemetry=telemetry, experiment=args.experiment or dataset_name,
+                                     reuse_terminal=not args.retry_refusals)
+else:
+    # Process all remaining cases concurrently; failed or empty responses are retried inline
+    dataset = generate_dataset(adapter, dataset, system_prompt, user_prompt, max_concurrency=args.max_concurrency,
+                               cache=cache, reuse_cache=args.reuse_cache,
+                               checkpoint=checkpoint,
+                               rate_limiter=rate_limiter, retry_policy=retry_policy,
+                               telemetry=telemetry, experiment=args.experiment or dataset_name,
+                               hedge_policy=hedge_policy, circuit_breaker=circuit_breaker,
+                               reuse_terminal=not args.retry_refusals,
+                               schedule=None if args.file_order else estimate.seconds)  # Longest-expected cases first
+
+# Save to a JSON file (built from the checkpoint)
+output_path = save_predictions(dataset, model, dataset_name, output_dir, shard=shard)
 print("***********************************************")
 print(f"{model} predicted diagnoses for calculation of top-5 accuracy saved to JSON.")
+report_connection_stats()
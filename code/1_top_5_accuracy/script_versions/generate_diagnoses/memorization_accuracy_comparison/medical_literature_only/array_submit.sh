@@ -0,0 +1,21 @@
+#!/bin/bash
+# Run one generation script as a Slurm array job; each task handles one deterministic shard of the vignettes
+# (the shard index and count come from SLURM_ARRAY_TASK_ID / SLURM_ARRAY_TASK_COUNT, see llm_pipeline/sharding.py)
+#
+# Usage:
+#   sbatch --array=0-7 array_submit.sh 2_generate_diagnoses_openai.py [--max-concurrency 4 ...]
+#   sbatch --dependency=afterok:<array job id> array_submit.sh 2_generate_diagnoses_openai.py --merge-shards
+# Not named submit_*.sh so that mass_submit.sh does not pick it up
+
+#SBATCH --job-name=generate-array
+#SBATCH --time=1-
+#SBATCH --mail-type=ALL
+#SBATCH --mem=8G
+#SBATCH --partition=day
+#SBATCH --output=/gpfs/radev/project/xu_hua/kwj9/psychiatry_llm/evaluation_of_sota/jama_submission_12152025/psychiatry-frontier-llm-evaluation/code/top_5_accuracy/script_versions/generate_diagnoses/slurm_logs/%x-%A_%a.out
+
+module reset
+module load miniconda
+conda activate mh-eval
+
+python "$@"
@@ -0,0 +1,69 @@
+# Generate every cell of the experiment matrix in experiment_matrix.json (model x dataset x prompt) in one run
+# Work items are deduplicated across cells, so the fictitious_only / medical_literature_only subsets reuse the
+# combined_jama responses instead of calling the APIs again; add "replicate": "<tag>" to an experiment to force
+# an independent sample. Rerunning after a crash only generates what is not yet in the response cache.
+import argparse
+import sys
+from dotenv import load_dotenv
+
+sys.path.append("..")  # Make the shared llm_pipeline package importable
+from llm_pipeline.http_clients import add_pool_arguments, configure_pool_from_args, report_connection_stats
+from llm_pipeline.experiment_matrix import ExperimentMatrix, build_plan, estimate_plan, print_plan, print_plan_estimate, run_plan
+from llm_pipeline.response_cache import DEFAULT_CACHE_PATH, ResponseCache
+from llm_pipeline.telemetry import DEFAULT_TELEMETRY_PATH, TelemetryStore
+
+# Load API keys from .env file
+load_dotenv()
+
+# Parse command-line options
+parser = argparse.ArgumentParser(description="Plan and run the top-5 accuracy experiment matrix")
+parser.add_argument("--config", default="experiment_matrix.json", help="Experiment matrix config (JSON)")
+parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="SQLite response cache shared by every cell")
+parser.add_argument("--models", nargs="+", help="Only plan/run these models")
+parser.add_argument("--experiments", nargs="+", help="Only plan/run these experiments")
+parser.add_argument("--plan-only", action="store_true", help="Print the deduplicated plan and its predicted cost and wall time without calling any API")
+parser.add_argument("--max-attempts", type=int, default=6,
+                    help="Attempts per case for retryable errors and empty answers (default: 6)")
+parser.add_argument("--no-prompt-caching", action="store_true",
+                    help="Do not send explicit prompt-cache hints (Anthropic cache_control, OpenAI prompt_cache_key)")
+parser.add_argument("--stream", action="store_true", help="Stream responses (see llm_pipeline/streaming.py)")
+parser.add_argument("--telemetry-path", default=DEFAULT_TELEMETRY_PATH,
+                    help="SQLite store for per-call latency, tokens and cost (see llm_pipeline/telemetry.py)")
+parser.add_argument("--hedge-percentile", type=float, default=None,
+                    help="Send a duplicate request for calls slower than this latency percentile (default: off)")
+parser.add_argument("--hedge-budget", type=float, default=0.1,
+                    help="Maximum duplicate requests as a fraction of calls, per model (default: 0.1)")
+parser.add_argument("--hedge-max-cost", type=float, default=None,
+                    help="Maximum estimated extra USD spent on duplicate requests, per model (default: no limit)")
+parser.add_argument("--breaker-threshold", type=float, default=0.5,
+                    help="Pause a model's queue when this fraction of its recent calls failed with 5xx/timeouts (default: 0.5)")
+parser.add_argument("--breaker-cooldown", type=float, default=30,
+                    help="Seconds a paused queue waits before a probe request; doubles while probes fail (default: 30)")
+parser.add_argument("--no-circuit-breaker", action="store_true", help="Keep sending requests while a provider is failing")
+add_pool_arguments(parser)
+args = parser.parse_args()
+configure_pool_from_args(args)  # One connection pool shared by every model's client
+
+# The response cache doubles as the record of finished work items
+matrix = ExperimentMatrix.load(args.config)
+cache = ResponseCache(args.cache_path)
+plan = build_plan(matrix, cache, models=args.models, experiments=args.experiments)
+
+telemetry = TelemetryStore(args.telemetry_path)  # Records are labelled with each item's experiment name
+
+print("***********************************************")
+print_plan(plan)
+print_plan_estimate(estimate_plan(matrix, plan, telemetry))  # Predicted from past runs; see llm_pipeline/estimator.py
+
+if not args.plan_only:
+    run_plan(matrix, plan, cache, max_attempts=args.max_attempts,
+             prompt_caching=not args.no_prompt_caching, stream=args.stream, telemetry=telemetry,
+             hedging=None if args.hedge_percentile is None else
+             {"percentile": args.hedge_percentile, "budget": args.hedge_budget, "max_extra_cost": args.hedge_max_cost},
+             circuit_breaker=None if args.no_circuit_breaker else
+             {"threshold": args.breaker_threshold, "cooldown": args.breaker_cooldown})
+    print("***********************************************")
+    print("Experiment matrix predicted diagnoses saved to JSON.")
+    report_connection_stats()
+telemetry.close()
+cache.close()
@@ -0,0 +1,7 @@
+"""
+Shared helpers for the top-5 accuracy scripts.
+
+The generate_diagnoses scripts (and their memorization_accuracy_comparison copies)
+add `script_versions/` to sys.path and import from this package so that every
+provider runs through the same generation engine.
+"""
@@ -0,0 +1,472 @@
+# Per-provider adapters for the shared generation engine
+# Each adapter wraps one async SDK client, builds the provider-specific request for a single vignette,
+# and extracts (reasoning, answer) with the same logic the generate_diagnoses scripts used before
+import hashlib
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from .streaming import StreamTimer
+
+CONTENT_FILTER_MESSAGE = "Content filter triggered."
+REFUSAL_MESSAGE = "Model refused to answer the prompt."
+TERMINAL_OUTCOMES = ("content_filter", "refusal")  # Deterministic provider decisions: cached, never retried or re-billed
+GEMINI_FILTER_FINISH_REASONS = {"SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST", "SPII", "RECITATION"}
+
+
+@dataclass
+class GenerationResult:
+    """Outcome of one generation call for one case."""
+    case_id: Any
+    model_thoughts: Optional[str]
+    model_diagnosis: Optional[str]
+    outcome: str = "ok"  # "ok", "content_filter", "refusal" or "error"
+    usage: dict = field(default_factory=dict)  # Normalized token counts (input/output/reasoning/cached_input/cache_write)
+    raw_response: Optional[dict] = None  # JSON-serializable dump of the SDK response
+    latency: Optional[float] = None  # Wall-clock seconds spent in the API call
+    queue_wait: Optional[float] = None  # Seconds spent waiting for a concurrency slot or the rate limiter
+    timings: Optional[dict] = None  # Streaming only: time-to-first-token and per-block timings (see streaming.py)
+    error: Optional[str] = None
+    retries: int = 0  # Attempts beyond the first (errors or empty answers retried inline)
+    from_cache: bool = False  # True when served from the on-disk response cache
+
+    @property
+    def is_complete(self) -> bool:
+        """A usable answer or a terminal outcome (filter/refusal); anything else should be generated again."""
+        return bool(self.model_diagnosis) or self.outcome in TERMINAL_OUTCOMES
+
+
+def format_user_message(user_prompt: str, vignette: str) -> str:
+    """User prompt with the vignette inserted at the end (the only part that changes between cases)."""
+    return user_prompt + vignette_block(vignette)
+
+
+def vignette_block(vignette: str) -> str:
+    """The per-case suffix of format_user_message(); everything before it is an identical prefix across cases."""
+    return "\n<vignette>\n" + vignette + "\n</vignette>"
+
+
+def prompt_prefix_key(system_prompt: str, user_prompt: str) -> str:
+    """Short stable id of the shared prompt prefix (used as a cache routing hint)."""
+    return hashlib.sha256((system_prompt + "\0" + user_prompt).encode("utf-8")).hexdigest()[:16]
+
+
+def dump_response(response) -> Optional[dict]:
+    """Convert an SDK response object (pydantic model) into plain JSON-compatible data."""
+    if response is None:
+        return None
+    if hasattr(response, "model_dump"):
+        return response.model_dump(mode="json", exclude_none=True)
+    if isinstance(response, dict):
+        return response
+    return {"repr": repr(response)}
+
+
+def responses_usage(response) -> dict:
+    """Normalized token counts of an OpenAI Responses API response (also used for the LLM judge)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "output_tokens_details", None)
+    input_details = getattr(usage, "input_tokens_details", None)
+    return {"input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "reasoning_tokens": getattr(details, "reasoning_tokens", None),
+            "cached_input_tokens": getattr(input_details, "cached_tokens", None) or 0,
+            "cache_write_tokens": None}
+
+
+class ProviderAdapter:
+    """
+    Base class: subclasses implement request(), extract() and usage().
+
+    Every request keeps the system prompt and user prompt as an identical prefix with the vignette last, so provider
+    prompt caching can reuse the prefix on every case after the first. `prompt_caching` only toggles explicit cache
+    hints (e.g. Anthropic cache_control); it is not a generation parameter and is kept out of the response cache key.
+    `stream` switches to request_stream(), which assembles the same response object from the event stream.
+    """
+    provider = None
+
+    def __init__(self, client, model: str, prompt_caching: bool = True, stream: bool = False, **params):
+        self.client = client  # Async SDK client
+        self.model = model
+        self.prompt_caching = prompt_caching
+        self.stream = stream
+        self.params = params  # Generation parameters (reasoning effort, thinking budget, temperature, ...)
+
+    async def request(self, system_prompt: str, user_prompt: str, vignette: str):
+        raise NotImplementedError
+
+    async def request_stream(self, system_prompt: str, user_prompt: str, vignette: str, timer: StreamTimer):
+        """Streaming variant of request(); must return an object extract() and usage() understand."""
+        raise NotImplementedError(f"Streaming is not implemented for {self.provider}")
+
+    def extract(self, response) -> tuple:
+        """Returns (reasoning, answer, outcome)."""
+        raise NotImplementedError
+
+    def usage(self, response) -> dict:
+        return {}
+
+    async def generate(self, case_id, system_prompt: str, user_prompt: str, vignette: str) -> GenerationResult:
+        start = time.perf_counter()
+        timings = None
+        if self.stream:
+            timer = StreamTimer()
+            response = await self.request_stream(system_prompt, user_prompt, vignette, timer)
+            timings = timer.summary()
+        else:
+            response = await self.request(system_prompt, user_prompt, vignette)
+        latency = time.perf_counter() - start
+        reasoning, answer, outcome = self.extract(response)
+        return GenerationResult(case_id=case_id,
+                                model_thoughts=reasoning,
+                                model_diagnosis=answer,
+                                outcome=outcome,
+                                usage=self.usage(response),
+                                raw_response=dump_response(response),
+                                latency=latency,
+                                timings=timings)
+
+
+class GeminiAdapter(ProviderAdapter):
+    """Gemini 3 via google-genai (`client` is `genai.Client().aio`)."""
+    provider = "google"
+
+    def __init__(self, client, model, thinking_level="high", temperature=1, prompt_caching=True, stream=False):
+        # Gemini 3 caches repeated prefixes implicitly; system_instruction + user prompt already form that prefix
+        super().__init__(client, model, prompt_caching, stream, thinking_level=thinking_level, temperature=temperature)
+
+    def build_config(self, system_prompt):
+        from google.genai import types
+        return types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(
+                thinking_level=self.params["thinking_level"],  # Use thinking_level for Gemini 3, not thinking_budget since it may result in subpar performance
+                include_thoughts=True  # Include thought summaries in parts/thought within `response` parameters
+            ),
+            system_instruction=system_prompt,  # System prompt
+            temperature=self.params["temperature"]  # Model temperature
+        )
+
+    async def request(self, system_prompt, user_prompt, vignette):
+        return await self.client.models.generate_content(
+            model=self.model,
+            contents=format_user_message(user_prompt, vignette),  # User prompt with inserted vignette
+            config=self.build_config(system_prompt),
+        )
+
+    async def request_stream(self, system_prompt, user_prompt, vignette, timer):
+        from google.genai import types
+
+        # Thought summary and answer arrive as text fragments spread over many chunks; concatenate each kind
+        thoughts, answer = [], []
+        last_chunk, prompt_feedback, finish_reason = None, None, None
+        async for chunk in await self.client.models.generate_content_stream(
+                model=self.model,
+                contents=format_user_message(user_prompt, vignette),
+                config=self.build_config(system_prompt)):
+            last_chunk = chunk
+            prompt_feedback = getattr(chunk, "prompt_feedback", None) or prompt_feedback
+            for candidate in chunk.candidates or []:
+                finish_reason = candidate.finish_reason or finish_reason
+                for part in (candidate.content.parts if candidate.content else None) or []:
+                    if not part.text:
+                        continue
+                    timer.token("thought" if part.thought else "text")
+                    (thoughts if part.thought else answer).append(part.text)
+
+        # Rebuild a regular response so extract() and usage() work unchanged
+        parts = []
+        if thoughts:
+            parts.append(types.Part(text="".join(thoughts), thought=True))
+        if answer:
+            parts.append(types.Part(text="".join(answer)))
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts), finish_reason=finish_reason)] if parts else None,
+            prompt_feedback=prompt_feedback,
+            usage_metadata=getattr(last_chunk, "usage_metadata", None),
+            model_version=getattr(last_chunk, "model_version", None),
+        )
+
+    def extract(self, response):
+        # Handle content filter triggering
+        prompt_feedback = getattr(response, "prompt_feedback", None)  # Check if prompt_feedback exists
+        if prompt_feedback and getattr(prompt_feedback, "block_reason", None):  # If block_reason exists within prompt_feedback
+            block_reason = prompt_feedback.block_reason  # Get the block_reason object
+            block_name = block_reason.name if getattr(block_reason, "name", None) else str(block_reason)  # Safely get the name attribute or convert to string
+            print("Content filter triggered:", block_name)
+            return CONTENT_FILTER_MESSAGE, CONTENT_FILTER_MESSAGE, "content_filter"
+
+        # The answer itself can also be blocked (finish_reason SAFETY, PROHIBITED_CONTENT, ...)
+        candidates = getattr(response, "candidates", None) or []
+        finish_reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        finish_name = getattr(finish_reason, "name", None) or str(finish_reason)
+        if finish_name in GEMINI_FILTER_FINISH_REASONS:
+            print("Content filter triggered:", finish_name)
+            return CONTENT_FILTER_MESSAGE, CONTENT_FILTER_MESSAGE, "content_filter"
+
+        # Iterate through response object to extract thought summary and differential diagnosis list
+        reasoning, answer = None, None
+        for part in response.parts or []:
+            if not part.text:
+                continue
+            if part.thought:
+                reasoning = part.text  # Extract thought summary
+            else:
+                answer = part.text  # Extract differential diagnosis list
+        return reasoning, answer, "ok"
+
+    def usage(self, response):
+        meta = getattr(response, "usage_metadata", None)
+        if meta is None:
+            return {}
+        return {"input_tokens": meta.prompt_token_count,
+                "output_tokens": (meta.candidates_token_count or 0) + (meta.thoughts_token_count or 0),
+                "reasoning_tokens": meta.thoughts_token_count,
+                "cached_input_tokens": meta.cached_content_token_count or 0,  # Implicit cache hits
+                "cache_write_tokens": None}
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """GPT-5.x via the Responses API (`client` is `openai.AsyncOpenAI`)."""
+    provider = "openai"
+
+    def __init__(self, client, model, reasoning_effort="xhigh", reasoning_summary="detailed", verbosity="low",
+                 prompt_caching=True, stream=False):
+        super().__init__(client, model, prompt_caching, stream,
+                         reasoning_effort=reasoning_effort, reasoning_summary=reasoning_summary, verbosity=verbosity)
+
+    def build_request(self, system_prompt, user_prompt, vignette) -> dict:
+        request = dict(
+            model=self.model,  # gpt-5.2-pro is way too expensive; use gpt-5.2
+            reasoning={
+                "effort": self.params["reasoning_effort"],  # xhigh favors even more complete reasoning
+                "summary": self.params["reasoning_summary"]  # Give as much detail as possible in thinking block
+            },
+            text={
+                "verbosity": self.params["verbosity"]  # Low verbosity keeps the model on task for diagnosis
+            },
+            input=[
+                {
+                    "role": "developer",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": format_user_message(user_prompt, vignette)
+                }
+            ]
+        )
+        if self.prompt_caching:
+            # Caching is automatic for prefixes >= 1024 tokens; the key routes every case to the same cache shard
+            request["extra_body"] = {"prompt_cache_key": f"top5-{prompt_prefix_key(system_prompt, user_prompt)}"}
+        return request
+
+    async def request(self, system_prompt, user_prompt, vignette):
+        return await self.client.responses.create(**self.build_request(system_prompt, user_prompt, vignette))
+
+    async def request_stream(self, system_prompt, user_prompt, vignette, timer):
+        final = None
+        stream = await self.client.responses.create(**self.build_request(system_prompt, user_prompt, vignette), stream=True)
+        async for event in stream:
+            if event.type == "response.reasoning_summary_text.delta":
+                timer.token("reasoning_summary")
+            elif event.type == "response.output_text.delta":
+                timer.token("text")
+            elif event.type in ("response.completed", "response.incomplete", "response.failed"):
+                final = event.response  # The terminal event carries the full Response object
+        if final is None:
+            raise ConnectionError("OpenAI stream ended without a terminal response event")  # Retryable
+        return final
+
+    def extract(self, response):
+        # Extract reasoning and answer from response object by item type
+        reasoning, answer, refused = None, None, False
+        for item in response.output or []:
+            if item.type == "reasoning" and reasoning is None:
+                # Extract the thought summary by concatenating all thinking blocks using newlines
+                reasoning = "\n\n".join([block.text for block in item.summary or []])
+            elif item.type == "message" and answer is None and item.content:
+                if item.content[0].type == "refusal":
+                    refused = True
+                else:
+                    answer = item.content[0].text  # Extract the differential diagnosis list
+
+        # Handle content filter triggering
+        incomplete = getattr(response, "incomplete_details", None)
+        reason = getattr(incomplete, "reason", None) if incomplete else None
+        if reason == "content_filter":
+            print("Content filter triggered:", reason)
+            return CONTENT_FILTER_MESSAGE, CONTENT_FILTER_MESSAGE, "content_filter"
+        if reason:
+            # Ran out of output tokens: not a filter hit, so the empty answer is retried like any other
+            print(f"Incomplete response ({reason}) for model {self.model}")
+            return reasoning, None, "ok"
+
+        # Handle model refusal to answer
+        if refused and not answer:
+            return reasoning or "N/A", REFUSAL_MESSAGE, "refusal"
+        return reasoning, answer, "ok"
+
+    def usage(self, response):
+        return responses_usage(response)
+
+
+class AnthropicAdapter(ProviderAdapter):
+    """Claude with extended thinking (`client` is `anthropic.AsyncAnthropic`)."""
+    provider = "anthropic"
+
+    def __init__(self, client, model, max_tokens=20000, thinking_budget=19000, prompt_caching=True, stream=False):
+        super().__init__(client, model, prompt_caching, stream, max_tokens=max_tokens, thinking_budget=thinking_budget)
+
+    def build_messages(self, user_prompt, vignette) -> list:
+        if not self.prompt_caching:
+            return [{"role": "user", "content": format_user_message(user_prompt, vignette)}]
+        # Same text split into two blocks: the cache_control breakpoint after the shared user prompt caches
+        # system + user prompt; prefixes below the model's minimum cacheable length are simply not cached
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": user_prompt, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": vignette_block(vignette)},
+                ]
+            }
+        ]
+
+    def build_request(self, system_prompt, user_prompt, vignette) -> dict:
+        return dict(
+            model=self.model,
+            max_tokens=self.params["max_tokens"],  # Max output for Claude Opus 4.5 is 64k but >~21k requires streaming
+            system=system_prompt,
+            # Extended thinking mode is not compatible with temperature, top_p, or top_k sampling
+            thinking={
+                "type": "enabled",
+                "budget_tokens": self.params["thinking_budget"]  # Allocate tokens for thinking - model may not use entire budget
+            },
+            messages=self.build_messages(user_prompt, vignette)
+        )
+
+    async def request(self, system_prompt, user_prompt, vignette):
+        return await self.client.messages.create(**self.build_request(system_prompt, user_prompt, vignette))
+
+    async def request_stream(self, system_prompt, user_prompt, vignette, timer):
+        # The SDK accumulates thinking, redacted_thinking and text blocks as the events arrive;
+        # we only add the timings and hand back the final Message
+        async with self.client.messages.stream(**self.build_request(system_prompt, user_prompt, vignette)) as stream:
+            block_type = None
+            async for event in stream:
+                if event.type == "content_block_start":
+                    block_type = event.content_block.type  # thinking, redacted_thinking or text
+                    timer.start_block(block_type)
+                elif event.type == "content_block_delta":
+                    timer.token(block_type or event.delta.type)
+                elif event.type == "content_block_stop":
+                    timer.end_block()
+            return await stream.get_final_message()
+
+    def extract(self, response):
+        # Handle model refusal to answer
+        if response.stop_reason == "refusal":
+            return "N/A", REFUSAL_MESSAGE, "refusal"
+
+        # Extract the response content
+        reasoning, answer = None, None
+        for block in response.content:
+            if block.type == "text":  # Extract differential diagnosis block
+                answer = block.text
+            elif block.type == "thinking":  # Extract summarized thinking block
+                reasoning = block.thinking
+            elif block.type == "redacted_thinking":  # Redacted thinking blocks carry encrypted data only
+                print(f"Redacted thinking detected for model {self.model}")
+        return reasoning, answer, "ok"
+
+    def usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return {}
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        return {"input_tokens": usage.input_tokens + cache_read + cache_write,  # usage.input_tokens excludes cached tokens
+                "output_tokens": usage.output_tokens,  # Includes thinking tokens
+                "reasoning_tokens": None,  # Not reported separately by the Messages API
+                "cached_input_tokens": cache_read,
+                "cache_write_tokens": cache_write}
+
+
+class DeepSeekAdapter(ProviderAdapter):
+    """DeepSeek reasoner via the OpenAI-compatible Chat Completions API (`client` is `openai.AsyncOpenAI`)."""
+    provider = "deepseek"
+
+    def __init__(self, client, model, temperature=0, prompt_caching=True, stream=False):
+        # DeepSeek caches repeated prefixes on disk automatically; the shared prompts come first in every request
+        super().__init__(client, model, prompt_caching, stream, temperature=temperature)
+
+    def build_request(self, system_prompt, user_prompt, vignette) -> dict:
+        return dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": format_user_message(user_prompt, vignette)},
+            ],
+            temperature=self.params["temperature"],
+            stream=False
+        )
+
+    async def request(self, system_prompt, user_prompt, vignette):
+        return await self.client.chat.completions.create(**self.build_request(system_prompt, user_prompt, vignette))
+
+    async def request_stream(self, system_prompt, user_prompt, vignette, timer):
+        from openai.types.chat import ChatCompletion
+
+        request = self.build_request(system_prompt, user_prompt, vignette)
+        request.update(stream=True, stream_options={"include_usage": True})  # Usage arrives in a final chunk
+        reasoning, content = [], []
+        last_chunk, usage, finish_reason = None, None, None
+        async for chunk in await self.client.chat.completions.create(**request):
+            last_chunk = chunk
+            usage = chunk.usage or usage
+            for choice in chunk.choices:
+                finish_reason = choice.finish_reason or finish_reason
+                reasoning_delta = getattr(choice.delta, "reasoning_content", None)
+                if reasoning_delta:
+                    timer.token("reasoning")
+                    reasoning.append(reasoning_delta)
+                if choice.delta.content:
+                    timer.token("text")
+                    content.append(choice.delta.content)
+        if last_chunk is None:
+            raise ConnectionError("DeepSeek stream ended without any chunks")  # Retryable
+
+        # Rebuild a regular ChatCompletion so extract() and usage() work unchanged
+        return ChatCompletion.model_validate({
+            "id": last_chunk.id, "object": "chat.completion", "created": last_chunk.created, "model": last_chunk.model,
+            "choices": [{"index": 0, "finish_reason": finish_reason or "stop",
+                         "message": {"role": "assistant", "content": "".join(content),
+                                     "reasoning_content": "".join(reasoning) or None}}],
+            "usage": usage.model_dump() if usage is not None else None,
+        })
+
+    def extract(self, response):
+        # Handle content filter triggering
+        if response.choices[0].finish_reason == "content_filter":
+            print("Content filter triggered: content_filter")
+            return CONTENT_FILTER_MESSAGE, CONTENT_FILTER_MESSAGE, "content_filter"
+
+        # Extract the response content
+        answer = response.choices[0].message.content
+
+        # Extract the thinking block
+        reasoning = getattr(response.choices[0].message, "reasoning_content", None)
+        return reasoning, answer, "ok"
+
+    def usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return {}
+        details = getattr(usage, "completion_tokens_details", None)
+        return {"input_tokens": usage.prompt_tokens,
+                "output_tokens": usage.completion_tokens,
+                "reasoning_tokens": getattr(details, "reasoning_tokens", None),
+                "cached_input_tokens": getattr(usage, "prompt_cache_hit_tokens", None) or 0,
+                "cache_write_tokens": None}
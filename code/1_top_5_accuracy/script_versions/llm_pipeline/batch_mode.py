@@ -0,0 +1,181 @@
+# Provider batch-API submission mode (OpenAI Batch and Anthropic Message Batches)
+# Builds one request per vignette with the adapter's own request builder, submits the batch, polls with backoff,
+# downloads the results and maps them back to case_id through the adapter's extraction code
+import io
+import json
+import os
+import time
+
+from .adapters import GenerationResult, dump_response
+
+CUSTOM_ID_PREFIX = "case-"
+
+
+def custom_id_for(case_id) -> str:
+    return f"{CUSTOM_ID_PREFIX}{case_id}"
+
+
+def request_body(request: dict) -> dict:
+    """SDK keyword arguments -> raw JSON body (fields passed through `extra_body` move to the top level)."""
+    body = dict(request)
+    body.update(body.pop("extra_body", None) or {})
+    return body
+
+
+class OpenAIBatchBackend:
+    """OpenAI Batch API on the /v1/responses endpoint (`client` is a synchronous `openai.OpenAI`)."""
+    endpoint = "/v1/responses"
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def build_requests(self, adapter, cases: list, system_prompt: str, user_prompt: str) -> list:
+        return [{"custom_id": custom_id_for(case["case_id"]),
+                 "method": "POST",
+                 "url": self.endpoint,
+                 "body": request_body(adapter.build_request(system_prompt, user_prompt, case["vignette"]))}
+                for case in cases]
+
+    def submit(self, requests: list) -> str:
+        jsonl = "".join(json.dumps(request, ensure_ascii=False) + "\n" for request in requests)
+        batch_file = self.client.files.create(file=("batch_requests.jsonl", io.BytesIO(jsonl.encode("utf-8"))),
+                                              purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_file.id,
+                                           endpoint=self.endpoint,
+                                           completion_window=self.completion_window)
+        return batch.id
+
+    def poll(self, batch_id: str) -> tuple:
+        """Returns (finished, status description)."""
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f"{batch.status} ({counts.completed} completed, {counts.failed} failed of {counts.total})" if counts else batch.status
+        return batch.status in ("completed", "failed", "expired", "cancelled"), progress
+
+    def results(self, batch_id: str) -> dict:
+        """custom_id -> (response object or None, error message or None)."""
+        from openai.types.responses import Response
+
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code", 200) != 200:
+                    results[record["custom_id"]] = (None, json.dumps(record.get("error") or response.get("body")))
+                else:
+                    results[record["custom_id"]] = (Response.model_validate(response["body"]), None)
+        return results
+
+
+class AnthropicBatchBackend:
+    """Anthropic Message Batches API (`client` is a synchronous `anthropic.Anthropic`)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def build_requests(self, adapter, cases: list, system_prompt: str, user_prompt: str) -> list:
+        return [{"custom_id": custom_id_for(case["case_id"]),
+                 "params": adapter.build_request(system_prompt, user_prompt, case["vignette"])}
+                for case in cases]
+
+    def submit(self, requests: list) -> str:
+        return self.client.messages.batches.create(requests=requests).id
+
+    def poll(self, batch_id: str) -> tuple:
+        batch = self.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = (f"{batch.processing_status} ({counts.succeeded} succeeded, {counts.errored} errored, "
+                    f"{counts.processing} processing)")
+        return batch.processing_status == "ended", progress
+
+    def results(self, batch_id: str) -> dict:
+        results = {}
+        for item in self.client.messages.batches.results(batch_id):
+            if item.result.type == "succeeded":
+                results[item.custom_id] = (item.result.message, None)
+            else:  # errored, canceled or expired
+                error = getattr(item.result, "error", None)
+                results[item.custom_id] = (None, f"{item.result.type}: {dump_response(error)}")
+        return results
+
+
+def wait_for_batch(backend, batch_id: str, poll_interval: float = 30, max_poll_interval: float = 600,
+                   backoff: float = 1.5, timeout: float = 26 * 3600, sleep=time.sleep):
+    """Poll until the batch has finished, growing the interval geometrically up to max_poll_interval."""
+    start = time.monotonic()
+    interval = poll_interval
+    while True:
+        finished, progress = backend.poll(batch_id)
+        print(f"Batch {batch_id}: {progress}")
+        if finished:
+            return
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"Batch {batch_id} did not finish within {timeout / 3600:.1f} hours")
+        sleep(interval)
+        interval = min(interval * backoff, max_poll_interval)
+
+
+def run_batch(backend, adapter, cases: list, system_prompt: str, user_prompt: str,
+              batch_id: str = None, on_submitted=None, **poll_kwargs) -> list:
+    """
+    Submit `cases` as one batch (or reattach to `batch_id`), wait for it and return GenerationResults.
+    `on_submitted(batch_id)` is called right after submission so callers can persist the id.
+    """
+    case_ids = {custom_id_for(case["case_id"]): case["case_id"] for case in cases}  # Map back to the original case_id (ints stay ints)
+    if batch_id is None:
+        requests = backend.build_requests(adapter, cases, system_prompt, user_prompt)
+        batch_id = backend.submit(requests)
+        print(f"Submitted batch {batch_id} with {len(requests)} requests.")
+        if on_submitted is not None:
+            on_submitted(batch_id)
+    else:
+        print(f"Reattaching to batch {batch_id}.")
+
+    wait_for_batch(backend, batch_id, **poll_kwargs)
+
+    results = []
+    for custom_id, (response, error) in backend.results(batch_id).items():
+        if custom_id not in case_ids:
+            continue
+        case_id = case_ids[custom_id]
+        if response is None:
+            print(f"Batch request for case {case_id} failed: {error}")
+            results.append(GenerationResult(case_id=case_id, model_thoughts=None, model_diagnosis=None,
+                                            outcome="error", error=error))
+            continue
+        reasoning, answer, outcome = adapter.extract(response)
+        results.append(GenerationResult(case_id=case_id,
+                                        model_thoughts=reasoning,
+                                        model_diagnosis=answer,
+                                        outcome=outcome,
+                                        usage=adapter.usage(response),
+                                        raw_response=dump_response(response)))
+    return results
+
+
+class BatchState:
+    """Remembers the id of a submitted batch next to the checkpoint so --resume can reattach instead of resubmitting."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f).get("batch_id")
+
+    def save(self, batch_id: str):
+        with open(self.path, "w") as f:
+            json.dump({"batch_id": batch_id, "submitted_at": time.time()}, f)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
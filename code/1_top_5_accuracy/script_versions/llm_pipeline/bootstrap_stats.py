@@ -0,0 +1,153 @@
+# Bootstrap confidence intervals and paired model comparisons for the per-case accuracy metrics
+# Models are grouped by the set of cases they scored (e.g. fictitious-only vs medical-literature-only files in one
+# folder), and the per-case metrics of each group are stacked into one (models x cases x metrics) array. Each
+# bootstrap resample of the cases is a row of case counts, so the means of every model and metric
+# for all resamples come out of a single matrix product; differences between two models use the same resamples for
+# both (paired), and percentile CIs and p-values are taken along the resample axis. 10,000 resamples for a dozen
+# models take well under a second.
+#
+# evaluate_accuracy.py writes the results next to the summary CSVs after every run; to recompute them from the
+# detailed results on disk:
+#   python -m llm_pipeline.bootstrap_stats --detailed-dir <detailed_results> --output-dir <summarized_results>
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+# Detailed-result columns -> metric names used in the summary CSVs
+DEFAULT_METRICS = {
+    "hybrid_top1": "Top-1 Accuracy",
+    "hybrid_hit_rate": "Top-5 Accuracy",
+    "hybrid_recall": "Recall@5",
+    "hybrid_mrr": "Mean Reciprocal Rank",
+}
+DETAILED_SUFFIX = "_diagnostic_evaluation_results_detailed.csv"
+
+
+def metric_groups(frames: dict, metrics: dict = None):
+    """
+    Stack per-case results ({model: DataFrame with case_id and metric columns}) into one float array of shape
+    (models, cases, metrics) per group of models that scored the same cases. Returns the metric columns and a list
+    of (array, models, case_ids) groups.
+    """
+    metrics = DEFAULT_METRICS if metrics is None else metrics
+    columns = [column for column in metrics if all(column in df for df in frames.values())]
+    groups = {}  # Sorted case ids -> models
+    scored = {}
+    for model, df in frames.items():
+        scored[model] = df.dropna(subset=columns).drop_duplicates("case_id").set_index("case_id")
+        groups.setdefault(tuple(sorted(scored[model].index)), []).append(model)
+    if len(groups) > 1:
+        print(f"Bootstrap: {len(groups)} groups of models with different case sets; models are only paired within a group.")
+    return columns, [(np.stack([scored[model].loc[list(case_ids), columns].to_numpy(dtype=np.float64) for model in models]),
+                      models, list(case_ids)) for case_ids, models in groups.items() if case_ids]
+
+
+def resample_means(array: np.ndarray, resamples: int = 10000, seed: int = 0, chunk: int = 10000) -> np.ndarray:
+    """
+    Means of every model and metric for `resamples` case resamples (with replacement): shape (resamples, models,
+    metrics). Each chunk of resamples is a (chunk x cases) count matrix times the (cases x models*metrics) data.
+    """
+    n_models, n_cases, n_metrics = array.shape
+    data = array.transpose(1, 0, 2).reshape(n_cases, n_models * n_metrics)
+    rng = np.random.default_rng(seed)
+    means = np.empty((resamples, n_models * n_metrics))
+    for start in range(0, resamples, chunk):
+        size = min(chunk, resamples - start)
+        draws = rng.integers(0, n_cases, size=(size, n_cases))
+        # Row r counts how often each case was drawn in resample r (one flat bincount, no Python loop)
+        counts = np.bincount((np.arange(size)[:, None] * n_cases + draws).ravel(), minlength=size * n_cases)
+        means[start:start + size] = counts.reshape(size, n_cases) @ data / n_cases
+    return means.reshape(resamples, n_models, n_metrics)
+
+
+def bootstrap_tables(frames: dict, metrics: dict = None, resamples: int = 10000, seed: int = 0, confidence: float = 0.95):
+    """(confidence intervals, paired differences) DataFrames for every model and metric."""
+    metrics = DEFAULT_METRICS if metrics is None else metrics
+    columns, groups = metric_groups(frames, metrics)
+    if not columns or not groups:
+        return pd.DataFrame(), pd.DataFrame()
+    tables = [group_tables(array, models, case_ids, [metrics[column] for column in columns], resamples, seed, confidence)
+              for array, models, case_ids in groups]
+    return pd.concat([ci for ci, _ in tables], ignore_index=True), pd.concat([pairs for _, pairs in tables], ignore_index=True)
+
+
+def group_tables(array, models, case_ids, names, resamples, seed, confidence):
+    """CI and paired-difference tables of one group of models scored on the same cases."""
+    alpha = (1 - confidence) / 2 * 100
+    means = resample_means(array, resamples, seed)
+    estimates = array.mean(axis=1)  # (models, metrics)
+
+    lower, upper = np.percentile(means, [alpha, 100 - alpha], axis=0)
+    ci = pd.DataFrame({
+        "model": np.repeat(models, len(names)),
+        "metric": np.tile(names, len(models)),
+        "n_cases": len(case_ids),
+        "estimate": estimates.ravel(),
+        "ci_lower": lower.ravel(),
+        "ci_upper": upper.ravel(),
+        "resamples": resamples,
+    })
+
+    # Every model pair on the same resamples; two-sided p-value from the share of resampled differences beyond 0
+    first, second = np.triu_indices(len(models), k=1)
+    differences = means[:, first, :] - means[:, second, :]  # (resamples, pairs, metrics)
+    diff_lower, diff_upper = np.percentile(differences, [alpha, 100 - alpha], axis=0)
+    p_values = np.minimum(1.0, 2 * np.minimum((differences <= 0).mean(axis=0), (differences >= 0).mean(axis=0)))
+    pairs = pd.DataFrame({
+        "model_a": np.repeat(np.array(models)[first], len(names)),
+        "model_b": np.repeat(np.array(models)[second], len(names)),
+        "metric": np.tile(names, len(first)),
+        "n_cases": len(case_ids),
+        "difference": (estimates[first] - estimates[second]).ravel(),
+        "ci_lower": diff_lower.ravel(),
+        "ci_upper": diff_upper.ravel(),
+        "p_value": p_values.ravel(),
+        "resamples": resamples,
+    })
+    return ci, pairs
+
+
+def write_bootstrap(frames: dict, output_dir: str, metrics: dict = None, resamples: int = 10000, seed: int = 0,
+                    confidence: float = 0.95):
+    """Write bootstrap_confidence_intervals.csv and bootstrap_paired_differences.csv into output_dir."""
+    ci, pairs = bootstrap_tables(frames, metrics, resamples, seed, confidence)
+    if ci.empty:
+        print("Bootstrap: no scored cases; nothing written.")
+        return
+    ci_path = os.path.join(output_dir, "bootstrap_confidence_intervals.csv")
+    pairs_path = os.path.join(output_dir, "bootstrap_paired_differences.csv")
+    ci.to_csv(ci_path, index=False)
+    print(f"Saved {confidence:.0%} bootstrap CIs ({resamples} case resamples) to '{ci_path}'")
+    if not pairs.empty:
+        pairs.to_csv(pairs_path, index=False)
+        print(f"Saved paired model differences to '{pairs_path}'")
+
+
+def load_detailed_results(detailed_dir: str) -> dict:
+    """{model: detailed results DataFrame} for every *_diagnostic_evaluation_results_detailed.csv in the folder."""
+    frames = {}
+    for path in sorted(glob.glob(os.path.join(glob.escape(detailed_dir), f"*{DETAILED_SUFFIX}"))):
+        frames[os.path.basename(path)[:-len(DETAILED_SUFFIX)]] = pd.read_csv(path)
+    return frames
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bootstrap CIs and paired model differences from detailed accuracy results")
+    ap.add_argument("--detailed-dir", required=True, help="Folder with *_diagnostic_evaluation_results_detailed.csv")
+    ap.add_argument("--output-dir", required=True, help="Where to write the bootstrap CSVs (e.g. the summarized results)")
+    ap.add_argument("--resamples", type=int, default=10000)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--confidence", type=float, default=0.95)
+    args = ap.parse_args()
+
+    frames = load_detailed_results(args.detailed_dir)
+    if not frames:
+        ap.error(f"no *{DETAILED_SUFFIX} files in {args.detailed_dir}")
+    write_bootstrap(frames, args.output_dir, resamples=args.resamples, seed=args.seed, confidence=args.confidence)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Crash-safe JSONL checkpoint for diagnosis generation
+# Every completed case is appended as one JSON line and fsync'ed, so a crash, preemption or Slurm --time limit
+# only loses the requests that were in flight; --resume skips the case_ids already present
+import json
+import os
+import time
+
+from .adapters import GenerationResult
+
+CHECKPOINT_FIELDS = ("case_id", "model_thoughts", "model_diagnosis", "outcome", "usage", "latency", "timings")
+
+
+def checkpoint_path(output_dir: str, model: str, dataset_name: str) -> str:
+    """Checkpoints are not timestamped so that a restarted job finds the file of the run it is resuming."""
+    return os.path.join(output_dir, "checkpoints", f"predicted_diagnoses_{model}_{dataset_name}.jsonl")
+
+
+class JsonlCheckpoint:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._drop_torn_line()
+
+    def _drop_torn_line(self):
+        """Truncate a partially written final line so the next append starts on a fresh line."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb+") as f:
+            content = f.read()
+            if content.endswith(b"\n"):
+                return
+            f.truncate(content.rfind(b"\n") + 1)  # rfind returns -1 when there is no complete line at all
+            print(f"Dropped a partially written line at the end of {self.path}")
+
+    def load(self) -> dict:
+        """Map case_id -> GenerationResult; later lines win and unreadable lines are skipped."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring unreadable checkpoint line {line_number} in {self.path}")
+                    continue
+                fields = {k: record.get(k) for k in CHECKPOINT_FIELDS}
+                fields["usage"] = fields["usage"] or {}
+                records[record["case_id"]] = GenerationResult(**fields)
+        return records
+
+    def completed_case_ids(self) -> set:
+        return set(self.load().keys())
+
+    def append(self, result: GenerationResult):
+        record = {k: getattr(result, k) for k in CHECKPOINT_FIELDS}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())  # Make sure the line is on disk before we count the case as done
+
+    def archive(self):
+        """Move an existing checkpoint aside (used when a run starts without --resume)."""
+        if os.path.exists(self.path):
+            archived = f"{self.path}.{time.strftime('%Y%m%d_%H%M%S')}.bak"
+            os.replace(self.path, archived)
+            print(f"Moved previous checkpoint to {archived} (pass --resume to continue it instead).")
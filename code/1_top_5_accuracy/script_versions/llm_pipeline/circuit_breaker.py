@@ -0,0 +1,116 @@
+# Circuit breaker per provider and model
+# During a provider incident every in-flight case keeps retrying against the failing endpoint. The breaker watches
+# the error rate of the last `window` calls; once it reaches `threshold` the circuit opens and that model's queue
+# waits out a cooldown (other providers keep running). Then a single probe call is let through: success closes the
+# circuit, failure reopens it with a doubled cooldown.
+#
+# Rate limiting (429) is handled by the rate limiter's Retry-After pause and does not count as a failure here;
+# neither do refusals, content-filter hits or fatal request errors, which say nothing about the provider's health.
+import asyncio
+import threading
+import time
+from collections import deque
+
+from .rate_limiter import classify_error, status_code_of
+
+_breakers = {}  # (provider, model) -> CircuitBreaker shared by every engine in the process
+_registry_lock = threading.Lock()
+
+
+def is_provider_failure(exc) -> bool:
+    """Errors that point at an unhealthy endpoint: 5xx, timeouts, dropped connections."""
+    return classify_error(exc) == "retryable" and status_code_of(exc) != 429
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: float = 0.5, window: int = 20, min_calls: int = 10,
+                 cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.name = name
+        self.threshold = threshold  # Failure fraction over the window that opens the circuit
+        self.window = deque(maxlen=window)  # True for failures
+        self.min_calls = min_calls  # Do not judge the error rate on fewer calls
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"  # "closed", "open" or "half_open"
+        self.open_until = 0.0
+        self.probing = False  # A half-open probe call is in flight
+        self.lock = threading.Lock()
+        self.opened = 0  # Times the circuit opened
+        self.open_seconds = 0.0  # Total time spent open
+        self.opened_at = None
+
+    async def wait(self) -> bool:
+        """
+        Block this case while the circuit is open; in half-open state only one probe call proceeds. Returns True for
+        that probe call, whose record(..., probe=True) alone decides whether the circuit closes again.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.state == "open" and now >= self.open_until:
+                    self.state = "half_open"
+                    print(f"Circuit breaker for {self.name}: cooldown over, sending a probe request.")
+                if self.state == "closed":
+                    return False
+                if self.state == "half_open" and not self.probing:
+                    self.probing = True
+                    return True
+                delay = self.open_until - now if self.state == "open" else 1.0  # Poll while a probe is in flight
+            await asyncio.sleep(delay)
+
+    def record(self, error=None, probe: bool = False):
+        """
+        Record a finished call (`error` is the exception, or None for any response from the provider); `probe` is what
+        wait() returned for the call.
+        """
+        failure = error is not None and is_provider_failure(error)
+        with self.lock:
+            if self.state == "half_open":
+                if not probe:
+                    return  # Calls that started before the circuit opened; only the probe decides
+                self.probing = False
+                if failure:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                    self._open(f"probe failed ({error})")
+                else:
+                    self.open_seconds += time.monotonic() - self.opened_at
+                    self.state, self.cooldown = "closed", self.base_cooldown
+                    self.window.clear()
+                    print(f"Circuit breaker for {self.name}: closed again.")
+                return
+            if self.state != "closed":
+                return  # Calls that were in flight before the circuit opened
+            self.window.append(failure)
+            failures = sum(self.window)
+            if len(self.window) >= self.min_calls and failures / len(self.window) >= self.threshold:
+                self._open(f"{failures} of the last {len(self.window)} calls failed")
+
+    def _open(self, why: str):
+        if self.state == "closed":
+            self.opened += 1
+            self.opened_at = time.monotonic()
+        self.state = "open"
+        self.open_until = time.monotonic() + self.cooldown
+        print(f"Circuit breaker for {self.name}: open for {self.cooldown:g}s, {why}.")
+
+    def summary(self) -> dict:
+        with self.lock:
+            open_seconds = self.open_seconds
+            if self.state != "closed" and self.opened_at is not None:
+                open_seconds += time.monotonic() - self.opened_at
+            return {"name": self.name, "state": self.state, "opened": self.opened, "open_seconds": round(open_seconds, 1)}
+
+
+def breaker_for(provider: str, model: str, **kwargs) -> CircuitBreaker:
+    """The process-wide breaker for (provider, model); `kwargs` apply when it is first created."""
+    with _registry_lock:
+        if (provider, model) not in _breakers:
+            _breakers[(provider, model)] = CircuitBreaker(f"{provider}/{model}", **kwargs)
+        return _breakers[(provider, model)]
+
+
+def report_circuit_breaker(breaker: CircuitBreaker):
+    s = breaker.summary()
+    if s["opened"]:
+        print(f"Circuit breaker for {s['name']}: opened {s['opened']} times, {s['open_seconds']:.0f}s paused in total.")
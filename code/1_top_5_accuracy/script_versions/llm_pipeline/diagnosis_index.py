@@ -0,0 +1,387 @@
+# Local ICD-10-CM / DSM-5-TR canonicalization index for the hybrid accuracy evaluation
+# Diagnosis strings are mapped to canonical DSM-5-TR entities through their names, common synonyms and
+# abbreviations, and the F-codes the models (and some ground truths) include. Entities form a parent/subtype
+# hierarchy inside each DSM-5-TR chapter, which lets a (true, predicted) pair be decided without the LLM judge when
+# the answer is unambiguous:
+#   match     - the prediction names the true entity or one of its subtypes (and its codes refine the true code)
+#   mismatch  - both sides resolve to a single DSM-5-TR chapter and the chapters differ (e.g. psychotic vs anxiety)
+# Everything else (siblings in one chapter, comorbid lists, medical conditions, codes the index does not know,
+# contradicting specifiers) is left to the judge. The index prefers sending a pair to the judge over guessing.
+#
+# Check how a pair is resolved:
+#   python -m llm_pipeline.diagnosis_index "Schizoaffective disorder" "Schizoaffective disorder, bipolar type - F25.0"
+import argparse
+import hashlib
+import re
+from dataclasses import dataclass, field
+
+# ICD-10 codes as written in diagnoses ("F32.3", "F43.10", "G04.81"); only F-codes are in the index
+ICD_CODE = re.compile(r"(?<![A-Z0-9])([A-Z]\d{2}(?:\.[0-9A-Z]{1,4})?)(?![A-Z0-9])")
+
+# Substance-induced psychotic disorders are coded F1x.15x / F1x.25x / F1x.95x (with abuse / dependence / use)
+SUBSTANCE_PSYCHOSIS_CODE = re.compile(r"^F1[0-9]\.[129]5")
+
+# Words a prediction may add to an entity name (severity, course, subtype and episode specifiers) and still be a
+# plain instance of that entity; any other leftover word (an etiology, a medical condition) defers to the judge
+SPECIFIER_WORDS = set("""
+    a absent acute adolescent adult and anxious atypical behavior by childhood chronic code combined congruent
+    continuous current currently delusional depressed depressive disorder distress early episode episodes extreme
+    f fair features first full good hypomanic i ii icd cm dsm tr impulsive in inattentive incongruent insight
+    hyperactive limited manic melancholic mild mixed moderate mood most multiple nos not of onset or other otherwise
+    partial pattern peripartum persistent poor postpartum predominantly presentation prognostic provisional
+    psychotic rapid recent recurrent remission restricting seasonal severe single specified sustained symptoms
+    the type uncomplicated unspecified with without 1 2 5 10
+""".split())
+
+# Words a ground truth may carry besides the entity name and still count as naming just that entity
+FILLER_WORDS = {"icd", "cm", "dsm", "tr", "f", "code", "5", "10"}
+
+
+@dataclass(frozen=True)
+class Entity:
+    name: str
+    chapter: str  # DSM-5-TR chapter; entities in different chapters never match each other
+    parent: str = None  # Broader entity in the same chapter, if any
+    codes: tuple = ()  # ICD-10-CM code prefixes that resolve to this entity (the longest prefix wins)
+    aliases: tuple = ()  # Synonyms and abbreviations besides the name
+    related: tuple = ()  # Other chapters it straddles (never a clear mismatch against those)
+
+
+def _entities(chapter, *entries):
+    return [Entity(name, chapter, parent, tuple(codes), tuple(aliases), tuple(related[0]) if related else ())
+            for name, parent, codes, aliases, *related in entries]
+
+
+# (name, parent, ICD-10-CM code prefixes, aliases[, related chapters]) per DSM-5-TR chapter
+ENTITIES = (
+    _entities(
+        "neurodevelopmental",
+        ("intellectual disability", None, ["F70", "F71", "F72", "F73", "F78", "F79"],
+         ["intellectual developmental disorder"]),
+        ("autism spectrum disorder", None, ["F84.0"], ["autism", "autistic disorder", "asperger syndrome"]),
+        ("attention deficit hyperactivity disorder", None, ["F90"],
+         ["attention deficit disorder", "adhd", "attention deficit hyperactivity"]),
+        ("specific learning disorder", None, ["F81"], ["dyslexia"]),
+        ("language disorder", None, ["F80.2"], []),
+        ("speech sound disorder", None, ["F80.0"], []),
+        ("childhood onset fluency disorder", None, ["F80.81"], ["stuttering"]),
+        ("social pragmatic communication disorder", None, ["F80.82"], ["social communication disorder"]),
+        ("developmental coordination disorder", None, ["F82"], []),
+        ("stereotypic movement disorder", None, ["F98.4"], []),
+        ("tic disorder", None, ["F95"], []),
+        ("tourette disorder", "tic disorder", ["F95.2"], ["tourette syndrome", "tourette"]),
+        ("persistent motor or vocal tic disorder", "tic disorder", ["F95.1"], ["chronic tic disorder"]),
+        ("provisional tic disorder", "tic disorder", ["F95.0"], ["transient tic disorder"]),
+    ),
+    _entities(
+        "psychotic",
+        ("schizophrenia", None, ["F20"], []),
+        ("paranoid schizophrenia", "schizophrenia", ["F20.0"], []),
+        ("schizophreniform disorder", None, ["F20.81"], []),
+        ("schizoaffective disorder", None, ["F25"], []),
+        ("schizoaffective disorder bipolar type", "schizoaffective disorder", ["F25.0"], []),
+        ("schizoaffective disorder depressive type", "schizoaffective disorder", ["F25.1"], []),
+        ("delusional disorder", None, ["F22"], []),
+        ("brief psychotic disorder", None, ["F23"], ["brief reactive psychosis"]),
+        ("other specified schizophrenia spectrum and other psychotic disorder", None, ["F28"], []),
+        ("unspecified schizophrenia spectrum and other psychotic disorder", None, ["F29"],
+         ["unspecified psychosis", "unspecified psychotic disorder"]),
+        ("substance induced psychotic disorder", None, [],
+         ["substance medication induced psychotic disorder", "medication induced psychotic disorder",
+          "substance induced psychosis", "drug induced psychosis", "drug induced psychotic disorder"],
+         ["substance"]),
+        ("psychotic disorder due to another medical condition", None, ["F06.0", "F06.2"], []),
+        ("catatonia", None, ["F06.1"], ["catatonic", "catatonic syndrome"]),
+        ("catatonia associated with another mental disorder", "catatonia", [], []),
+        ("catatonic disorder due to another medical condition", "catatonia", [], ["catatonia due to another medical condition"]),
+        ("unspecified catatonia", "catatonia", [], []),
+    ),
+    _entities(
+        "bipolar",
+        ("bipolar disorder", None, ["F31"], ["bipolar affective disorder", "manic depressive illness",
+                                              "manic depression"]),
+        ("bipolar i disorder", "bipolar disorder", ["F31.0", "F31.1", "F31.2", "F31.3", "F31.4", "F31.5", "F31.6",
+                                                    "F31.7"],
+         ["bipolar 1 disorder", "bipolar disorder i", "bipolar disorder type i", "bipolar type i", "bipolar i"]),
+        ("bipolar ii disorder", "bipolar disorder", ["F31.81"],
+         ["bipolar 2 disorder", "bipolar disorder ii", "bipolar disorder type ii", "bipolar type ii", "bipolar ii"]),
+        ("other specified bipolar and related disorder", "bipolar disorder", ["F31.89"], []),
+        ("cyclothymic disorder", None, ["F34.0"], ["cyclothymia"]),
+    ),
+    _entities(
+        "depressive",
+        ("major depressive disorder", None, ["F32", "F33"],
+         ["major depression", "mdd", "unipolar depression", "major depressive episode"]),
+        ("persistent depressive disorder", None, ["F34.1"], ["dysthymia", "dysthymic disorder"]),
+        ("disruptive mood dysregulation disorder", None, ["F34.81"], ["dmdd"]),
+        ("premenstrual dysphoric disorder", None, ["F32.81"], ["pmdd"]),
+        ("other specified depressive disorder", None, ["F32.89"], []),
+        ("unspecified depressive disorder", None, ["F32.A"], []),
+        ("depressive disorder due to another medical condition", None, ["F06.31", "F06.32"], []),
+    ),
+    _entities(
+        "anxiety",
+        ("separation anxiety disorder", None, ["F93.0"], []),
+        ("selective mutism", None, ["F94.0"], []),
+        ("specific phobia", None, ["F40.2"], []),
+        ("social anxiety disorder", None, ["F40.1"], ["social phobia"]),
+        ("panic disorder", None, ["F41.0"], []),
+        ("agoraphobia", None, ["F40.0"], []),
+        ("generalized anxiety disorder", None, ["F41.1"], ["gad"]),
+        ("anxiety disorder due to another medical condition", None, ["F06.4"], []),
+    ),
+    _entities(
+        "obsessive compulsive",
+        ("obsessive compulsive disorder", None, ["F42"], ["ocd"]),
+        ("body dysmorphic disorder", None, ["F45.22"], ["dysmorphophobia"]),
+        ("hoarding disorder", None, ["F42.3"], []),
+        ("trichotillomania", None, ["F63.3"], ["hair pulling disorder"]),
+        ("excoriation disorder", None, ["F42.4"], ["skin picking disorder"]),
+    ),
+    _entities(
+        "trauma",
+        ("reactive attachment disorder", None, ["F94.1"], []),
+        ("disinhibited social engagement disorder", None, ["F94.2"], []),
+        ("posttraumatic stress disorder", None, ["F43.1"], ["post traumatic stress disorder", "ptsd"]),
+        ("acute stress disorder", None, ["F43.0"], []),
+        ("adjustment disorder", None, ["F43.2"], []),
+        ("prolonged grief disorder", None, ["F43.81"], ["complicated grief"]),
+    ),
+    _entities(
+        "dissociative",
+        ("dissociative identity disorder", None, ["F44.81"], ["multiple personality disorder"]),
+        ("dissociative amnesia", None, ["F44.0"], []),
+        ("depersonalization derealization disorder", None, ["F48.1"], ["depersonalization disorder"]),
+    ),
+    _entities(
+        "somatic",
+        ("somatic symptom disorder", None, ["F45.1"], []),
+        ("illness anxiety disorder", None, ["F45.21"], ["hypochondriasis"]),
+        ("functional neurological symptom disorder", None, ["F44.4", "F44.5", "F44.6", "F44.7"],
+         ["conversion disorder", "psychogenic nonepileptic seizures"]),
+        ("psychological factors affecting other medical conditions", None, ["F54"], []),
+        ("factitious disorder", None, ["F68.1"], ["munchausen syndrome"]),
+        ("pseudocyesis", None, ["F45.8"], []),
+    ),
+    _entities(
+        "feeding and eating",
+        ("anorexia nervosa", None, ["F50.0"], []),
+        ("bulimia nervosa", None, ["F50.2"], []),
+        ("binge eating disorder", None, ["F50.81"], []),
+        ("avoidant restrictive food intake disorder", None, ["F50.82"], ["arfid"]),
+        ("pica", None, ["F98.3"], []),
+        ("rumination disorder", None, ["F98.21"], []),
+        ("other specified feeding or eating disorder", None, ["F50.89"], ["osfed"]),
+    ),
+    _entities(
+        "elimination",
+        ("enuresis", None, ["F98.0"], []),
+        ("encopresis", None, ["F98.1"], []),
+    ),
+    _entities(
+        "sleep wake",
+        ("insomnia disorder", None, ["F51.01"], []),
+        ("nightmare disorder", None, ["F51.5"], []),
+    ),
+    _entities(
+        "gender dysphoria",
+        ("gender dysphoria", None, ["F64"], []),
+    ),
+    _entities(
+        "disruptive",
+        ("oppositional defiant disorder", None, ["F91.3"], []),
+        ("conduct disorder", None, ["F91"], []),
+        ("intermittent explosive disorder", None, ["F63.81"], []),
+        ("pyromania", None, ["F63.1"], []),
+        ("kleptomania", None, ["F63.2"], []),
+    ),
+    _entities(
+        "neurocognitive",
+        ("delirium", None, ["F05"], []),
+        ("major neurocognitive disorder", None, ["F01", "F02", "F03"], ["dementia"]),
+        ("mild neurocognitive disorder", None, ["F06.7"], []),
+    ),
+    _entities(
+        "personality",
+        ("paranoid personality disorder", None, ["F60.0"], []),
+        ("schizoid personality disorder", None, ["F60.1"], []),
+        ("schizotypal personality disorder", None, ["F21"], ["schizotypal disorder"]),
+        ("antisocial personality disorder", None, ["F60.2"], []),
+        ("borderline personality disorder", None, ["F60.3"], ["emotionally unstable personality disorder"]),
+        ("histrionic personality disorder", None, ["F60.4"], []),
+        ("narcissistic personality disorder", None, ["F60.81"], []),
+        ("avoidant personality disorder", None, ["F60.6"], []),
+        ("dependent personality disorder", None, ["F60.7"], []),
+        ("obsessive compulsive personality disorder", None, ["F60.5"], ["ocpd"]),
+        ("personality change due to another medical condition", None, ["F07.0"], []),
+    ),
+)
+
+# Substance-related disorders: one entity per substance class, with use disorder, intoxication and withdrawal as subtypes
+SUBSTANCES = (
+    ("alcohol", "F10", ["alcohol"]),
+    ("opioid", "F11", ["opioid", "opiate", "heroin"]),
+    ("cannabis", "F12", ["cannabis", "marijuana"]),
+    ("sedative hypnotic or anxiolytic", "F13", ["sedative hypnotic or anxiolytic", "sedative", "benzodiazepine"]),
+    ("cocaine", "F14", ["cocaine"]),
+    ("stimulant", "F15", ["stimulant", "amphetamine", "methamphetamine", "amphetamine type substance"]),
+    ("hallucinogen", "F16", ["hallucinogen", "phencyclidine"]),
+    ("tobacco", "F17", ["tobacco", "nicotine"]),
+    ("inhalant", "F18", ["inhalant"]),
+    ("other or unknown substance", "F19", ["other or unknown substance", "other substance", "polysubstance"]),
+)
+for _substance, _code, _names in SUBSTANCES:
+    ENTITIES += (_entities(
+        "substance",
+        (f"{_substance} related disorder", None, [_code], [f"{name} related disorder" for name in _names]),
+        (f"{_substance} use disorder", f"{_substance} related disorder", [],
+         [f"{name} {kind}" for name in _names for kind in ("use disorder", "dependence", "abuse")]),
+        (f"{_substance} intoxication", f"{_substance} related disorder", [], [f"{name} intoxication" for name in _names]),
+        (f"{_substance} withdrawal", f"{_substance} related disorder", [], [f"{name} withdrawal" for name in _names]),
+    ),)
+
+
+def normalize(text: str) -> str:
+    """Lower-case words only: hyphens, slashes and punctuation become spaces, possessive 's is dropped."""
+    text = str(text).lower().replace("'s ", " ").replace("’s ", " ")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+def qualifiers(text: str) -> dict:
+    """{"psychotic": "with", ...} for the "with X" / "without X" specifiers of a diagnosis."""
+    return {word: polarity for polarity, word in re.findall(r"\b(with|without) (\w+)", normalize(text))}
+
+
+@dataclass
+class Resolution:
+    """What the index found in one diagnosis string."""
+    text: str
+    entities: set = field(default_factory=set)  # Entities named in the text
+    codes: dict = field(default_factory=dict)  # F-code -> entity name (None for codes the index does not know)
+    leftover: list = field(default_factory=list)  # Words not covered by any entity name or code
+
+    def primary(self, index):
+        """The single most specific entity everything in the string points at, or None if they disagree."""
+        if None in self.codes.values():
+            return None
+        candidates = self.entities | set(self.codes.values())
+        for entity in candidates:
+            if all(index.is_within(entity, other) for other in candidates):
+                return entity
+        return None
+
+    def chapters(self, index) -> set:
+        chapters = set()
+        for entity in self.entities | set(self.codes.values()):
+            if entity is not None:
+                chapters |= {index.entities[entity].chapter, *index.entities[entity].related}
+        return chapters
+
+
+class DiagnosisIndex:
+    def __init__(self, entities=None):
+        self.entities = {}  # name -> Entity
+        self.aliases = {}  # normalized alias -> entity name
+        self.code_prefixes = {}  # ICD-10-CM code prefix -> entity name
+        for group in (ENTITIES if entities is None else entities):
+            for entity in group:
+                self.add_entity(entity)
+
+    @property
+    def version(self) -> str:
+        """Short hash of the entity table and word lists; changes whenever the index could decide differently."""
+        content = repr((sorted(self.entities.values(), key=lambda e: e.name), sorted(SPECIFIER_WORDS), sorted(FILLER_WORDS)))
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+
+    def add_entity(self, entity: Entity):
+        self.entities[entity.name] = entity
+        for alias in (entity.name, *entity.aliases):
+            self.aliases.setdefault(normalize(alias), entity.name)
+        for code in entity.codes:
+            self.code_prefixes[code] = entity.name
+        self._pattern = None
+
+    def entity_for_code(self, code: str):
+        """Entity of an ICD-10-CM code by its longest known prefix, or None."""
+        code = code.upper()
+        if SUBSTANCE_PSYCHOSIS_CODE.match(code):
+            return "substance induced psychotic disorder"
+        for end in range(len(code), 2, -1):
+            entity = self.code_prefixes.get(code[:end])
+            if entity is not None:
+                return entity
+        return None
+
+    def is_within(self, entity: str, ancestor: str) -> bool:
+        """True if `entity` is `ancestor` or one of its subtypes."""
+        while entity is not None:
+            if entity == ancestor:
+                return True
+            entity = self.entities[entity].parent
+        return False
+
+    def resolve(self, text: str) -> Resolution:
+        if self._pattern is None:
+            # Longest aliases first, so "bipolar ii disorder" wins over "bipolar ii" at the same position
+            aliases = sorted(self.aliases, key=len, reverse=True)
+            self._pattern = re.compile(r"(?<![a-z0-9])(" + "|".join(map(re.escape, aliases)) + r")(?![a-z0-9])")
+
+        resolution = Resolution(text)
+        for code in ICD_CODE.findall(str(text).upper()):
+            if code.startswith("F"):
+                resolution.codes[code] = self.entity_for_code(code)
+            else:
+                resolution.codes[code] = None  # Medical (non-F) codes are outside the index
+        words = ICD_CODE.sub(" ", str(text).upper()).lower()  # Codes are not words
+        names = normalize(words)
+        resolution.entities = {self.aliases[match.group(1)] for match in self._pattern.finditer(names)}
+        resolution.leftover = self._pattern.sub(" ", names).split()
+        return resolution
+
+    def compare(self, true_diag: str, pred_diag: str):
+        """True (match), False (clear mismatch) or None (leave it to the judge) for one (true, predicted) pair."""
+        true, pred = self.resolve(true_diag), self.resolve(pred_diag)
+        true_entity, pred_entity = true.primary(self), pred.primary(self)
+
+        # Exact or subclass: the prediction names the true entity (or a subtype), adds only specifiers, and its codes
+        # refine every code the ground truth gives. A ground truth without codes has to be just the entity name;
+        # one with codes may add specifiers, which the prediction has to repeat (a strict judge reads "chronic",
+        # "poor insight" or "adolescent-onset" as part of the diagnosis)
+        if true_entity and pred_entity and true.entities and pred.entities \
+                and self.is_within(pred_entity, true_entity) \
+                and all(word in SPECIFIER_WORDS for word in pred.leftover) \
+                and not any(qualifiers(pred_diag).get(word, polarity) != polarity
+                            for word, polarity in qualifiers(true_diag).items()):
+            if true.codes:
+                refines = pred.codes and all(pc.startswith(tc) for tc in true.codes for pc in pred.codes)
+                if refines and all(word in SPECIFIER_WORDS and (word in FILLER_WORDS or word in pred.leftover)
+                                   for word in true.leftover):
+                    return True
+            elif all(word in FILLER_WORDS for word in true.leftover):
+                return True
+
+        # Clear mismatch: each side points at exactly one DSM-5-TR chapter, and they differ
+        if true.entities and None not in true.codes.values() and None not in pred.codes.values():
+            true_chapters, pred_chapters = true.chapters(self), pred.chapters(self)
+            if len(true_chapters) == 1 and len(pred_chapters) == 1 and true_chapters != pred_chapters:
+                return False
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Show how the diagnosis index resolves a (true, predicted) pair")
+    ap.add_argument("true_diagnosis")
+    ap.add_argument("predicted_diagnosis")
+    args = ap.parse_args()
+
+    index = DiagnosisIndex()
+    for label, text in (("True", args.true_diagnosis), ("Predicted", args.predicted_diagnosis)):
+        resolution = index.resolve(text)
+        print(f"{label}: entities {sorted(resolution.entities)}, codes {resolution.codes}, "
+              f"primary {resolution.primary(index)!r}, leftover {resolution.leftover}")
+    verdict = index.compare(args.true_diagnosis, args.predicted_diagnosis)
+    print("Verdict:", {True: "match", False: "mismatch", None: "ask the judge"}[verdict])
+
+
+if __name__ == "__main__":
+    main()
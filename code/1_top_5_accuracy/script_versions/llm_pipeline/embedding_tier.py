@@ -0,0 +1,110 @@
+# Local sentence-embedding tier for the hybrid accuracy evaluation
+# Pairs such as "mdd, recurrent, severe" vs "major depressive disorder" fail the fuzzy threshold but are easy semantic
+# matches. Diagnosis strings are embedded once per run with a small CPU sentence-transformer (vectors are memoized);
+# a pair whose cosine similarity is at least `accept` is a match, one at most `reject` is not, and only the band in
+# between goes to the LLM judge.
+#
+# Every judge verdict seen during a run (fresh or cached) is logged next to the pair's similarity, so the thresholds
+# can be calibrated: run once with --embedding-shadow (the tier decides nothing, every pair reaches the cache or the
+# judge), then read the agreement summary and the embedding_calibration.csv file written
+# next to the detailed results.
+#
+# Needs the optional sentence-transformers package (pip install sentence-transformers).
+import threading
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def load_sentence_encoder(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    """encode(list of str) -> 2-D array from a CPU sentence-transformer, or None if it cannot be loaded."""
+    try:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device="cpu")  # Downloaded on first use, so this fails offline
+    except Exception as e:
+        # Optional dependency; the evaluation runs without the tier
+        print(f"Embedding tier unavailable ({type(e).__name__}: {e}); continuing without it.")
+        return None
+    return lambda texts: model.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False)
+
+
+class EmbeddingTier:
+    """
+    Cosine-similarity verdicts for (true, pred) pairs: True at or above `accept`, False at or below `reject`, None in
+    between. With shadow=True similarities are only logged against judge verdicts and nothing is decided.
+    """
+
+    def __init__(self, encoder, accept: float = 0.95, reject: float = 0.3, shadow: bool = False, model_name: str = None):
+        if reject >= accept:
+            raise ValueError(f"reject threshold ({reject}) must be below the accept threshold ({accept})")
+        self.encoder = encoder
+        self.model_name = model_name  # Recorded in the evaluation manifest's configuration
+        self.accept = accept
+        self.reject = reject
+        self.shadow = shadow
+        self.vectors = {}  # text -> unit-length vector
+        self.lock = threading.Lock()
+        self.observations = []  # (true, pred, similarity, judge verdict) for calibration
+
+    def encode(self, texts):
+        """Embed (in one batch) every text that has no memoized vector yet."""
+        with self.lock:
+            missing = [text for text in dict.fromkeys(texts) if text not in self.vectors]
+        if not missing:
+            return
+        vectors = np.asarray(self.encoder(missing), dtype=np.float64)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        with self.lock:
+            self.vectors.update(zip(missing, vectors))
+
+    def similarity(self, t: str, p: str) -> float:
+        self.encode([t, p])  # No-op for strings embedded up front
+        return float(np.dot(self.vectors[t], self.vectors[p]))
+
+    def compare(self, t: str, p: str):
+        """True (match), False (no match) or None (ask the judge)."""
+        if self.shadow:
+            return None
+        score = self.similarity(t, p)
+        if score >= self.accept:
+            return True
+        if score <= self.reject:
+            return False
+        return None
+
+    def observe(self, t: str, p: str, verdict: bool):
+        """Log a judge verdict (fresh or cached) next to the pair's similarity."""
+        score = self.similarity(t, p)
+        with self.lock:
+            self.observations.append((t, p, score, bool(verdict)))
+
+    def calibration(self) -> pd.DataFrame:
+        """Logged pairs with their similarity, judge verdict and the verdict the current thresholds would give."""
+        with self.lock:
+            df = pd.DataFrame(self.observations, columns=["true_diagnosis", "predicted_diagnosis", "similarity", "judge_match"])
+        df = df.drop_duplicates(["true_diagnosis", "predicted_diagnosis"])
+        df["tier_verdict"] = np.select([df["similarity"] >= self.accept, df["similarity"] <= self.reject],
+                                       ["match", "no match"], "judge")
+        return df.sort_values("similarity", ascending=False, ignore_index=True)
+
+
+def report_calibration(tier: EmbeddingTier, csv_path: str = None):
+    """Print how often the thresholds agree with the judge; optionally save the logged pairs for calibration."""
+    df = tier.calibration()
+    if df.empty:
+        return
+    accepted = df[df["tier_verdict"] == "match"]
+    rejected = df[df["tier_verdict"] == "no match"]
+
+    def agreement(pairs, verdict):
+        return f" ({(pairs['judge_match'] == verdict).mean():.1%} agree with the judge)" if len(pairs) else ""
+
+    print(f"Embedding tier vs judge on {len(df)} judged pairs (accept >= {tier.accept:g}, reject <= {tier.reject:g}): "
+          f"would accept {len(accepted)}{agreement(accepted, True)}, would reject {len(rejected)}{agreement(rejected, False)}, "
+          f"{len(df) - len(accepted) - len(rejected)} in the judge band.")
+    if csv_path:
+        df.to_csv(csv_path, index=False)
+        print(f"Saved embedding calibration pairs to '{csv_path}'")
@@ -0,0 +1,247 @@
+# Concurrent asyncio generation engine shared by all four provider scripts
+# Up to `max_concurrency` requests are in flight at once, so a full run takes roughly as long as
+# the slowest few calls instead of the sum of all calls
+import asyncio
+import time
+from tqdm import tqdm
+
+from .adapters import GenerationResult
+from .circuit_breaker import report_circuit_breaker
+from .hedging import report_hedging
+from .rate_limiter import EmptyResponseError, RetryPolicy, classify_error, estimate_tokens, retry_after_seconds
+from .response_cache import cache_key
+
+
+class GenerationEngine:
+    def __init__(self, adapter, system_prompt: str, user_prompt: str, max_concurrency: int = 8,
+                 cache=None, reuse_cache: bool = False, checkpoint=None, rate_limiter=None, retry_policy=None,
+                 replicate: str = None, telemetry=None, experiment: str = None, hedge_policy=None,
+                 circuit_breaker=None, reuse_terminal: bool = True):
+        self.adapter = adapter
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.max_concurrency = max_concurrency
+        self.cache = cache  # Optional ResponseCache; completed responses are always written to it
+        self.reuse_cache = reuse_cache  # Opt-in: serve cached responses instead of calling the API
+        self.checkpoint = checkpoint  # Optional JsonlCheckpoint; completed cases are appended as they finish
+        self.rate_limiter = rate_limiter  # Optional ProviderRateLimiter (requests/minute and tokens/minute)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.replicate = replicate  # Optional tag giving an independent sample its own cache keys (see experiment_matrix.py)
+        self.telemetry = telemetry  # Optional TelemetryStore; one record per case
+        self.experiment = experiment  # Label for telemetry records (a case dict may override it with "experiment")
+        self.hedge_policy = hedge_policy  # Optional HedgePolicy; slow calls get a duplicate request (see hedging.py)
+        self.circuit_breaker = circuit_breaker  # Optional CircuitBreaker; pauses this model while its endpoint fails
+        self.reuse_terminal = reuse_terminal  # Serve cached refusals/filter hits even without reuse_cache
+
+    def cache_key(self, vignette: str) -> str:
+        params = self.adapter.params if self.replicate is None else {**self.adapter.params, "replicate": self.replicate}
+        return cache_key(self.adapter.model, self.system_prompt, self.user_prompt, vignette, params)
+
+    def cached_result(self, case: dict):
+        """
+        The cached result to serve for `case`, or None to call the provider. Any cached response with reuse_cache;
+        otherwise only refusals and content-filter hits, which would come back the same and be billed again.
+        """
+        if self.cache is None:
+            return None
+        key = self.cache_key(case["vignette"])
+        if self.reuse_cache:
+            return self.cache.get(key, case_id=case["case_id"])
+        if self.reuse_terminal:
+            return self.cache.get_terminal(key, case_id=case["case_id"])
+        return None
+
+    async def _generate_one(self, semaphore, case: dict) -> GenerationResult:
+        key = self.cache_key(case["vignette"]) if self.cache is not None else None
+        cached = self.cached_result(case)
+        if cached is not None:
+            return cached
+
+        try:
+            result = await self._generate_with_retry(semaphore, case)
+        except Exception as e:
+            # One failing case must not take down the other in-flight requests
+            print(f"Error processing case {case['case_id']}: {e}")
+            return GenerationResult(case_id=case["case_id"], model_thoughts=None, model_diagnosis=None,
+                                    outcome="error", error=str(e))
+
+        # Only cache usable answers and terminal outcomes (filter/refusal) so empty responses still get rerun
+        if key is not None and result.is_complete:
+            self.cache.put(key, self.adapter.model, self.adapter.params, result)
+        return result
+
+    async def _generate_with_retry(self, semaphore, case: dict) -> GenerationResult:
+        """
+        Call the provider until a complete answer arrives, retrying retryable errors and empty responses with backoff.
+        The semaphore is released while backing off so other cases keep flowing.
+        """
+        estimated = estimate_tokens(self.system_prompt, self.user_prompt, case["vignette"])
+        attempt = 0
+        queue_wait = 0.0
+        while True:
+            attempt += 1
+            error = None
+            waiting = time.perf_counter()
+            probe = False
+            if self.circuit_breaker is not None:
+                probe = await self.circuit_breaker.wait()  # Held here while the provider is failing
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated)
+            async with semaphore:
+                queue_wait += time.perf_counter() - waiting
+                try:
+                    result = await self._call(semaphore, case, estimated)
+                except Exception as e:
+                    error = e
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record(error, probe=probe)
+
+            if error is None:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.settle(estimated, result.usage)
+                result.retries = attempt - 1
+                result.queue_wait = queue_wait
+                if result.is_complete or attempt >= self.retry_policy.max_attempts:
+                    return result  # Out of attempts: hand back the empty result so it is reported as missing
+                error = EmptyResponseError(f"empty model_diagnosis for case {case['case_id']}")
+            elif classify_error(error) == "fatal" or attempt >= self.retry_policy.max_attempts:
+                raise error
+
+            delay = self.retry_policy.delay(attempt, error)
+            retry_after = retry_after_seconds(error)
+            if retry_after is not None and self.rate_limiter is not None:
+                self.rate_limiter.pause(retry_after)  # The provider asked everyone to slow down, not just this case
+            print(f"Retrying case {case['case_id']} in {delay:.1f}s (attempt {attempt} of {self.retry_policy.max_attempts}): {error}")
+            await asyncio.sleep(delay)
+
+    async def _call(self, semaphore, case: dict, estimated: float) -> GenerationResult:
+        """
+        One provider call. With a hedge policy, a call still running after the hedge delay gets a duplicate request
+        if a concurrency slot is free (the duplicate holds its own slot, so max_concurrency is never exceeded); the
+        first successful answer wins and the other call is cancelled.
+        """
+        def generate():
+            return self.adapter.generate(case["case_id"], self.system_prompt, self.user_prompt, case["vignette"])
+
+        policy = self.hedge_policy
+        if policy is None:
+            return await generate()
+        policy.start()
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(generate())
+        delay = policy.delay()
+        if delay is not None:
+            await asyncio.wait({primary}, timeout=delay)
+        # No hedge when every concurrency slot is taken: the duplicate would push the run past max_concurrency
+        reserved = None if delay is None or primary.done() or semaphore.locked() else policy.try_fire()
+        if reserved is None:
+            result = await primary
+            policy.observe(result.latency, result.usage)
+            return result
+
+        await semaphore.acquire()  # A slot was free just above and nothing else ran since, so this does not wait
+        print(f"Hedging case {case['case_id']}: no answer after {delay:.1f}s, sending a duplicate request.")
+        hedge = asyncio.ensure_future(self._hedge(semaphore, generate, estimated))
+        pending, winner = {primary, hedge}, None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: task is hedge):  # The original wins a tie
+                    if task.exception() is None and winner is None:
+                        winner = task
+        finally:
+            for task in pending:
+                task.cancel()
+        if winner is None:
+            policy.settle(reserved, None, hedge_won=False)
+            raise primary.exception()  # Both calls failed; retry as usual
+        result = winner.result()
+        result.latency = time.perf_counter() - start  # What the case actually waited
+        policy.observe(result.latency, result.usage)
+        policy.settle(reserved, result.usage, hedge_won=winner is hedge)
+        return result
+
+    async def _hedge(self, semaphore, generate, estimated: float) -> GenerationResult:
+        """The duplicate request; holds the concurrency slot acquired for it in _call until it finishes."""
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated)  # The duplicate counts against the provider limits too
+            try:
+                result = await generate()
+            except asyncio.CancelledError:
+                raise  # The original call answered first; says nothing about the provider
+            except Exception as e:
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record(e)  # A failing duplicate is a failing call like any other
+                raise
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.record()
+            return result
+        finally:
+            semaphore.release()
+
+    async def run(self, cases: list) -> list:
+        """
+        Generate diagnoses for every case (dicts with "case_id" and "vignette").
+        Results are returned in completion order.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)  # Created here so it binds to the running event loop
+        tasks = [asyncio.create_task(self._generate_one(semaphore, case)) for case in cases]
+        experiments = {case["case_id"]: case["experiment"] for case in cases if "experiment" in case}
+
+        results = []
+        pbar = tqdm(asyncio.as_completed(tasks), total=len(tasks))  # Progress bar for tracking
+        pbar.set_description(f"Generating differential diagnoses with {self.adapter.model}")
+        for next_done in pbar:
+            result = await next_done
+            results.append(result)
+            if self.checkpoint is not None and result.is_complete:
+                self.checkpoint.append(result)
+            if self.telemetry is not None:
+                self.telemetry.record_generation(result, self.adapter.model,
+                                                 experiment=experiments.get(result.case_id, self.experiment))
+            if result.from_cache:
+                print(f"Reused cached response for case {result.case_id} ({len(results)} out of {len(tasks)}).")
+            elif result.outcome == "ok":
+                print(f"Completed case {result.case_id} ({len(results)} out of {len(tasks)}).")
+            else:
+                print(f"Case {result.case_id} finished with outcome '{result.outcome}' ({len(results)} out of {len(tasks)}).")
+        if self.cache is not None and self.reuse_cache:
+            print(f"Response cache: {self.cache.hits} hits, {self.cache.misses} misses.")
+        report_prompt_cache(results)
+        report_stream_timings(results)
+        if self.hedge_policy is not None:
+            report_hedging(self.hedge_policy)
+        if self.circuit_breaker is not None:
+            report_circuit_breaker(self.circuit_breaker)
+        report_outcomes(results)
+        return results
+
+
+def report_outcomes(results: list):
+    """Print how many cases ended as refusals, content-filter hits or errors (nothing when every case is "ok")."""
+    counts = {}
+    for result in results:
+        counts[result.outcome] = counts.get(result.outcome, 0) + 1
+    if set(counts) - {"ok"}:
+        print("Outcomes: " + ", ".join(f"{count} {outcome}" for outcome, count in sorted(counts.items())) + ".")
+
+
+def report_prompt_cache(results: list):
+    """Print how many input tokens the provider served from its prompt cache across fresh (non-cached) calls."""
+    fresh = [result.usage for result in results if result.usage and not result.from_cache]
+    input_tokens = sum(usage.get("input_tokens") or 0 for usage in fresh)
+    if input_tokens:
+        cached = sum(usage.get("cached_input_tokens") or 0 for usage in fresh)
+        written = sum(usage.get("cache_write_tokens") or 0 for usage in fresh)
+        print(f"Prompt cache: {cached} of {input_tokens} input tokens read from cache ({cached / input_tokens:.1%}), {written} written.")
+
+
+def report_stream_timings(results: list):
+    """Print median/max time-to-first-token and total stream time for streamed calls."""
+    timings = [result.timings for result in results if result.timings and result.timings.get("ttft") is not None]
+    if timings:
+        ttft = sorted(t["ttft"] for t in timings)
+        total = sorted(t["total"] for t in timings)
+        print(f"Streaming: time to first token median {ttft[len(ttft) // 2]:.1f}s (max {ttft[-1]:.1f}s), "
+              f"total median {total[len(total) // 2]:.1f}s (max {total[-1]:.1f}s) over {len(timings)} calls.")
@@ -0,0 +1,197 @@
+# Pre-flight estimate of tokens, cost and wall time for a generation run, and longest-job-first ordering
+# Every vignette is tokenized locally together with the prompts. Per-model output/reasoning token ratios and
+# seconds per output token come from past runs: the telemetry store when it has live calls for the model (exact
+# usage and latency), otherwise the predicted_diagnoses_*.json result files (visible thoughts + answer only, so
+# hidden reasoning tokens are undercounted). Wall time is simulated for the given concurrency.
+#
+# Example:
+#   python -m llm_pipeline.estimator --model gpt-5.2 --dataset ../../../datasets/combined/combined_jama.json \
+#       --prompts ../../prompts/top_5_accuracy --concurrency 8
+import argparse
+import glob
+import heapq
+import json
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from .adapters import format_user_message
+from .rate_limiter import estimate_tokens
+from .telemetry import DEFAULT_TELEMETRY_PATH, PRICES, TelemetryStore, estimate_cost
+
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "results")
+DEFAULT_OUTPUT_RATIO = 3.0  # Output tokens per input token when a model has no history at all
+DEFAULT_SECONDS_PER_OUTPUT_TOKEN = 0.02  # ~50 tokens/s when no latency history is available
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """o200k_base token count (OpenAI's tokenizer; a close enough proxy for the other providers), or ~4 chars/token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")  # Downloaded on first use, so this fails offline
+        except Exception as e:
+            # Optional dependency; fall back to the rate limiter's heuristic
+            print(f"tiktoken unavailable ({type(e).__name__}); estimating ~4 characters per token.")
+            _encoding = False
+    if not text:
+        return 0
+    return len(_encoding.encode(text, disallowed_special=())) if _encoding else estimate_tokens(text)
+
+
+def prompt_tokens(system_prompt: str, user_prompt: str, vignette: str) -> int:
+    """Input tokens of one request, built the same way the adapters build it."""
+    return count_tokens(system_prompt) + count_tokens(format_user_message(user_prompt, vignette))
+
+
+@dataclass
+class ModelHistory:
+    """Token ratios and speed of past calls of one model."""
+    model: str
+    source: str  # "telemetry", "result files" or "defaults"
+    calls: int
+    output_ratio: float  # Output tokens (incl. reasoning) per input token
+    reasoning_share: float  # Fraction of output tokens spent on reasoning
+    seconds_per_output_token: float
+    latency_source: str  # "telemetry" or "defaults"
+    case_output_tokens: dict = field(default_factory=dict)  # str(case_id) -> median output tokens of past calls
+    case_seconds: dict = field(default_factory=dict)  # str(case_id) -> median latency of past live calls
+
+
+def load_history(model: str, system_prompt: str, user_prompt: str, telemetry=None,
+                 results_dir: str = DEFAULT_RESULTS_DIR) -> ModelHistory:
+    """Median ratios from telemetry, else from result files, else defaults."""
+    seconds_per_token, latency_source = DEFAULT_SECONDS_PER_OUTPUT_TOKEN, "defaults"
+    if telemetry is not None:
+        calls = telemetry.dataframe(kind="generation")
+        calls = calls[(calls["model"] == model) & (calls["from_cache"] == 0) & (calls["outcome"] == "ok")
+                      & (calls["input_tokens"] > 0) & (calls["output_tokens"] > 0)]
+        timed = calls[(calls["batch"] == 0) & calls["latency"].notna()]
+        if len(timed):
+            seconds_per_token = (timed["latency"] / timed["output_tokens"]).median()
+            latency_source = "telemetry"
+        if len(calls):
+            # Hard vignettes stay hard across runs, so a case's own history beats the model-wide ratio
+            return ModelHistory(model, "telemetry", len(calls),
+                                output_ratio=(calls["output_tokens"] / calls["input_tokens"]).median(),
+                                reasoning_share=(calls["reasoning_tokens"].fillna(0) / calls["output_tokens"]).median(),
+                                seconds_per_output_token=seconds_per_token, latency_source=latency_source,
+                                case_output_tokens=calls.groupby("case_id")["output_tokens"].median().to_dict(),
+                                case_seconds=timed.groupby("case_id")["latency"].median().to_dict())
+
+    ratios, shares = [], []
+    for path in glob.glob(os.path.join(results_dir, "**", f"predicted_diagnoses_{model}_*.json"), recursive=True):
+        with open(path, "r") as f:
+            for row in json.load(f):
+                thoughts, answer = count_tokens(row.get("model_thoughts")), count_tokens(row.get("model_diagnosis"))
+                if answer and row.get("vignette"):
+                    ratios.append((thoughts + answer) / prompt_tokens(system_prompt, user_prompt, row["vignette"]))
+                    shares.append(thoughts / (thoughts + answer))
+    if ratios:
+        return ModelHistory(model, "result files", len(ratios), output_ratio=float(pd.Series(ratios).median()),
+                            reasoning_share=float(pd.Series(shares).median()),
+                            seconds_per_output_token=seconds_per_token, latency_source=latency_source)
+    return ModelHistory(model, "defaults", 0, DEFAULT_OUTPUT_RATIO, 0.0, seconds_per_token, latency_source)
+
+
+def predict_cases(cases: list, system_prompt: str, user_prompt: str, history: ModelHistory) -> pd.DataFrame:
+    """
+    Per-case predicted input/output/reasoning tokens, seconds and list-price cost (cases: case_id + vignette).
+    Cases with telemetry history use their own past output length and latency.
+    """
+    rows = []
+    for case in cases:
+        input_tokens = prompt_tokens(system_prompt, user_prompt, case["vignette"])
+        output_tokens = round(history.case_output_tokens.get(str(case["case_id"]), input_tokens * history.output_ratio))
+        seconds = history.case_seconds.get(str(case["case_id"]), output_tokens * history.seconds_per_output_token)
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+        rows.append({"case_id": case["case_id"], "input_tokens": input_tokens, "output_tokens": output_tokens,
+                     "reasoning_tokens": round(output_tokens * history.reasoning_share), "seconds": seconds,
+                     "cost": estimate_cost(history.model, usage)})
+    return pd.DataFrame(rows, columns=["case_id", "input_tokens", "output_tokens", "reasoning_tokens", "seconds", "cost"])
+
+
+def makespan(durations: list, concurrency: int) -> float:
+    """Wall time when jobs are dispatched in the given order to `concurrency` slots as they free up."""
+    slots = [0.0] * max(min(concurrency, len(durations)), 1)
+    for duration in durations:
+        heapq.heappush(slots, heapq.heappop(slots) + duration)
+    return max(slots)
+
+
+def longest_first(cases: list, seconds: dict) -> list:
+    """Cases ordered by predicted duration, longest first (stable for ties and unknown cases)."""
+    return sorted(cases, key=lambda case: -seconds.get(case["case_id"], 0.0))
+
+
+@dataclass
+class RunEstimate:
+    history: ModelHistory
+    predictions: pd.DataFrame
+    concurrency: int
+    makespan_file_order: float
+    makespan_longest_first: float
+
+    @property
+    def seconds(self) -> dict:
+        """case_id -> predicted seconds, for longest_first()."""
+        return dict(zip(self.predictions["case_id"], self.predictions["seconds"]))
+
+
+def estimate_run(cases: list, system_prompt: str, user_prompt: str, model: str, telemetry=None,
+                 concurrency: int = 8, results_dir: str = DEFAULT_RESULTS_DIR) -> RunEstimate:
+    history = load_history(model, system_prompt, user_prompt, telemetry, results_dir)
+    predictions = predict_cases(cases, system_prompt, user_prompt, history)
+    seconds = predictions["seconds"].tolist()
+    return RunEstimate(history, predictions, concurrency, makespan(seconds, concurrency),
+                       makespan(sorted(seconds, reverse=True), concurrency))
+
+
+def print_estimate(estimate: RunEstimate):
+    h, p = estimate.history, estimate.predictions
+    print(f"Estimate for {h.model} over {len(p)} cases (ratios from {h.source}, {h.calls} past calls; "
+          f"speed from {h.latency_source}):")
+    print(f"  Input tokens: {p['input_tokens'].sum():,} (median {p['input_tokens'].median():.0f} per case)")
+    print(f"  Output tokens: {p['output_tokens'].sum():,}, of which reasoning {p['reasoning_tokens'].sum():,}")
+    if h.model in PRICES:
+        print(f"  Cost at list price: ${p['cost'].sum():.2f} (synchronous calls, before prompt-cache discounts)")
+    else:
+        print(f"  Cost: unknown (no price for {h.model} in telemetry.PRICES)")
+    print(f"  Wall time at concurrency {estimate.concurrency}: {estimate.makespan_file_order / 60:.1f} min in file order, "
+          f"{estimate.makespan_longest_first / 60:.1f} min longest-first (slowest case {p['seconds'].max() / 60:.1f} min)")
+    if h.source == "result files":
+        print("  Note: result files hold only visible thoughts and answers; hidden reasoning tokens are not counted.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Predict tokens, cost and wall time of a generation run without calling any API")
+    ap.add_argument("--model", nargs="+", required=True)
+    ap.add_argument("--dataset", required=True, help="Vignette dataset JSON")
+    ap.add_argument("--prompts", required=True, help="Folder with system_prompt.txt and user_prompt.txt")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--telemetry-path", default=DEFAULT_TELEMETRY_PATH)
+    ap.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR, help="Searched for past predicted_diagnoses_*.json")
+    ap.add_argument("--csv", help="Also write the per-case predictions to this CSV file")
+    args = ap.parse_args()
+
+    from .runner import load_dataset, load_prompts
+
+    cases = load_dataset(args.dataset)[1][["case_id", "vignette"]].to_dict("records")
+    system_prompt, user_prompt = load_prompts(args.prompts)
+    telemetry = TelemetryStore(args.telemetry_path) if os.path.exists(args.telemetry_path) else None
+    frames = []
+    for model in args.model:
+        estimate = estimate_run(cases, system_prompt, user_prompt, model, telemetry, args.concurrency, args.results_dir)
+        print_estimate(estimate)
+        frames.append(estimate.predictions.assign(model=model))
+    if args.csv:
+        pd.concat(frames).to_csv(args.csv, index=False)
+        print(f"Saved per-case predictions to '{args.csv}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Per-case manifest for incremental re-evaluation of accuracy metrics
+# For every case of a predicted-diagnoses file the evaluator stores a digest of what the scores depend on (the parsed
+# true and predicted diagnoses plus the evaluator configuration) together with the scored result. On the next run
+# only cases whose digest changed (new model file, fixed case, filled-in diagnosis, different judge or tiers) are
+# scored again; the others are taken from the manifest and merged back into the detailed and summary CSVs.
+#
+# Manifests are plain JSON: {"<case_id>": {"digest": "...", "result": {...} or null}}, one file per model file.
+import hashlib
+import json
+import os
+
+
+def _plain(value):
+    """JSON fallback for NumPy scalars (case ids read through pandas)."""
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def case_digest(*parts) -> str:
+    """Stable hash of JSON-serializable parts (e.g. y_true, y_pred, evaluator config)."""
+    payload = json.dumps(parts, sort_keys=True, default=_plain)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(path: str) -> dict:
+    """Manifest entries keyed by str(case_id); empty when there is no (readable) manifest yet."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest '{path}' ({e}); all its cases will be scored again.")
+        return {}
+
+
+def save_manifest(path: str, entries: dict):
+    """Write atomically, so an interrupted run never leaves a truncated manifest behind."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, default=_plain)
+    os.replace(tmp_path, path)
+
+
+def merge_manifests(paths: list, path: str) -> int:
+    """Combine the manifests of every shard into one; returns the number of cases."""
+    entries = {}
+    for shard_path in paths:
+        entries.update(load_manifest(shard_path))
+    save_manifest(path, entries)
+    return len(entries)
@@ -0,0 +1,283 @@
+# Declarative experiment matrix (model x dataset x prompt) compiled into a deduplicated list of work items
+# One JSON config replaces the copy-pasted generation scripts under memorization_accuracy_comparison/. Every
+# (model, prompt, vignette, params) combination is generated at most once: fictitious_only.json and
+# medical_literature_only.json are subsets of combined_jama.json, so their cells are filled from the same responses
+import asyncio
+import glob
+import inspect
+import json
+import os
+from dataclasses import dataclass, field
+
+from . import http_clients
+from .circuit_breaker import breaker_for
+from .engine import GenerationEngine
+from .estimator import estimate_run, longest_first, print_estimate
+from .hedging import HedgePolicy
+from .rate_limiter import ProviderRateLimiter, RetryPolicy
+from .response_cache import cache_key
+from .runner import apply_results, load_dataset, load_prompts, save_predictions
+
+PROVIDERS = ("gemini", "openai", "anthropic", "deepseek")
+ADAPTER_CLASSES = {"gemini": "GeminiAdapter", "openai": "OpenAIAdapter",
+                   "anthropic": "AnthropicAdapter", "deepseek": "DeepSeekAdapter"}
+
+
+def adapter_params(provider: str, params: dict) -> dict:
+    """The generation params the adapter will end up with (its defaults filled in), as used in cache keys."""
+    from . import adapters
+
+    signature = inspect.signature(getattr(adapters, ADAPTER_CLASSES[provider]).__init__)
+    defaults = {name: parameter.default for name, parameter in signature.parameters.items()
+                if name not in ("self", "client", "model", "prompt_caching", "stream")}
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown {provider} params: {', '.join(sorted(unknown))}")
+    return {**defaults, **params}
+
+
+def make_adapter(provider: str, model: str, params: dict, prompt_caching: bool = True, stream: bool = False):
+    """
+    Adapter with an async client for `provider` on the shared connection pool (SDK retries disabled; the engine
+    retries instead).
+    """
+    from . import adapters
+
+    if provider == "gemini":
+        return adapters.GeminiAdapter(http_clients.gemini_client().aio, model, stream=stream, **params)
+    if provider == "openai":
+        return adapters.OpenAIAdapter(http_clients.openai_client(max_retries=0), model,
+                                      prompt_caching=prompt_caching, stream=stream, **params)
+    if provider == "anthropic":
+        return adapters.AnthropicAdapter(http_clients.anthropic_client(max_retries=0), model,
+                                         prompt_caching=prompt_caching, stream=stream, **params)
+    if provider == "deepseek":
+        return adapters.DeepSeekAdapter(http_clients.deepseek_client(max_retries=0), model, stream=stream, **params)
+    raise ValueError(f"Unknown provider '{provider}' (expected one of {', '.join(PROVIDERS)})")
+
+
+@dataclass
+class Cell:
+    """One output file of the matrix: predicted_diagnoses_{model}_{dataset}.json."""
+    experiment: str
+    model: str
+    dataset: str
+    prompt: str
+    replicate: str = None  # Set when the experiment asked for an independent sample instead of reusing other cells
+    keys: dict = field(default_factory=dict)  # case_id -> work item key
+
+
+@dataclass
+class WorkItem:
+    """A unique (model, prompt, vignette, params) generation; `cells` lists every cell that reads its result."""
+    key: str
+    model: str
+    prompt: str
+    replicate: str
+    case_id: object
+    vignette: str
+    experiment: str  # Experiment of the first cell that needs the item (telemetry label)
+    cells: list = field(default_factory=list)
+
+
+class ExperimentMatrix:
+    """
+    Parsed experiment config. Relative paths are resolved against the config file's folder. Layout:
+
+        {"output_dir": "...",
+         "datasets": {"combined_jama": "path.json", ...},
+         "prompts": {"top_5_accuracy": "prompts/folder", ...},
+         "models": {"gpt-5.2": {"provider": "openai", "params": {...}, "max_concurrency": 8,
+                                "requests_per_minute": null, "tokens_per_minute": null}, ...},
+         "experiments": [{"name": "main", "models": "all", "datasets": ["combined_jama"],
+                          "prompts": ["top_5_accuracy"], "replicate": null}, ...]}
+    """
+
+    def __init__(self, config: dict, base_dir: str = "."):
+        self.config = config
+        self.base_dir = base_dir
+        self.output_dir = self._path(config["output_dir"])
+        self.datasets = {name: self._path(path) for name, path in config["datasets"].items()}
+        self.prompts = {name: self._path(path) for name, path in config["prompts"].items()}
+        self.models = config["models"]
+        for model, spec in self.models.items():
+            if spec.get("provider") not in PROVIDERS:
+                raise ValueError(f"Model '{model}' needs a provider (one of {', '.join(PROVIDERS)})")
+        self.experiments = config["experiments"]
+
+    @classmethod
+    def load(cls, path: str) -> "ExperimentMatrix":
+        with open(path, "r") as f:
+            return cls(json.load(f), base_dir=os.path.dirname(os.path.abspath(path)))
+
+    def _path(self, path: str) -> str:
+        return path if os.path.isabs(path) else os.path.normpath(os.path.join(self.base_dir, path))
+
+    def _names(self, experiment: dict, kind: str, known: dict) -> list:
+        names = experiment.get(kind, "all")
+        names = list(known) if names == "all" else names
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise ValueError(f"Experiment '{experiment['name']}' refers to unknown {kind}: {', '.join(unknown)}")
+        return names
+
+    def cells(self, models: list = None, experiments: list = None) -> list:
+        """Expand every experiment into its cells, optionally restricted to some models/experiments."""
+        cells, seen = [], set()
+        for experiment in self.experiments:
+            if experiments and experiment["name"] not in experiments:
+                continue
+            for model in self._names(experiment, "models", self.models):
+                if models and model not in models:
+                    continue
+                for dataset in self._names(experiment, "datasets", self.datasets):
+                    for prompt in self._names(experiment, "prompts", self.prompts):
+                        identity = (model, dataset, prompt, experiment.get("replicate"))
+                        if identity in seen:
+                            continue  # The same cell listed by two experiments is one output file
+                        seen.add(identity)
+                        cells.append(Cell(experiment["name"], model, dataset, prompt, experiment.get("replicate")))
+        return cells
+
+
+@dataclass
+class Plan:
+    cells: list
+    items: list  # Unique work items that still need a generation
+    done: int = 0  # Unique items already in the response cache
+    shared: int = 0  # Cell entries served by an item that another cell already owns
+
+
+def build_plan(matrix: ExperimentMatrix, cache=None, models: list = None, experiments: list = None) -> Plan:
+    """Compile the matrix into unique work items, dropping those already in the response cache."""
+    prompts = {name: load_prompts(path) for name, path in matrix.prompts.items()}
+    datasets = {}
+    items, shared = {}, 0
+    cells = matrix.cells(models=models, experiments=experiments)
+    for cell in cells:
+        if cell.dataset not in datasets:
+            datasets[cell.dataset] = load_dataset(matrix.datasets[cell.dataset])[1]
+        system_prompt, user_prompt = prompts[cell.prompt]
+        spec = matrix.models[cell.model]
+        params = adapter_params(spec["provider"], spec.get("params", {}))
+        if cell.replicate is not None:
+            params["replicate"] = cell.replicate  # Same convention as GenerationEngine.cache_key
+        for case_id, vignette in datasets[cell.dataset][["case_id", "vignette"]].itertuples(index=False):
+            key = cache_key(cell.model, system_prompt, user_prompt, vignette, params)
+            cell.keys[case_id] = key
+            if key in items:
+                shared += 1
+            else:
+                items[key] = WorkItem(key, cell.model, cell.prompt, cell.replicate, case_id, vignette, cell.experiment)
+            items[key].cells.append(f"{cell.model}/{cell.dataset}/{cell.prompt}")
+
+    done = cache.cached_keys(items) if cache is not None else set()
+    return Plan(cells=cells, items=[item for key, item in items.items() if key not in done], done=len(done), shared=shared)
+
+
+def print_plan(plan: Plan):
+    print(f"{len(plan.cells)} cells, {len(plan.items) + plan.done} unique work items "
+          f"({plan.shared} cell entries shared with another cell, {plan.done} already cached).")
+    for cell in plan.cells:
+        print(f"  [{cell.experiment}] {cell.model} x {cell.dataset} x {cell.prompt}"
+              f"{f' (replicate {cell.replicate})' if cell.replicate else ''}: {len(cell.keys)} cases")
+    counts = {}
+    for item in plan.items:
+        counts[item.model] = counts.get(item.model, 0) + 1
+    for model, count in counts.items():
+        print(f"  To generate with {model}: {count}")
+
+
+def group_items(plan: Plan) -> dict:
+    """Pending work items per (model, prompt, replicate); each group is one engine run."""
+    groups = {}
+    for item in plan.items:
+        groups.setdefault((item.model, item.prompt, item.replicate), []).append(item)
+    return groups
+
+
+def estimate_plan(matrix: ExperimentMatrix, plan: Plan, telemetry=None) -> dict:
+    """RunEstimate per group of pending work items, at each model's max_concurrency (see estimator.py)."""
+    estimates = {}
+    for (model, prompt, replicate), group in group_items(plan).items():
+        system_prompt, user_prompt = load_prompts(matrix.prompts[prompt])
+        cases = [{"case_id": item.case_id, "vignette": item.vignette} for item in group]
+        estimates[(model, prompt, replicate)] = estimate_run(cases, system_prompt, user_prompt, model, telemetry,
+                                                             matrix.models[model].get("max_concurrency", 8))
+    return estimates
+
+
+def print_plan_estimate(estimates: dict):
+    for estimate in estimates.values():
+        print_estimate(estimate)
+    total = sum(estimate.predictions["cost"].sum() for estimate in estimates.values())
+    longest = max((estimate.makespan_longest_first for estimate in estimates.values()), default=0.0)
+    print(f"Whole plan: about ${total:.2f}; groups run concurrently, so about {longest / 60:.1f} min wall time.")
+
+
+def run_plan(matrix: ExperimentMatrix, plan: Plan, cache, max_attempts: int = 6, prompt_caching: bool = True,
+             stream: bool = False, telemetry=None, hedging: dict = None, circuit_breaker: dict = None) -> list:
+    """
+    Generate every pending work item, one engine per (model, prompt, replicate) group; the groups run concurrently
+    since each provider has its own rate limits. Then write one predicted_diagnoses_*.json per cell from the cache.
+    `hedging` holds HedgePolicy options (percentile, budget, ...) to hedge slow calls; one policy per model.
+    `circuit_breaker` holds CircuitBreaker options (threshold, window, cooldown); one breaker per provider and model,
+    so a failing provider pauses only its own groups.
+    """
+    policies = {}
+    groups = group_items(plan)
+    estimates = estimate_plan(matrix, plan, telemetry)
+
+    async def run_groups():
+        runs = []
+        for (model, prompt, replicate), group in groups.items():
+            spec = matrix.models[model]
+            system_prompt, user_prompt = load_prompts(matrix.prompts[prompt])
+            adapter = make_adapter(spec["provider"], model, spec.get("params", {}), prompt_caching, stream)
+            rate_limiter = None
+            if spec.get("requests_per_minute") or spec.get("tokens_per_minute"):
+                rate_limiter = ProviderRateLimiter(spec.get("requests_per_minute"), spec.get("tokens_per_minute"))
+            if hedging and model not in policies:
+                policies[model] = HedgePolicy.from_telemetry(telemetry, model, **hedging)
+            engine = GenerationEngine(adapter, system_prompt, user_prompt,
+                                      max_concurrency=spec.get("max_concurrency", 8),
+                                      cache=cache, rate_limiter=rate_limiter,
+                                      retry_policy=RetryPolicy(max_attempts=max_attempts),
+                                      replicate=replicate, telemetry=telemetry,
+                                      hedge_policy=policies.get(model),
+                                      circuit_breaker=None if circuit_breaker is None else
+                                      breaker_for(spec["provider"], model, **circuit_breaker))
+            cases = [{"case_id": item.case_id, "vignette": item.vignette, "experiment": item.experiment}
+                     for item in group]
+            runs.append(engine.run(longest_first(cases, estimates[(model, prompt, replicate)].seconds)))
+        await asyncio.gather(*runs)
+
+    if groups:
+        asyncio.run(run_groups())
+    return write_cells(matrix, plan, cache)
+
+
+def cell_model_name(cell: Cell) -> str:
+    return cell.model if cell.replicate is None else f"{cell.model}_{cell.replicate}"
+
+
+def write_cells(matrix: ExperimentMatrix, plan: Plan, cache) -> list:
+    """
+    Assemble predicted_diagnoses_*.json from the response cache for every cell that received new generations
+    or has no output file yet; returns the written paths.
+    """
+    paths = []
+    generated = {item.key for item in plan.items}
+    for cell in plan.cells:
+        dataset_name = os.path.basename(matrix.datasets[cell.dataset]).split(".")[0]
+        existing = glob.glob(os.path.join(matrix.output_dir, f"predicted_diagnoses_{cell_model_name(cell)}_{dataset_name}_*.json"))
+        if existing and generated.isdisjoint(cell.keys.values()):
+            continue  # Nothing new for this cell
+        dataset_name, dataset = load_dataset(matrix.datasets[cell.dataset])
+        results = [cache.get(key, case_id=case_id) for case_id, key in cell.keys.items()]
+        missing = [case_id for case_id, result in zip(cell.keys, results) if result is None]
+        apply_results(dataset, [result for result in results if result is not None])
+        os.makedirs(matrix.output_dir, exist_ok=True)
+        paths.append(save_predictions(dataset, cell_model_name(cell), dataset_name, matrix.output_dir))
+        print(f"Saved {paths[-1]}" + (f" ({len(missing)} cases still missing: {missing})" if missing else ""))
+    return paths
@@ -0,0 +1,160 @@
+# Local stand-in for the OpenAI Batch and Anthropic Message Batches APIs
+# Implements the subset of the synchronous SDK clients used by batch_mode.py entirely in memory, so the
+# submit -> poll -> download -> extract flow can be exercised offline without spending API credits
+#
+# Example:
+#   server = FakeBatchServer(polls_until_done=2, fail_rate=0.1)
+#   results = run_batch(OpenAIBatchBackend(server.openai_client()), adapter, cases, system_prompt, user_prompt,
+#                       poll_interval=0)
+import itertools
+import json
+import random
+from types import SimpleNamespace
+
+CANNED_THOUGHTS = "The vignette describes persistent low mood, anhedonia and neurovegetative symptoms."
+CANNED_DIAGNOSIS = ("1. Major depressive disorder, single episode, moderate - F32.1\n"
+                    "2. Persistent depressive disorder - F34.1\n"
+                    "3. Adjustment disorder with depressed mood - F43.21\n"
+                    "4. Bipolar II disorder - F31.81\n"
+                    "5. Generalized anxiety disorder - F41.1")
+
+
+def openai_response_body(body: dict, thoughts: str = CANNED_THOUGHTS, diagnosis: str = CANNED_DIAGNOSIS) -> dict:
+    """Minimal Responses API payload with a reasoning summary followed by the answer message."""
+    return {
+        "id": "resp_fake", "object": "response", "created_at": 0, "model": body.get("model"), "status": "completed",
+        "output": [
+            {"type": "reasoning", "id": "rs_fake", "summary": [{"type": "summary_text", "text": thoughts}]},
+            {"type": "message", "id": "msg_fake", "role": "assistant", "status": "completed",
+             "content": [{"type": "output_text", "text": diagnosis, "annotations": []}]},
+        ],
+        "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+        "usage": {"input_tokens": 1000, "input_tokens_details": {"cached_tokens": 0},
+                  "output_tokens": 1500, "output_tokens_details": {"reasoning_tokens": 1200}, "total_tokens": 2500},
+    }
+
+
+def anthropic_message_body(params: dict, thoughts: str = CANNED_THOUGHTS, diagnosis: str = CANNED_DIAGNOSIS) -> dict:
+    """Minimal Messages API payload with a thinking block followed by the answer text."""
+    return {
+        "id": "msg_fake", "type": "message", "role": "assistant", "model": params.get("model"),
+        "stop_reason": "end_turn", "stop_sequence": None,
+        "content": [{"type": "thinking", "thinking": thoughts, "signature": "fake"},
+                    {"type": "text", "text": diagnosis}],
+        "usage": {"input_tokens": 1000, "output_tokens": 1500},
+    }
+
+
+class _FakeBatch:
+    def __init__(self, batch_id, requests, polls_until_done):
+        self.id = batch_id
+        self.requests = requests
+        self.polls_left = polls_until_done
+        self.outputs = None  # Filled in when the batch "finishes"
+
+
+class FakeBatchServer:
+    def __init__(self, polls_until_done: int = 2, fail_rate: float = 0.0, seed: int = 0,
+                 openai_responder=openai_response_body, anthropic_responder=anthropic_message_body):
+        self.polls_until_done = polls_until_done  # Number of retrieve() calls that report "in progress"
+        self.fail_rate = fail_rate  # Fraction of requests that come back as errors
+        self.rng = random.Random(seed)
+        self.openai_responder = openai_responder
+        self.anthropic_responder = anthropic_responder
+        self.files = {}
+        self.batches = {}
+        self._ids = itertools.count(1)
+
+    def _new_id(self, prefix):
+        return f"{prefix}_{next(self._ids)}"
+
+    def _advance(self, batch: _FakeBatch) -> bool:
+        """Count one poll; returns True once the batch has finished."""
+        if batch.polls_left > 0:
+            batch.polls_left -= 1
+            return False
+        return True
+
+    def _failed(self) -> bool:
+        return self.rng.random() < self.fail_rate
+
+    # OpenAI: files.create / files.content / batches.create / batches.retrieve
+    def openai_client(self):
+        server = self
+
+        def files_create(file, purpose):
+            name, fileobj = file
+            file_id = server._new_id("file")
+            server.files[file_id] = fileobj.read().decode("utf-8")
+            return SimpleNamespace(id=file_id, filename=name, purpose=purpose)
+
+        def files_content(file_id):
+            return SimpleNamespace(text=server.files[file_id])
+
+        def batches_create(input_file_id, endpoint, completion_window):
+            requests = [json.loads(line) for line in server.files[input_file_id].splitlines() if line.strip()]
+            batch = _FakeBatch(server._new_id("batch"), requests, server.polls_until_done)
+            server.batches[batch.id] = batch
+            return SimpleNamespace(id=batch.id, endpoint=endpoint, status="validating")
+
+        def batches_retrieve(batch_id):
+            batch = server.batches[batch_id]
+            done = server._advance(batch)
+            if done and batch.outputs is None:
+                output, errors = [], []
+                for request in batch.requests:
+                    if server._failed():
+                        errors.append({"custom_id": request["custom_id"], "response": {"status_code": 500, "body": {"error": {"message": "fake server error"}}}, "error": None})
+                    else:
+                        output.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": server.openai_responder(request["body"])}, "error": None})
+                batch.outputs = (server._store_jsonl(output), server._store_jsonl(errors) if errors else None, len(errors))
+            total = len(batch.requests)
+            if not done:
+                return SimpleNamespace(id=batch_id, status="in_progress", output_file_id=None, error_file_id=None,
+                                       request_counts=SimpleNamespace(completed=0, failed=0, total=total))
+            output_file_id, error_file_id, failed = batch.outputs
+            return SimpleNamespace(id=batch_id, status="completed", output_file_id=output_file_id, error_file_id=error_file_id,
+                                   request_counts=SimpleNamespace(completed=total - failed, failed=failed, total=total))
+
+        return SimpleNamespace(files=SimpleNamespace(create=files_create, content=files_content),
+                               batches=SimpleNamespace(create=batches_create, retrieve=batches_retrieve))
+
+    def _store_jsonl(self, records):
+        file_id = self._new_id("file")
+        self.files[file_id] = "".join(json.dumps(record) + "\n" for record in records)
+        return file_id
+
+    # Anthropic: messages.batches.create / retrieve / results
+    def anthropic_client(self):
+        from anthropic.types.messages import MessageBatchIndividualResponse
+        server = self
+
+        def batches_create(requests):
+            batch = _FakeBatch(server._new_id("msgbatch"), list(requests), server.polls_until_done)
+            server.batches[batch.id] = batch
+            return SimpleNamespace(id=batch.id, processing_status="in_progress")
+
+        def batches_retrieve(batch_id):
+            batch = server.batches[batch_id]
+            done = server._advance(batch)
+            if done and batch.outputs is None:
+                batch.outputs = []
+                for request in batch.requests:
+                    if server._failed():
+                        result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": "fake server error"}}}
+                    else:
+                        result = {"type": "succeeded", "message": server.anthropic_responder(request["params"])}
+                    batch.outputs.append({"custom_id": request["custom_id"], "result": result})
+            total = len(batch.requests)
+            errored = sum(1 for item in batch.outputs or [] if item["result"]["type"] == "errored")
+            return SimpleNamespace(id=batch_id,
+                                   processing_status="ended" if done else "in_progress",
+                                   request_counts=SimpleNamespace(succeeded=total - errored if done else 0,
+                                                                  errored=errored,
+                                                                  processing=0 if done else total))
+
+        def batches_results(batch_id):
+            return [MessageBatchIndividualResponse.model_validate(item) for item in server.batches[batch_id].outputs]
+
+        batches = SimpleNamespace(create=batches_create, retrieve=batches_retrieve, results=batches_results)
+        return SimpleNamespace(messages=SimpleNamespace(batches=batches))
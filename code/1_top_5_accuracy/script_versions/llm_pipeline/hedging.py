@@ -0,0 +1,104 @@
+# Hedged requests for the long latency tail of reasoning calls
+# When a call has been running longer than a percentile of the latencies observed for the model, the engine sends a
+# duplicate request and keeps whichever answer arrives first (the other call is cancelled). A few very slow
+# vignettes decide when a whole run finishes, so trading a small, capped amount of extra spend for them pays off
+#
+# Example: hedge calls slower than the p90 latency, at most 10% extra calls and $5 extra per run
+#   python 2_generate_diagnoses_openai.py --hedge-percentile 90 --hedge-budget 0.1 --hedge-max-cost 5
+import threading
+
+from .telemetry import estimate_cost
+
+
+class HedgePolicy:
+    """
+    Latency history, budget and fired/won counters for one model. The hedge delay is the `percentile` of observed
+    latencies; no hedges are sent until `min_samples` latencies are known (seed them from telemetry with
+    `latencies=`). Hedges are capped at `budget` x primary calls and, when set, `max_extra_cost` USD.
+    """
+
+    def __init__(self, model: str, percentile: float = 95, budget: float = 0.1, max_extra_cost: float = None,
+                 min_samples: int = 20, latencies: list = None):
+        self.model = model
+        self.percentile = percentile
+        self.budget = budget
+        self.max_extra_cost = max_extra_cost
+        self.min_samples = min_samples
+        self.latencies = sorted(latencies or [])
+        self.lock = threading.Lock()
+        self.primaries = 0  # Calls started
+        self.fired = 0  # Duplicates sent
+        self.won = 0  # Duplicates that answered before the original call
+        self.extra_cost = 0.0  # Estimated USD of the duplicates (each charged as a full call)
+        self.call_costs = [0.0, 0]  # Running (sum, count) of per-call cost, to reserve budget when a hedge fires
+
+    @classmethod
+    def from_telemetry(cls, telemetry, model: str, history: int = 500, **kwargs) -> "HedgePolicy":
+        """Policy seeded with the model's most recent live, synchronous call latencies from the telemetry store."""
+        latencies = []
+        if telemetry is not None:
+            calls = telemetry.dataframe(kind="generation")
+            calls = calls[(calls["model"] == model) & (calls["from_cache"] == 0) & (calls["batch"] == 0)
+                          & (calls["outcome"] == "ok")]
+            latencies = calls.sort_values("created_at")["latency"].dropna().tail(history).tolist()
+        return cls(model, latencies=latencies, **kwargs)
+
+    def delay(self):
+        """Seconds after which a running call is hedged, or None while there is too little latency history."""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            index = min(int(len(self.latencies) * self.percentile / 100), len(self.latencies) - 1)
+            return self.latencies[index]
+
+    def start(self):
+        with self.lock:
+            self.primaries += 1
+
+    def observe(self, latency: float, usage: dict = None):
+        """Record the latency the case actually experienced (from the start of the original call) and its cost."""
+        cost = estimate_cost(self.model, usage)
+        with self.lock:
+            if cost is not None:
+                self.call_costs = [self.call_costs[0] + cost, self.call_costs[1] + 1]
+            if latency is None:
+                return
+            position = len(self.latencies)
+            while position and self.latencies[position - 1] > latency:
+                position -= 1
+            self.latencies.insert(position, latency)
+
+    def try_fire(self) -> float:
+        """
+        Reserve one hedge if the call and cost budgets allow it; returns the reserved cost (the mean cost per call so
+        far, so hedges still in flight count against the cap) or None when no hedge may be sent.
+        """
+        with self.lock:
+            if self.fired + 1 > self.budget * max(self.primaries, 1):
+                return None
+            reserved = self.call_costs[0] / self.call_costs[1] if self.call_costs[1] else 0.0
+            if self.max_extra_cost is not None and self.extra_cost + reserved > self.max_extra_cost:
+                return None
+            self.fired += 1
+            self.extra_cost += reserved
+            return reserved
+
+    def settle(self, reserved: float, usage: dict, hedge_won: bool):
+        """Count a fired hedge's outcome and swap its reservation for the winner's cost (the loser is billed alike)."""
+        cost = estimate_cost(self.model, usage)
+        with self.lock:
+            self.won += int(hedge_won)
+            self.extra_cost += (reserved if cost is None else cost) - reserved
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {"model": self.model, "primaries": self.primaries, "fired": self.fired, "won": self.won,
+                    "extra_cost": round(self.extra_cost, 4)}
+
+
+def report_hedging(policy: HedgePolicy):
+    """Print hedges fired/won and their estimated extra cost."""
+    s = policy.summary()
+    if s["primaries"]:
+        print(f"Hedging: {s['fired']} duplicate requests fired for {s['primaries']} calls, {s['won']} won "
+              f"(estimated extra cost ${s['extra_cost']:.2f}).")
@@ -0,0 +1,187 @@
+# Pooled HTTP clients shared by every provider SDK client in a process
+# One httpx client (sync and/or async) per process with explicit connection limits, long keep-alive, HTTP/2 when the
+# optional `h2` package is installed, and timeouts sized for long reasoning calls. Generation and LLM-judge clients
+# built here reuse the same warm connections instead of paying a TCP + TLS handshake per request
+#
+# Connection reuse is traced per request; report_connection_stats() prints how many requests rode on an existing
+# connection, which is the quickest way to confirm the pool is doing its job
+import os
+import threading
+from dataclasses import dataclass
+
+import httpx
+
+
+@dataclass
+class PoolConfig:
+    max_connections: int = 64  # Should be at least --max-concurrency (plus judge calls when they share the process)
+    max_keepalive_connections: int = 64  # Keep every connection warm between calls
+    keepalive_expiry: float = 60.0  # Seconds an idle connection is kept; providers drop idle connections after ~1-2 min
+    http2: bool = True  # Used only when the optional `h2` package is installed
+    connect_timeout: float = 10.0
+    read_timeout: float = 600.0  # Non-streaming xhigh/thinking calls can run for many minutes before the first byte
+    write_timeout: float = 30.0
+    pool_timeout: float = 600.0  # Waiting for a free connection is normal once every slot is busy
+
+
+class ConnectionStats:
+    """Thread-safe counters of requests and newly opened connections, per host."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.new_connections = {}
+        self.http2_requests = 0
+
+    def count_request(self, host: str):
+        with self.lock:
+            self.requests[host] = self.requests.get(host, 0) + 1
+
+    def trace(self, host: str, event: str):
+        """httpcore trace callback: count TCP connects and HTTP/2 requests."""
+        if event == "connection.connect_tcp.complete":
+            with self.lock:
+                self.new_connections[host] = self.new_connections.get(host, 0) + 1
+        elif event == "http2.send_request_headers.started":
+            with self.lock:
+                self.http2_requests += 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            requests = sum(self.requests.values())
+            connections = sum(self.new_connections.values())
+            return {"requests": requests, "new_connections": connections,
+                    "reused": max(requests - connections, 0),
+                    "reuse_rate": (requests - connections) / requests if requests else None,
+                    "http2_requests": self.http2_requests,
+                    "per_host": {host: {"requests": count, "new_connections": self.new_connections.get(host, 0)}
+                                 for host, count in self.requests.items()}}
+
+
+_config = PoolConfig()
+_clients = {}  # "sync"/"async" -> shared httpx client
+_lock = threading.Lock()
+stats = ConnectionStats()
+
+
+def add_pool_arguments(parser):
+    """--max-connections/--keepalive-expiry/--read-timeout/--no-http2 for the generation and evaluation entry points."""
+    parser.add_argument("--max-connections", type=int, default=PoolConfig.max_connections,
+                        help=f"HTTP connections kept per process, shared by all API clients (default: {PoolConfig.max_connections})")
+    parser.add_argument("--keepalive-expiry", type=float, default=PoolConfig.keepalive_expiry,
+                        help=f"Seconds an idle connection stays open for reuse (default: {PoolConfig.keepalive_expiry:g})")
+    parser.add_argument("--read-timeout", type=float, default=PoolConfig.read_timeout,
+                        help=f"Seconds to wait for response data before failing the call (default: {PoolConfig.read_timeout:g})")
+    parser.add_argument("--no-http2", action="store_true", help="Use HTTP/1.1 even when the h2 package is installed")
+    return parser
+
+
+def configure_pool(config: PoolConfig):
+    """Set the pool configuration; must run before the first client is built."""
+    global _config
+    with _lock:
+        if _clients:
+            raise RuntimeError("configure_pool() called after HTTP clients were created")
+        _config = config
+
+
+def configure_pool_from_args(args):
+    configure_pool(PoolConfig(max_connections=args.max_connections, max_keepalive_connections=args.max_connections,
+                              keepalive_expiry=args.keepalive_expiry, read_timeout=args.read_timeout,
+                              http2=not args.no_http2))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=_config.connect_timeout, read=_config.read_timeout,
+                         write=_config.write_timeout, pool=_config.pool_timeout)
+
+
+def http_client(async_: bool = True):
+    """The process-wide httpx.AsyncClient (or httpx.Client) all SDK clients share."""
+    kind = "async" if async_ else "sync"
+    with _lock:
+        if kind not in _clients:
+            limits = httpx.Limits(max_connections=_config.max_connections,
+                                  max_keepalive_connections=_config.max_keepalive_connections,
+                                  keepalive_expiry=_config.keepalive_expiry)
+            http2 = _config.http2 and _http2_available()
+            if async_:
+                async def on_request(request):
+                    host = request.url.host
+                    stats.count_request(host)
+
+                    async def trace(event, info):
+                        stats.trace(host, event)
+                    request.extensions["trace"] = trace
+
+                _clients[kind] = httpx.AsyncClient(limits=limits, timeout=timeout(), http2=http2,
+                                                   event_hooks={"request": [on_request]})
+            else:
+                def on_request(request):
+                    host = request.url.host
+                    stats.count_request(host)
+                    request.extensions["trace"] = lambda event, info: stats.trace(host, event)
+
+                _clients[kind] = httpx.Client(limits=limits, timeout=timeout(), http2=http2,
+                                              event_hooks={"request": [on_request]})
+        return _clients[kind]
+
+
+# SDK clients on the shared pool. max_retries defaults to the SDK's own default; the generation engine passes 0
+# because it retries itself (backoff with jitter, Retry-After aware)
+
+def openai_client(api_key: str = None, base_url: str = None, async_: bool = True, max_retries: int = 2):
+    from openai import AsyncOpenAI, OpenAI
+
+    cls = AsyncOpenAI if async_ else OpenAI
+    return cls(api_key=api_key or os.environ.get("OPENAI_API_KEY"), base_url=base_url, max_retries=max_retries,
+               timeout=timeout(), http_client=http_client(async_))
+
+
+def deepseek_client(async_: bool = True, max_retries: int = 2):
+    """DeepSeek's OpenAI-compatible endpoint (DEEPSEEK_BASE_URL overrides it, e.g. for the mock server)."""
+    return openai_client(api_key=os.environ.get("DEEPSEEK_API_KEY"),
+                         base_url=os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+                         async_=async_, max_retries=max_retries)
+
+
+def anthropic_client(async_: bool = True, max_retries: int = 2):
+    import anthropic
+
+    cls = anthropic.AsyncAnthropic if async_ else anthropic.Anthropic
+    return cls(max_retries=max_retries, timeout=timeout(), http_client=http_client(async_))
+
+
+def gemini_client():
+    """genai.Client on the shared pool; use `.aio` for the async interface."""
+    from google import genai
+    from google.genai import types
+
+    # google-genai sends a per-request timeout (ms) that overrides the httpx client's own
+    options = types.HttpOptions(httpx_client=http_client(async_=False), httpx_async_client=http_client(async_=True),
+                                timeout=int(_config.read_timeout * 1000))
+    return genai.Client(http_options=options)
+
+
+def connection_stats() -> dict:
+    return stats.summary()
+
+
+def report_connection_stats():
+    """Print how many requests reused a pooled connection (nothing when no request was made)."""
+    summary = stats.summary()
+    if not summary["requests"]:
+        return
+    print(f"HTTP pool: {summary['requests']} requests over {summary['new_connections']} new connections "
+          f"({summary['reuse_rate']:.0%} reused, {summary['http2_requests']} over HTTP/2).")
+    for host, counts in summary["per_host"].items():
+        print(f"  {host}: {counts['requests']} requests, {counts['new_connections']} connections")
+
@@ -0,0 +1,184 @@
+# Persistent cache of LLM-judge verdicts for the hybrid fuzzy + LLM accuracy evaluation
+# The same (true, predicted) diagnosis pairs come up across models, experiments and reruns, so every verdict is
+# stored on disk keyed by the normalized pair, the judge model and a hash of the judge prompt. Editing the prompt
+# or switching judge models starts a fresh set of verdicts instead of mixing old and new ones.
+#
+# Inspect or clear it with:
+#   python -m llm_pipeline.judge_cache stats
+#   python -m llm_pipeline.judge_cache invalidate --judge-model gpt-5-mini
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_JUDGE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "judgments.sqlite")
+
+# LLM-as-a-judge prompt (one pair per call) shared by evaluate_accuracy.py and the human-to-LLM comparison notebook
+JUDGE_PROMPT = """
+
+        Your task is to act as a strict medical adjudicator specializing in psychiatry and identify whether the predicted diagnosis is clinically equivalent to (or a valid subclass of) the true diagnosis. Your standards are exacting, and you must consider the nuances of each diagnosis carefully. As much as possible, adhere to the diagnostic language laid out in the DSM-5-TR, and utilize the included ICD-10 F-codes to aid your determination.
+
+        True Diagnosis: "{true_diagnosis}"
+        Predicted Diagnosis: "{predicted_diagnosis}"
+
+        Return JSON ONLY: {{ "match": <true/false> }}
+        """
+
+
+# Batched variant: the unresolved true x predicted matrix of one case in a single structured-output call
+BATCH_JUDGE_PROMPT = """
+
+        Your task is to act as a strict medical adjudicator specializing in psychiatry and identify, for every pair of a true diagnosis and a predicted diagnosis below, whether the predicted diagnosis is clinically equivalent to (or a valid subclass of) the true diagnosis. Judge each pair on its own, independently of the other pairs. Your standards are exacting, and you must consider the nuances of each diagnosis carefully. As much as possible, adhere to the diagnostic language laid out in the DSM-5-TR, and utilize the included ICD-10 F-codes to aid your determination.
+
+        True Diagnoses:
+{true_diagnoses}
+
+        Predicted Diagnoses:
+{predicted_diagnoses}
+
+        Return JSON ONLY: {{ "matches": [[<true/false>, ...], ...] }} with one row per true diagnosis (T1, T2, ...) in order, each row holding one entry per predicted diagnosis (P1, P2, ...) in order.
+        """
+
+
+def format_batch_prompt(true_diagnoses: list, predicted_diagnoses: list) -> str:
+    def listing(prefix, items):
+        return "\n".join(f'        {prefix}{index}. "{item}"' for index, item in enumerate(items, start=1))
+    return BATCH_JUDGE_PROMPT.format(true_diagnoses=listing("T", true_diagnoses),
+                                     predicted_diagnoses=listing("P", predicted_diagnoses))
+
+
+def prompt_version(prompt: str = JUDGE_PROMPT) -> str:
+    """Short hash of a judge prompt template; part of every cache key."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def normalize_diagnosis(text: str) -> str:
+    """Lower-case with collapsed whitespace, so trivially different spellings share one verdict."""
+    return " ".join(str(text).lower().split())
+
+
+class JudgeCache:
+    """
+    Judge verdicts in SQLite (WAL), safe to share between concurrent evaluation processes and threads.
+    Use path=":memory:" for a cache that lives only as long as the process.
+    """
+
+    def __init__(self, path: str = DEFAULT_JUDGE_CACHE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)  # Array-job shards share the file
+        self.conn.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS judgments (
+                true_diagnosis TEXT NOT NULL,
+                predicted_diagnosis TEXT NOT NULL,
+                judge_model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                match INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (true_diagnosis, predicted_diagnosis, judge_model, prompt_version)
+            )
+        """)
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.in_flight = {}  # Pair key -> threading.Event, set once the worker asking the judge has stored the verdict
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(true_diag: str, pred_diag: str, judge_model: str, version: str) -> tuple:
+        return normalize_diagnosis(true_diag), normalize_diagnosis(pred_diag), judge_model, version
+
+    def claim(self, true_diag: str, pred_diag: str, judge_model: str, version: str):
+        """
+        In-flight deduplication for concurrent workers: returns None if the caller now owns the pair (ask the judge,
+        put() the verdict, then release()), or an Event to wait on while another worker is asking about it.
+        """
+        key = self.key(true_diag, pred_diag, judge_model, version)
+        with self.lock:
+            if key in self.in_flight:
+                return self.in_flight[key]
+            self.in_flight[key] = threading.Event()
+            return None
+
+    def release(self, true_diag: str, pred_diag: str, judge_model: str, version: str):
+        """Wake the workers waiting on a claimed pair (also after a failed call; they then ask themselves)."""
+        with self.lock:
+            event = self.in_flight.pop(self.key(true_diag, pred_diag, judge_model, version), None)
+        if event is not None:
+            event.set()
+
+    def get(self, true_diag: str, pred_diag: str, judge_model: str, version: str):
+        """The cached verdict (True/False) for the pair, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT match FROM judgments WHERE true_diagnosis = ? AND predicted_diagnosis = ? "
+                "AND judge_model = ? AND prompt_version = ?",
+                self.key(true_diag, pred_diag, judge_model, version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return bool(row[0])
+
+    def put(self, true_diag: str, pred_diag: str, judge_model: str, version: str, match: bool):
+        """Store a verdict; the first one written wins if two processes judged the same pair concurrently."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO judgments VALUES (?, ?, ?, ?, ?, ?)",
+                (*self.key(true_diag, pred_diag, judge_model, version), int(match), time.time())
+            )
+            self.conn.commit()
+
+    def invalidate(self, judge_model: str = None, version: str = None) -> int:
+        """Delete the verdicts of one judge model (optionally one prompt version), or everything."""
+        query, params = "DELETE FROM judgments", []
+        conditions = [(column, value) for column, value in (("judge_model", judge_model), ("prompt_version", version))
+                      if value is not None]
+        if conditions:
+            query += " WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)
+            params = [value for _, value in conditions]
+        with self.lock:
+            cursor = self.conn.execute(query, params)
+            self.conn.commit()
+        return cursor.rowcount
+
+    def stats(self) -> list:
+        """(judge_model, prompt_version, verdicts, matches) rows."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT judge_model, prompt_version, COUNT(*), SUM(match) FROM judgments "
+                "GROUP BY judge_model, prompt_version ORDER BY judge_model, prompt_version"
+            ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or invalidate the LLM-judge verdict cache")
+    ap.add_argument("command", choices=["stats", "invalidate"])
+    ap.add_argument("--judge-cache-path", default=DEFAULT_JUDGE_CACHE_PATH)
+    ap.add_argument("--judge-model", help="Only invalidate verdicts of this judge model")
+    ap.add_argument("--prompt-version", help="Only invalidate verdicts for this prompt version")
+    ap.add_argument("--all", action="store_true", help="Required to invalidate every verdict")
+    args = ap.parse_args()
+
+    cache = JudgeCache(args.judge_cache_path)
+    if args.command == "stats":
+        print(f"Current prompt versions: {prompt_version(JUDGE_PROMPT)} (per pair), {prompt_version(BATCH_JUDGE_PROMPT)} (batched)")
+        for judge_model, version, count, matches in cache.stats():
+            print(f"{judge_model}\t{version}\t{count} verdicts\t{matches} matches")
+    else:
+        if args.judge_model is None and args.prompt_version is None and not args.all:
+            ap.error("invalidate needs --judge-model, --prompt-version or --all")
+        print(f"Deleted {cache.invalidate(args.judge_model, args.prompt_version)} cached verdicts.")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+# Local mock of the four provider APIs for load and fault testing without spending API credits
+# Speaks the wire formats the adapters use (OpenAI Responses incl. responses.parse, Anthropic Messages with thinking,
+# Gemini generateContent with thought parts, DeepSeek chat.completions with reasoning_content), streaming included,
+# with lognormal latencies and injected 429/500 errors, content filters, refusals and truncated outputs
+#
+# Example:
+#   python -m llm_pipeline.mock_server --port 8089 --latency-median 2 --rate-limit-rate 0.05 --server-error-rate 0.02
+#   eval "$(python -m llm_pipeline.mock_server --port 8089 --print-env)"   # Point the SDKs at the mock
+#   python 2_generate_diagnoses_openai.py --no-cache
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .fake_batch_server import CANNED_DIAGNOSIS, CANNED_THOUGHTS, anthropic_message_body, openai_response_body
+
+REFUSAL_TEXT = "I'm sorry, but I can't help with that request."
+FAULTS = ("rate_limit", "server_error", "content_filter", "refusal", "truncated")
+
+
+@dataclass
+class MockConfig:
+    latency_median: float = 1.0  # Seconds; latencies are lognormal around this median
+    latency_sigma: float = 0.5  # Spread of log(latency); 0 gives a fixed latency
+    ttft_fraction: float = 0.3  # Share of the latency spent before the first streamed token
+    rate_limit_rate: float = 0.0  # Fraction of requests answered with 429 + Retry-After
+    retry_after: float = 1.0  # Seconds advertised in Retry-After
+    server_error_rate: float = 0.0  # Fraction answered with 500
+    content_filter_rate: float = 0.0  # Fraction blocked by the provider's content filter
+    refusal_rate: float = 0.0  # Fraction where the model refuses to answer
+    truncated_rate: float = 0.0  # Fraction that runs out of output tokens before the answer
+    judge_match_rate: float = 0.3  # Share of structured-output judge calls that answer {"match": true}
+    output_tokens: int = 1500
+    reasoning_tokens: int = 1200
+    seed: int = 0
+
+
+def _estimate_tokens(body: dict) -> int:
+    return max(len(json.dumps(body, ensure_ascii=False)) // 4, 1)
+
+
+def _chunks(text: str, n: int = 5) -> list:
+    """Split text into about n streaming deltas."""
+    size = max(math.ceil(len(text) / n), 1)
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _judge_verdict(body: dict, rate: float) -> bool:
+    """Deterministic pseudo-random verdict so repeated judge calls agree with each other."""
+    digest = hashlib.sha256(json.dumps(body.get("input"), sort_keys=True).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < rate
+
+
+def _judge_matrix(body: dict, rate: float) -> list:
+    """Verdict matrix for a batched judge prompt (T1./P1. listings), one deterministic verdict per pair."""
+    text = json.dumps(body.get("input"))
+    true_items = re.findall(r'T\d+\. \\"(.*?)\\"', text)
+    pred_items = re.findall(r'P\d+\. \\"(.*?)\\"', text)
+    return [[_judge_verdict({"input": [t, p]}, rate) for p in pred_items] for t in true_items]
+
+
+# Provider payload builders ----------------------------------------------------------------------------------------
+
+def openai_body(body: dict, fault: str, config: MockConfig, input_tokens: int) -> dict:
+    text_format = (body.get("text") or {}).get("format") or {}
+    if text_format.get("type") == "json_schema":  # responses.parse (LLM judge)
+        if "matches" in json.dumps(text_format.get("schema")):  # Batched judge: one call per case
+            verdict = {"matches": _judge_matrix(body, config.judge_match_rate)}
+        else:
+            pair = re.findall(r'(?:True|Predicted) Diagnosis: \\"(.*?)\\"', json.dumps(body.get("input")))
+            # Same verdict as the pair's cell in a batched call, so both judge modes can be compared
+            verdict = {"match": _judge_verdict({"input": pair} if len(pair) == 2 else body, config.judge_match_rate)}
+        response = openai_response_body(body, thoughts="", diagnosis=json.dumps(verdict))
+        response["output"][0]["summary"] = []
+    else:
+        response = openai_response_body(body)
+    response["id"] = f"resp_mock_{random.getrandbits(48):012x}"
+    response["usage"].update(input_tokens=input_tokens, output_tokens=config.output_tokens,
+                             total_tokens=input_tokens + config.output_tokens)
+    response["usage"]["output_tokens_details"]["reasoning_tokens"] = config.reasoning_tokens
+    if fault == "content_filter":
+        response.update(status="incomplete", incomplete_details={"reason": "content_filter"}, output=[])
+    elif fault == "truncated":
+        response.update(status="incomplete", incomplete_details={"reason": "max_output_tokens"}, output=response["output"][:1])
+    elif fault == "refusal":
+        response["output"][1]["content"] = [{"type": "refusal", "refusal": REFUSAL_TEXT}]
+    return response
+
+
+def anthropic_body(body: dict, fault: str, config: MockConfig, input_tokens: int) -> dict:
+    message = anthropic_message_body(body)
+    message["id"] = f"msg_mock_{random.getrandbits(48):012x}"
+    message["usage"] = {"input_tokens": input_tokens, "output_tokens": config.output_tokens,
+                        "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+    if fault in ("refusal", "content_filter"):  # Claude has no separate content filter; both surface as a refusal
+        message.update(stop_reason="refusal", content=[])
+    elif fault == "truncated":
+        message.update(stop_reason="max_tokens", content=message["content"][:1])
+    return message
+
+
+def gemini_body(model: str, fault: str, config: MockConfig, input_tokens: int) -> dict:
+    usage = {"promptTokenCount": input_tokens, "candidatesTokenCount": config.output_tokens - config.reasoning_tokens,
+             "thoughtsTokenCount": config.reasoning_tokens, "totalTokenCount": input_tokens + config.output_tokens}
+    if fault == "content_filter":
+        return {"promptFeedback": {"blockReason": "SAFETY"}, "usageMetadata": {"promptTokenCount": input_tokens},
+                "modelVersion": model}
+    parts = [{"text": CANNED_THOUGHTS, "thought": True}, {"text": REFUSAL_TEXT if fault == "refusal" else CANNED_DIAGNOSIS}]
+    finish_reason = "STOP"
+    if fault == "truncated":
+        parts, finish_reason = parts[:1], "MAX_TOKENS"
+    return {"candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": finish_reason, "index": 0}],
+            "usageMetadata": usage, "modelVersion": model}
+
+
+def deepseek_body(body: dict, fault: str, config: MockConfig, input_tokens: int) -> dict:
+    content, finish_reason = CANNED_DIAGNOSIS, "stop"
+    if fault == "content_filter":
+        content, finish_reason = "", "content_filter"
+    elif fault == "truncated":
+        content, finish_reason = "", "length"
+    elif fault == "refusal":
+        content = REFUSAL_TEXT
+    return {"id": f"mock-{random.getrandbits(48):012x}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": finish_reason,
+                         "message": {"role": "assistant", "content": content, "reasoning_content": CANNED_THOUGHTS}}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": config.output_tokens,
+                      "total_tokens": input_tokens + config.output_tokens, "prompt_cache_hit_tokens": 0,
+                      "prompt_cache_miss_tokens": input_tokens,
+                      "completion_tokens_details": {"reasoning_tokens": config.reasoning_tokens}}}
+
+
+def error_body(provider: str, status: int) -> dict:
+    message = "Rate limit reached (mock)" if status == 429 else "Internal server error (mock)"
+    if provider == "anthropic":
+        return {"type": "error", "error": {"type": "rate_limit_error" if status == 429 else "api_error", "message": message}}
+    if provider == "gemini":
+        return {"error": {"code": status, "message": message, "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}}
+    return {"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error", "code": None}}
+
+
+# Streaming event builders (list of (event name or None, payload)) --------------------------------------------------
+
+def openai_events(response: dict) -> list:
+    events, sequence = [], 0
+
+    def add(payload):
+        nonlocal sequence
+        events.append((payload["type"], {**payload, "sequence_number": sequence}))
+        sequence += 1
+
+    add({"type": "response.created", "response": {**response, "status": "in_progress", "output": []}})
+    for index, item in enumerate(response["output"]):
+        if item["type"] == "reasoning":
+            for summary_index, summary in enumerate(item["summary"]):
+                for delta in _chunks(summary["text"]):
+                    add({"type": "response.reasoning_summary_text.delta", "item_id": item["id"], "output_index": index,
+                         "summary_index": summary_index, "delta": delta})
+        elif item["type"] == "message":
+            for content_index, content in enumerate(item["content"]):
+                for delta in _chunks(content.get("text", "")) if content["type"] == "output_text" else []:
+                    add({"type": "response.output_text.delta", "item_id": item["id"], "output_index": index,
+                         "content_index": content_index, "delta": delta, "logprobs": []})
+    add({"type": "response.incomplete" if response["status"] == "incomplete" else "response.completed", "response": response})
+    return events
+
+
+def anthropic_events(message: dict) -> list:
+    usage = message["usage"]
+    events = [("message_start", {"type": "message_start",
+                                 "message": {**message, "content": [], "stop_reason": None,
+                                             "usage": {**usage, "output_tokens": 1}}})]
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "thinking":
+            events.append(("content_block_start", {"type": "content_block_start", "index": index,
+                                                   "content_block": {"type": "thinking", "thinking": "", "signature": ""}}))
+            events += [("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                "delta": {"type": "thinking_delta", "thinking": delta}})
+                       for delta in _chunks(block["thinking"])]
+            events.append(("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                   "delta": {"type": "signature_delta", "signature": block["signature"]}}))
+        else:
+            events.append(("content_block_start", {"type": "content_block_start", "index": index,
+                                                   "content_block": {"type": "text", "text": ""}}))
+            events += [("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                "delta": {"type": "text_delta", "text": delta}})
+                       for delta in _chunks(block["text"])]
+        events.append(("content_block_stop", {"type": "content_block_stop", "index": index}))
+    events.append(("message_delta", {"type": "message_delta",
+                                     "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                                     "usage": {"output_tokens": usage["output_tokens"]}}))
+    events.append(("message_stop", {"type": "message_stop"}))
+    return events
+
+
+def gemini_events(response: dict) -> list:
+    candidates = response.get("candidates")
+    if not candidates:
+        return [(None, response)]
+    events = []
+    for part in candidates[0]["content"]["parts"]:
+        for delta in _chunks(part["text"]):
+            events.append((None, {"candidates": [{"content": {"role": "model", "parts": [{**part, "text": delta}]},
+                                                  "index": 0}], "modelVersion": response["modelVersion"]}))
+    events.append((None, {"candidates": [{"content": {"role": "model", "parts": [{"text": ""}]},
+                                          "finishReason": candidates[0]["finishReason"], "index": 0}],
+                          "usageMetadata": response["usageMetadata"], "modelVersion": response["modelVersion"]}))
+    return events
+
+
+def deepseek_events(completion: dict) -> list:
+    choice = completion["choices"][0]
+    base = {key: completion[key] for key in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+
+    def chunk(delta, finish_reason=None):
+        return (None, {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]})
+
+    events = [chunk({"role": "assistant", "content": None, "reasoning_content": delta})
+              for delta in _chunks(choice["message"]["reasoning_content"])]
+    events += [chunk({"content": delta}) for delta in _chunks(choice["message"]["content"]) if delta]
+    events.append(chunk({}, choice["finish_reason"]))
+    events.append((None, {**base, "choices": [], "usage": completion["usage"]}))
+    events.append((None, "[DONE]"))
+    return events
+
+
+# Server -----------------------------------------------------------------------------------------------------------
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so client connection pooling behaves as against the real APIs
+
+    def log_message(self, format, *args):
+        pass  # Per-request logging would drown the pipeline's own output
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.mock.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        mock = self.server.mock
+        path, _, query = self.path.partition("?")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if path.endswith("/responses"):
+            provider, model = "openai", body.get("model")
+        elif path.endswith("/messages"):
+            provider, model = "anthropic", body.get("model")
+        elif ":generateContent" in path or ":streamGenerateContent" in path:
+            provider, model = "gemini", path.rsplit("/", 1)[-1].split(":")[0]
+        elif path.endswith("/chat/completions"):
+            provider, model = "deepseek", body.get("model")
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {path}"}})
+            return
+        stream = bool(body.get("stream")) or ":streamGenerateContent" in path
+
+        fault, latency = mock.draw()
+        mock.count(provider, fault)
+        if fault in ("rate_limit", "server_error"):
+            time.sleep(latency * 0.1)  # Errors come back faster than full generations
+            status = 429 if fault == "rate_limit" else 500
+            headers = {"retry-after": f"{mock.config.retry_after:g}"} if status == 429 else {}
+            self._send_json(status, error_body(provider, status), headers)
+            return
+
+        input_tokens = _estimate_tokens(body)
+        if provider == "openai":
+            payload, events = openai_body(body, fault, mock.config, input_tokens), openai_events
+        elif provider == "anthropic":
+            payload, events = anthropic_body(body, fault, mock.config, input_tokens), anthropic_events
+        elif provider == "gemini":
+            payload, events = gemini_body(model, fault, mock.config, input_tokens), gemini_events
+        else:
+            payload, events = deepseek_body(body, fault, mock.config, input_tokens), deepseek_events
+
+        if not stream:
+            time.sleep(latency)
+            self._send_json(200, payload)
+            return
+        self._send_stream(events(payload), latency)
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, events: list, latency: float):
+        """Server-sent events over chunked encoding: first event after the TTFT, the rest spread over the remainder."""
+        ttft = latency * self.server.mock.config.ttft_fraction
+        gap = (latency - ttft) / max(len(events) - 1, 1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(ttft)
+        for index, (name, payload) in enumerate(events):
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            event = (f"event: {name}\n" if name else "") + f"data: {data}\n\n"
+            encoded = event.encode("utf-8")
+            self.wfile.write(f"{len(encoded):x}\r\n".encode("ascii") + encoded + b"\r\n")
+            self.wfile.flush()
+            if index < len(events) - 1:
+                time.sleep(gap)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def mock_env(url: str) -> dict:
+    """Environment variables that point the SDKs (and the DeepSeek base_url) at a mock server on `url`."""
+    return {"OPENAI_BASE_URL": f"{url}/v1", "ANTHROPIC_BASE_URL": url, "GOOGLE_GEMINI_BASE_URL": url,
+            "DEEPSEEK_BASE_URL": url, "OPENAI_API_KEY": "mock", "ANTHROPIC_API_KEY": "mock",
+            "GEMINI_API_KEY": "mock", "DEEPSEEK_API_KEY": "mock"}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (cancelled hedges, timeouts) are part of the tests, not server errors
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class MockServer:
+    """Threaded mock API server; start() runs it in the background and returns the base URL."""
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self) -> dict:
+        return mock_env(self.url)
+
+    def draw(self) -> tuple:
+        """(fault or None, latency in seconds) for one request."""
+        c = self.config
+        with self.lock:
+            roll = self.rng.random()
+            latency = c.latency_median * math.exp(self.rng.gauss(0, c.latency_sigma)) if c.latency_sigma else c.latency_median
+        for fault, rate in zip(FAULTS, (c.rate_limit_rate, c.server_error_rate, c.content_filter_rate,
+                                        c.refusal_rate, c.truncated_rate)):
+            if roll < rate:
+                return fault, latency
+            roll -= rate
+        return None, latency
+
+    def count(self, provider: str, fault: str):
+        with self.lock:
+            self.counts[(provider, fault or "ok")] += 1
+
+    def stats(self) -> dict:
+        """{provider: {outcome: count}} of the requests served so far."""
+        with self.lock:
+            stats = {}
+            for (provider, outcome), count in self.counts.items():
+                stats.setdefault(provider, {})[outcome] = count
+            return stats
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local mock of the OpenAI/Anthropic/Gemini/DeepSeek APIs")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--print-env", action="store_true", help="Print export lines for the SDK base URLs and exit")
+    for name, default in vars(MockConfig()).items():
+        ap.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = ap.parse_args()
+
+    config = MockConfig(**{name: getattr(args, name) for name in vars(MockConfig())})
+    if args.print_env:
+        for name, value in mock_env(f"http://{args.host}:{args.port}").items():
+            print(f"export {name}={value}")
+        return
+    server = MockServer(config, args.host, args.port)
+    print(f"Mock API server on {server.url} (GET /stats for request counts); point the SDKs at it with:")
+    for name, value in server.env().items():
+        print(f"  export {name}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Shared rate-limit and retry layer for the generation engine
+# A per-provider token bucket for requests/minute and tokens/minute, exponential backoff with full jitter,
+# Retry-After support and classification of retryable versus fatal errors
+import asyncio
+import random
+import time
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}  # 529 = Anthropic "overloaded"
+RETRYABLE_ERROR_NAMES = {  # Transport-level failures raised by the SDKs / httpx, matched by class name
+    "APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ReadError", "ReadTimeout",
+    "RemoteProtocolError", "WriteError", "PoolTimeout", "TimeoutError", "ServerError",
+}
+
+
+class EmptyResponseError(Exception):
+    """The call succeeded but returned no usable diagnosis list (previously handled by the post-hoc rerun loop)."""
+
+
+def status_code_of(exc):
+    """HTTP status of an SDK error (openai/anthropic use .status_code, google-genai uses .code)."""
+    for attribute in ("status_code", "code"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def classify_error(exc) -> str:
+    """Returns "retryable" or "fatal"."""
+    if isinstance(exc, (EmptyResponseError, asyncio.TimeoutError, ConnectionError)):
+        return "retryable"
+    status = status_code_of(exc)
+    if status is not None:
+        return "retryable" if status in RETRYABLE_STATUS_CODES else "fatal"  # e.g. 400/401/403/404 will not fix themselves
+    if any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(exc).__mro__):
+        return "retryable"
+    return "fatal"
+
+
+def retry_after_seconds(exc):
+    """Seconds requested by a Retry-After / retry-after-ms header, if the error carries one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None  # HTTP-date form; fall back to our own backoff
+    return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 6, base_delay: float = 2.0, max_delay: float = 120.0, rng=None):
+        self.max_attempts = max_attempts  # Total attempts per case, including the first
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt: int, exc=None) -> float:
+        """Backoff before attempt `attempt + 1`: Retry-After if given, else full jitter on base * 2^(attempt-1)."""
+        retry_after = retry_after_seconds(exc) if exc is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class TokenBucket:
+    """Continuous-refill bucket holding up to `per_minute` units; the level may go negative to record debt."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0  # Units refilled per second
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)  # A single oversized request only has to wait for a full bucket
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+class ProviderRateLimiter:
+    """Requests/minute and tokens/minute limits shared by every in-flight request to one provider."""
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0  # Set from Retry-After so every request backs off, not just the one that got the 429
+        self.lock = None
+
+    async def acquire(self, estimated_tokens: float = 0):
+        if self.lock is None:
+            self.lock = asyncio.Lock()  # Created lazily so it binds to the running event loop
+        async with self.lock:  # First come, first served
+            while True:
+                wait = max(self.paused_until - time.monotonic(),
+                           self.requests.wait_time(1) if self.requests else 0.0,
+                           self.tokens.wait_time(estimated_tokens) if self.tokens else 0.0)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.consume(1)
+            if self.tokens:
+                self.tokens.consume(estimated_tokens)
+
+    def settle(self, estimated_tokens: float, usage: dict):
+        """Replace the up-front estimate with the real token count once the response is in."""
+        if self.tokens and usage:
+            actual = (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+            self.tokens.consume(actual - estimated_tokens)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough prompt size (about 4 characters per token) used to reserve tokens/minute budget before a call."""
+    return sum(len(text) for text in texts) // 4
@@ -0,0 +1,147 @@
+# Content-addressed on-disk cache for model generations
+# Entries are keyed by a hash of (model, system_prompt, user_prompt, vignette, generation parameters), so reruns after a
+# crash and the fictitious_only / medical_literature_only subsets of combined_jama.json reuse earlier calls for free
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from .adapters import TERMINAL_OUTCOMES, GenerationResult
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "responses.sqlite")
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str, vignette: str, params: dict) -> str:
+    """SHA-256 of everything that determines a generation; any change to prompts or parameters gives a new key."""
+    payload = json.dumps({
+        "model": model,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "vignette": vignette,
+        "params": params,  # Reasoning effort, thinking budget, temperature, ...
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)  # Array-job shards share the file; wait out short write locks
+        self.conn.execute("PRAGMA journal_mode=WAL")  # Readers (e.g. another Slurm job) do not block the writer
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                params TEXT NOT NULL,
+                model_thoughts TEXT,
+                model_diagnosis TEXT,
+                outcome TEXT NOT NULL,
+                usage TEXT,
+                raw_response TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, case_id=None):
+        """Returns a GenerationResult for `case_id` if `key` is cached, otherwise None."""
+        row = self.conn.execute(
+            "SELECT model_thoughts, model_diagnosis, outcome, usage, raw_response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._result(row, case_id)
+
+    def get_terminal(self, key: str, case_id=None):
+        """
+        The cached result for `key` only if it is a refusal or content-filter hit (does not touch the hit/miss
+        counters). These are served even without --reuse-cache, so a known refusal is never re-billed.
+        """
+        row = self.conn.execute(
+            "SELECT model_thoughts, model_diagnosis, outcome, usage, raw_response FROM responses "
+            f"WHERE key = ? AND outcome IN ({','.join('?' * len(TERMINAL_OUTCOMES))})", (key, *TERMINAL_OUTCOMES)
+        ).fetchone()
+        return None if row is None else self._result(row, case_id)
+
+    @staticmethod
+    def _result(row, case_id) -> GenerationResult:
+        thoughts, diagnosis, outcome, usage, raw = row
+        return GenerationResult(case_id=case_id,
+                                model_thoughts=thoughts,
+                                model_diagnosis=diagnosis,
+                                outcome=outcome,
+                                usage=json.loads(usage) if usage else {},
+                                raw_response=json.loads(raw) if raw else None,
+                                from_cache=True)
+
+    def cached_keys(self, keys) -> set:
+        """The subset of `keys` that has a stored response (does not touch the hit/miss counters)."""
+        keys = list(keys)
+        found = set()
+        for start in range(0, len(keys), 500):  # Stay below SQLite's bound-parameter limit
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(f"SELECT key FROM responses WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            found.update(row[0] for row in rows)
+        return found
+
+    def put(self, key: str, model: str, params: dict, result: GenerationResult):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, model, json.dumps(params, sort_keys=True), result.model_thoughts, result.model_diagnosis,
+             result.outcome, json.dumps(result.usage), json.dumps(result.raw_response), time.time())
+        )
+        self.conn.commit()
+
+    def invalidate(self, key: str = None, model: str = None, params: dict = None) -> int:
+        """Delete one key, every entry for a model (optionally only with the given params), or everything."""
+        if key is not None:
+            cursor = self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        elif model is not None and params is not None:
+            cursor = self.conn.execute("DELETE FROM responses WHERE model = ? AND params = ?",
+                                       (model, json.dumps(params, sort_keys=True)))
+        elif model is not None:
+            cursor = self.conn.execute("DELETE FROM responses WHERE model = ?", (model,))
+        else:
+            cursor = self.conn.execute("DELETE FROM responses")
+        self.conn.commit()
+        return cursor.rowcount
+
+    def stats(self) -> list:
+        """(model, outcome, count) rows for a quick look at what is stored."""
+        return self.conn.execute(
+            "SELECT model, outcome, COUNT(*) FROM responses GROUP BY model, outcome ORDER BY model, outcome"
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or invalidate the generation response cache")
+    ap.add_argument("command", choices=["stats", "invalidate"])
+    ap.add_argument("--cache-path", default=DEFAULT_CACHE_PATH)
+    ap.add_argument("--model", help="Only invalidate entries for this model")
+    ap.add_argument("--key", help="Only invalidate this cache key")
+    ap.add_argument("--all", action="store_true", help="Required to invalidate every entry")
+    args = ap.parse_args()
+
+    cache = ResponseCache(args.cache_path)
+    if args.command == "stats":
+        for model, outcome, count in cache.stats():
+            print(f"{model}\t{outcome}\t{count}")
+    else:
+        if args.key is None and args.model is None and not args.all:
+            ap.error("invalidate needs --key, --model or --all")
+        print(f"Deleted {cache.invalidate(key=args.key, model=args.model)} cached responses.")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
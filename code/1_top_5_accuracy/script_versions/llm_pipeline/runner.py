@@ -0,0 +1,298 @@
+# Script-level helpers shared by the generate_diagnoses entry points
+# (loading the dataset and prompts, running the engine, writing predicted_diagnoses_*.json)
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import pandas as pd
+
+from .batch_mode import BatchState, run_batch
+from .checkpoint import JsonlCheckpoint, checkpoint_path
+from .circuit_breaker import breaker_for
+from .engine import GenerationEngine
+from .estimator import estimate_run, longest_first
+from .hedging import HedgePolicy
+from .http_clients import add_pool_arguments
+from .rate_limiter import ProviderRateLimiter, RetryPolicy
+from .response_cache import DEFAULT_CACHE_PATH, ResponseCache
+from .sharding import add_shard_arguments, check_coverage, find_shard_files, shard_suffix
+from .telemetry import DEFAULT_TELEMETRY_PATH, TelemetryStore
+
+
+def build_arg_parser(description: str, default_concurrency: int = 8, batch: bool = False) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--max-concurrency", type=int, default=default_concurrency,
+                        help=f"Maximum number of in-flight requests (default: {default_concurrency})")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH,
+                        help="SQLite response cache; every successful response is stored here")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--reuse-cache", action="store_true",
+                        help="Reuse cached responses for identical (model, prompts, vignette, parameters) calls")
+    parser.add_argument("--invalidate-cache", action="store_true",
+                        help="Delete cached responses for this model and parameters before running")
+    parser.add_argument("--retry-refusals", action="store_true",
+                        help="Call the API again for cases whose cached outcome is a refusal or content-filter hit "
+                             "(by default these are served from the cache, even without --reuse-cache)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the JSONL checkpoint, skipping case_ids that already completed")
+    parser.add_argument("--no-prompt-caching", action="store_true",
+                        help="Do not send explicit prompt-cache hints (Anthropic cache_control, OpenAI prompt_cache_key)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream responses (records time-to-first-token and per-block timings, avoids HTTP read timeouts on long calls)")
+    parser.add_argument("--max-attempts", type=int, default=6,
+                        help="Attempts per case for retryable errors and empty answers (default: 6)")
+    parser.add_argument("--requests-per-minute", type=float, default=None,
+                        help="Client-side requests/minute limit for this provider (default: unlimited)")
+    parser.add_argument("--tokens-per-minute", type=float, default=None,
+                        help="Client-side tokens/minute limit for this provider (default: unlimited)")
+    parser.add_argument("--telemetry-path", default=DEFAULT_TELEMETRY_PATH,
+                        help="SQLite store for per-call latency, tokens and cost (see llm_pipeline/telemetry.py)")
+    parser.add_argument("--no-telemetry", action="store_true", help="Do not record per-call telemetry")
+    parser.add_argument("--experiment", default=None,
+                        help="Label for telemetry records (default: the dataset name)")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Send a duplicate request for calls slower than this latency percentile, e.g. 95 (default: off)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1,
+                        help="Maximum duplicate requests as a fraction of calls (default: 0.1)")
+    parser.add_argument("--hedge-max-cost", type=float, default=None,
+                        help="Maximum estimated extra USD spent on duplicate requests (default: no limit)")
+    parser.add_argument("--hedge-min-samples", type=int, default=20,
+                        help="Latencies needed (from telemetry history or this run) before hedging starts (default: 20)")
+    parser.add_argument("--breaker-threshold", type=float, default=0.5,
+                        help="Pause this model's queue when this fraction of recent calls failed with 5xx/timeouts (default: 0.5)")
+    parser.add_argument("--breaker-window", type=int, default=20,
+                        help="Recent calls the circuit breaker's error rate is computed over (default: 20)")
+    parser.add_argument("--breaker-cooldown", type=float, default=30,
+                        help="Seconds the queue pauses before a probe request; doubles while probes fail (default: 30)")
+    parser.add_argument("--no-circuit-breaker", action="store_true",
+                        help="Keep sending requests while the provider is failing")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print predicted tokens, cost and wall time from past runs and exit without calling the API")
+    parser.add_argument("--file-order", action="store_true",
+                        help="Dispatch cases in file order instead of longest-expected first")
+    add_shard_arguments(parser)
+    add_pool_arguments(parser)
+    if batch:
+        parser.add_argument("--batch", action="store_true",
+                            help="Submit all remaining cases through the provider's batch API instead of synchronous calls")
+        parser.add_argument("--batch-poll-interval", type=float, default=30,
+                            help="Initial seconds between batch status checks; grows 1.5x per poll up to 10 minutes")
+    return parser
+
+
+def open_cache(args, adapter):
+    """Open the response cache selected on the command line (None with --no-cache)."""
+    if args.no_cache:
+        return None
+    cache = ResponseCache(args.cache_path)
+    if args.invalidate_cache:
+        deleted = cache.invalidate(model=adapter.model, params=adapter.params)
+        print(f"Invalidated {deleted} cached responses for {adapter.model}.")
+    return cache
+
+
+def open_telemetry(args):
+    """Open the telemetry store selected on the command line (None with --no-telemetry)."""
+    return None if args.no_telemetry else TelemetryStore(args.telemetry_path)
+
+
+def open_rate_limits(args) -> tuple:
+    """(ProviderRateLimiter or None, RetryPolicy) from the command-line options."""
+    rate_limiter = None
+    if args.requests_per_minute or args.tokens_per_minute:
+        rate_limiter = ProviderRateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    return rate_limiter, RetryPolicy(max_attempts=args.max_attempts)
+
+
+def estimate_dataset(args, dataset: pd.DataFrame, system_prompt: str, user_prompt: str, model: str):
+    """RunEstimate for `dataset` from the telemetry store (if it exists) and earlier result files (see estimator.py)."""
+    telemetry = TelemetryStore(args.telemetry_path) if os.path.exists(args.telemetry_path) else None
+    return estimate_run(dataset[["case_id", "vignette"]].to_dict("records"), system_prompt, user_prompt, model,
+                        telemetry=telemetry, concurrency=args.max_concurrency)
+
+
+def open_hedging(args, model: str, telemetry=None):
+    """HedgePolicy seeded with the model's past latencies from telemetry, or None without --hedge-percentile."""
+    if args.hedge_percentile is None:
+        return None
+    return HedgePolicy.from_telemetry(telemetry, model, percentile=args.hedge_percentile, budget=args.hedge_budget,
+                                      max_extra_cost=args.hedge_max_cost, min_samples=args.hedge_min_samples)
+
+
+def open_circuit_breaker(args, adapter):
+    """The process-wide CircuitBreaker for the adapter's provider and model, or None with --no-circuit-breaker."""
+    if args.no_circuit_breaker:
+        return None
+    return breaker_for(adapter.provider, adapter.model, threshold=args.breaker_threshold, window=args.breaker_window,
+                       min_calls=min(10, args.breaker_window), cooldown=args.breaker_cooldown)
+
+
+def open_checkpoint(args, output_dir: str, model: str, dataset_name: str, shard=None) -> JsonlCheckpoint:
+    """
+    Open the run's JSONL checkpoint (one per shard); without --resume an existing checkpoint is moved aside.
+    Returns None with --merge-shards, which makes no API calls.
+    """
+    if args.merge_shards:
+        return None
+    if shard is not None:
+        dataset_name = f"{dataset_name}_{shard_suffix(shard)}"
+    checkpoint = JsonlCheckpoint(checkpoint_path(output_dir, model, dataset_name))
+    if not args.resume:
+        checkpoint.archive()
+        BatchState(checkpoint.path + ".batch.json").clear()  # Do not reattach to a batch from an earlier run
+    return checkpoint
+
+
+def load_dataset(dataset_path: str) -> tuple:
+    """Returns (dataset_name, DataFrame) for a vignette dataset JSON file."""
+    dataset_name = str(dataset_path).split("/")[-1].split(".")[0]  # Extract the dataset name
+    with open(dataset_path, "r") as f:
+        combined = json.load(f)
+    return dataset_name, pd.DataFrame(combined)  # Convert to DataFrame
+
+
+def load_prompts(prompts_dir: str) -> tuple:
+    """Returns (system_prompt, user_prompt) from a prompts folder."""
+    with open(os.path.join(prompts_dir, "system_prompt.txt")) as f:
+        system_prompt = f.read()
+
+    with open(os.path.join(prompts_dir, "user_prompt.txt")) as f:
+        user_prompt = f.read()
+    return system_prompt, user_prompt
+
+
+def apply_results(dataset: pd.DataFrame, results: list) -> pd.DataFrame:
+    """Write model_thoughts/model_diagnosis from the engine results into the dataset rows (matched on case_id)."""
+    for column in ("model_thoughts", "model_diagnosis"):
+        if column not in dataset.columns:
+            dataset[column] = None
+    row_by_case = {case_id: index for index, case_id in dataset["case_id"].items()}
+    for result in results:
+        index = row_by_case[result.case_id]
+        dataset.loc[index, "model_thoughts"] = result.model_thoughts
+        dataset.loc[index, "model_diagnosis"] = result.model_diagnosis
+    return dataset
+
+
+def generate_dataset(adapter, dataset: pd.DataFrame, system_prompt: str, user_prompt: str,
+                     max_concurrency: int = 8, cache=None, reuse_cache: bool = False, checkpoint=None,
+                     rate_limiter=None, retry_policy=None, telemetry=None, experiment: str = None,
+                     hedge_policy=None, schedule: dict = None, circuit_breaker=None,
+                     reuse_terminal: bool = True) -> pd.DataFrame:
+    """
+    Run the engine over every case in `dataset` and fill in model_thoughts/model_diagnosis.
+    Failed calls and empty answers are retried inline by the engine (see rate_limiter.py).
+    With a `schedule` (case_id -> predicted seconds), the longest cases are dispatched first.
+    With a checkpoint, cases already in it are skipped and the final outputs are rebuilt from it.
+    """
+    engine = GenerationEngine(adapter, system_prompt, user_prompt, max_concurrency=max_concurrency,
+                              cache=cache, reuse_cache=reuse_cache, checkpoint=checkpoint,
+                              rate_limiter=rate_limiter, retry_policy=retry_policy,
+                              telemetry=telemetry, experiment=experiment, hedge_policy=hedge_policy,
+                              circuit_breaker=circuit_breaker, reuse_terminal=reuse_terminal)
+    cases = pending_cases(dataset, checkpoint)
+    if schedule:
+        cases = longest_first(cases, schedule)  # The engine starts cases in list order
+
+    apply_results(dataset, asyncio.run(engine.run(cases)))
+    return apply_checkpoint(dataset, checkpoint)
+
+
+def pending_cases(dataset: pd.DataFrame, checkpoint=None) -> list:
+    """Cases (dicts with case_id and vignette) that still need a generation; checkpointed ones are applied to `dataset`."""
+    cases = dataset[["case_id", "vignette"]].to_dict("records")
+    if checkpoint is not None:
+        completed = checkpoint.load()
+        if completed:
+            apply_checkpoint(dataset, checkpoint, completed)
+            cases = [case for case in cases if case["case_id"] not in completed]
+            print(f"Resuming from {checkpoint.path}: {len(completed)} cases already done, {len(cases)} remaining.")
+    return cases
+
+
+def apply_checkpoint(dataset: pd.DataFrame, checkpoint=None, completed: dict = None) -> pd.DataFrame:
+    """The checkpoint is the source of truth for the final predicted_diagnoses_*.json."""
+    if checkpoint is None:
+        return dataset
+    completed = checkpoint.load() if completed is None else completed
+    return apply_results(dataset, [completed[case_id] for case_id in dataset["case_id"] if case_id in completed])
+
+
+def generate_dataset_batch(backend, adapter, dataset: pd.DataFrame, system_prompt: str, user_prompt: str,
+                           poll_interval: float = 30, cache=None, reuse_cache: bool = False,
+                           checkpoint=None, telemetry=None, experiment: str = None,
+                           reuse_terminal: bool = True) -> pd.DataFrame:
+    """
+    Batch-API counterpart of generate_dataset(): cached and checkpointed cases are skipped, everything else is
+    submitted as one batch. The batch id is stored next to the checkpoint so that --resume reattaches to it.
+    """
+    engine = GenerationEngine(adapter, system_prompt, user_prompt, cache=cache, reuse_cache=reuse_cache,
+                              reuse_terminal=reuse_terminal)
+    cases = pending_cases(dataset, checkpoint)
+
+    # Serve cache hits (and cached refusals/filter hits) locally and only submit the misses
+    results, to_submit = [], []
+    for case in cases:
+        cached = engine.cached_result(case)
+        if cached is not None:
+            results.append(cached)
+        else:
+            to_submit.append(case)
+    if results:
+        print(f"Response cache: {len(results)} hits, {len(to_submit)} cases left for the batch.")
+
+    state = BatchState(checkpoint.path + ".batch.json") if checkpoint is not None else None
+    if to_submit:
+        batch_id = state.load() if state is not None else None
+        results += run_batch(backend, adapter, to_submit, system_prompt, user_prompt,
+                             batch_id=batch_id,
+                             on_submitted=state.save if state is not None else None,
+                             poll_interval=poll_interval)
+
+    vignettes = {case["case_id"]: case["vignette"] for case in cases}
+    for result in results:
+        if cache is not None and result.is_complete and not result.from_cache:
+            cache.put(engine.cache_key(vignettes[result.case_id]), adapter.model, adapter.params, result)
+        if checkpoint is not None and result.is_complete:
+            checkpoint.append(result)
+        if telemetry is not None:
+            telemetry.record_generation(result, adapter.model, experiment=experiment, batch=not result.from_cache)
+    if state is not None:
+        state.clear()  # The batch has been consumed; a later --resume submits a new one for any remaining cases
+
+    apply_results(dataset, results)
+    return apply_checkpoint(dataset, checkpoint)
+
+
+def save_predictions(dataset: pd.DataFrame, model: str, dataset_name: str, output_dir: str, shard=None) -> str:
+    """
+    Save to a timestamped predicted_diagnoses_*.json file and return its path. A shard of an array job is saved
+    under shards/ without a timestamp instead, so that merge_shards() can find it.
+    """
+    if shard is not None:
+        output_path = shard_predictions_prefix(model, dataset_name, output_dir) + f"_{shard_suffix(shard)}.json"
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    else:
+        output_path = os.path.join(output_dir, f"predicted_diagnoses_{model}_{dataset_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    dataset.to_json(output_path, orient="records", indent=2)
+    return output_path
+
+
+def shard_predictions_prefix(model: str, dataset_name: str, output_dir: str) -> str:
+    return os.path.join(output_dir, "shards", f"predicted_diagnoses_{model}_{dataset_name}")
+
+
+def merge_shards(dataset: pd.DataFrame, model: str, dataset_name: str, output_dir: str,
+                 num_shards: int = None) -> pd.DataFrame:
+    """Combine the shard files of an array job, checking that every case_id of `dataset` is covered exactly once."""
+    paths = find_shard_files(shard_predictions_prefix(model, dataset_name, output_dir), ".json", num_shards)
+    shards = [pd.read_json(path, orient="records", dtype=False) for path in paths]
+    merged = pd.concat(shards, ignore_index=True)
+    check_coverage(dataset["case_id"].tolist(), merged["case_id"].tolist())
+
+    # Keep the dataset's row order so merged and unsharded outputs line up
+    merged = dataset[["case_id"]].merge(merged, on="case_id", how="left")
+    missing = merged["model_diagnosis"].isna().sum()
+    print(f"Merged {len(paths)} shards into {len(merged)} cases ({missing} without a model diagnosis).")
+    return merged
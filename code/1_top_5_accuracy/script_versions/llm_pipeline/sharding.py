@@ -0,0 +1,95 @@
+# Deterministic sharding of the vignette set for Slurm array jobs
+# Each array task processes every num_shards-th case_id (sorted), writes a shard file, and a final --merge-shards
+# run checks that every case is covered exactly once before writing the usual output files
+#
+# Example (8 tasks, then merge once they all succeeded):
+#   sbatch --array=0-7 array_submit.sh 2_generate_diagnoses_openai.py
+#   sbatch --dependency=afterok:<job id> array_submit.sh 2_generate_diagnoses_openai.py --merge-shards
+import glob
+import os
+import re
+
+
+def add_shard_arguments(parser):
+    """--shard-index/--num-shards/--merge-shards for the generation and evaluation entry points."""
+    parser.add_argument("--shard-index", type=int, default=None,
+                        help="Process only this shard of the cases (default: $SLURM_ARRAY_TASK_ID when set)")
+    parser.add_argument("--num-shards", type=int, default=None,
+                        help="Total number of shards (default: $SLURM_ARRAY_TASK_COUNT when set)")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="Do not call any API; combine the shard outputs written by an array job")
+    return parser
+
+
+def resolve_shard(args):
+    """(shard_index, num_shards) from the command line or the Slurm array environment, or None for a full run."""
+    if args.merge_shards:
+        return None
+    index, count = args.shard_index, args.num_shards
+    if index is None and "SLURM_ARRAY_TASK_ID" in os.environ:
+        # Array ids need not start at 0 (e.g. --array=1-8)
+        index = int(os.environ["SLURM_ARRAY_TASK_ID"]) - int(os.environ.get("SLURM_ARRAY_TASK_MIN", 0))
+        count = count or int(os.environ.get("SLURM_ARRAY_TASK_COUNT", 0)) or None
+    if index is None and count is None:
+        return None
+    if index is None or count is None:
+        raise ValueError("Sharding needs both --shard-index and --num-shards (or a Slurm array job)")
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index {index} is outside 0..{count - 1}")
+    return index, count
+
+
+def shard_case_ids(case_ids, shard) -> set:
+    """Every num_shards-th case_id in sorted order: deterministic and balanced to within one case."""
+    index, count = shard
+    return set(sorted(case_ids, key=str)[index::count])
+
+
+def select_shard(df, shard):
+    """Rows of `df` that belong to `shard` (all rows when shard is None)."""
+    if shard is None:
+        return df
+    keep = shard_case_ids(df["case_id"].tolist(), shard)
+    selected = df[df["case_id"].isin(keep)].reset_index(drop=True)
+    print(f"Shard {shard[0]} of {shard[1]}: {len(selected)} of {len(df)} cases.")
+    return selected
+
+
+def shard_suffix(shard) -> str:
+    return f"shard{shard[0]:03d}-of-{shard[1]:03d}"
+
+
+def find_shard_files(pattern_prefix: str, extension: str, num_shards: int = None) -> list:
+    """
+    Shard files `<prefix>_shardXXX-of-NNN<extension>` sorted by index. All NNN shards must be present; with
+    several shard counts on disk, `num_shards` picks one.
+    """
+    found = {}
+    for path in glob.glob(f"{glob.escape(pattern_prefix)}_shard*-of-*{extension}"):
+        match = re.search(r"_shard(\d+)-of-(\d+)" + re.escape(extension) + "$", path)
+        if match:
+            found.setdefault(int(match.group(2)), {})[int(match.group(1))] = path
+    if not found:
+        raise FileNotFoundError(f"No shard files matching {pattern_prefix}_shard*{extension}")
+    if num_shards is None:
+        if len(found) > 1:
+            raise ValueError(f"Shard files for several shard counts {sorted(found)}; pass --num-shards")
+        num_shards = next(iter(found))
+    shards = found.get(num_shards, {})
+    missing = [index for index in range(num_shards) if index not in shards]
+    if missing:
+        raise ValueError(f"Missing shard files for shards {missing} of {num_shards} ({pattern_prefix})")
+    return [shards[index] for index in range(num_shards)]
+
+
+def check_coverage(expected_case_ids, merged_case_ids):
+    """Raise ValueError unless every expected case_id appears exactly once (and nothing else appears)."""
+    expected = set(expected_case_ids)
+    seen, duplicates = set(), set()
+    for case_id in merged_case_ids:
+        (duplicates if case_id in seen else seen).add(case_id)
+    missing, unexpected = expected - seen, seen - expected
+    if missing or duplicates or unexpected:
+        raise ValueError(f"Shard coverage check failed: {len(missing)} missing {sorted(missing, key=str)[:20]}, "
+                         f"{len(duplicates)} duplicated {sorted(duplicates, key=str)[:20]}, "
+                         f"{len(unexpected)} unexpected {sorted(unexpected, key=str)[:20]}")
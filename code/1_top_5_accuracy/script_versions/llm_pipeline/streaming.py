@@ -0,0 +1,45 @@
+# Timing helpers for the streaming code paths in adapters.py
+# Streaming lets Claude use thinking budgets above the ~20k max_tokens the SDK allows without streaming, and keeps
+# long xhigh-effort calls from the other providers from hitting HTTP read timeouts
+import time
+
+
+class StreamTimer:
+    """Records time-to-first-token and the start/end of every content block, in seconds since the request began."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.blocks = []  # [{"type": ..., "start": ..., "end": ..., "chunks": ...}]
+        self._open = None
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.start
+
+    def token(self, block_type: str):
+        """Call for every delta; opens a new block whenever the block type changes."""
+        now = self._now()
+        if self.first_token is None:
+            self.first_token = now
+        if self._open is None or self._open["type"] != block_type:
+            self.end_block()
+            self._open = {"type": block_type, "start": now, "end": now, "chunks": 0}
+        self._open["end"] = now
+        self._open["chunks"] += 1
+
+    def start_block(self, block_type: str):
+        """For protocols with explicit block boundaries (Anthropic content_block_start)."""
+        self.end_block()
+        self._open = {"type": block_type, "start": self._now(), "end": self._now(), "chunks": 0}
+
+    def end_block(self):
+        if self._open is not None:
+            self._open["end"] = max(self._open["end"], self._now())
+            self.blocks.append(self._open)
+            self._open = None
+
+    def summary(self) -> dict:
+        self.end_block()
+        return {"ttft": round(self.first_token, 3) if self.first_token is not None else None,
+                "total": round(self._now(), 3),
+                "blocks": [{k: round(v, 3) if isinstance(v, float) else v for k, v in block.items()} for block in self.blocks]}
@@ -0,0 +1,163 @@
+# Per-call telemetry store for generation and judge calls
+# Every provider call is written as one row (latency, queue wait, token usage, cache hits, retries, estimated cost)
+# to a local SQLite file, so capacity planning and cost estimates can use measured numbers instead of Slurm logs
+#
+# Report:
+#   python -m llm_pipeline.telemetry report [--experiment fictitious_only] [--kind judge]
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_TELEMETRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache", "telemetry.sqlite")
+
+# List prices in USD per 1M tokens: (input, cached input, cache write, output incl. reasoning); update when they change
+PRICES = {
+    "gemini-3-pro-preview": (2.00, 0.20, 2.00, 12.00),
+    "gpt-5.2": (1.75, 0.175, 1.75, 14.00),
+    "gpt-5-mini": (0.25, 0.025, 0.25, 2.00),
+    "claude-opus-4-5-20251101": (5.00, 0.50, 6.25, 25.00),
+    "deepseek-reasoner": (0.28, 0.028, 0.28, 0.42),
+}
+BATCH_DISCOUNT = 0.5  # OpenAI Batch and Anthropic Message Batches bill half the synchronous price
+
+COLUMNS = ("created_at", "kind", "experiment", "case_id", "model", "outcome", "latency", "queue_wait",
+           "input_tokens", "output_tokens", "reasoning_tokens", "cached_input_tokens", "cache_write_tokens",
+           "from_cache", "retries", "batch", "cost")
+
+
+def estimate_cost(model: str, usage: dict, batch: bool = False):
+    """Estimated USD cost of one call from normalized usage (see ProviderAdapter.usage); None for unknown models."""
+    if model not in PRICES or not usage:
+        return None
+    price_in, price_cached, price_write, price_out = PRICES[model]
+    cached = usage.get("cached_input_tokens") or 0
+    written = usage.get("cache_write_tokens") or 0
+    uncached = max((usage.get("input_tokens") or 0) - cached - written, 0)  # input_tokens includes cached/written tokens
+    cost = (uncached * price_in + cached * price_cached + written * price_write
+            + (usage.get("output_tokens") or 0) * price_out) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+class TelemetryStore:
+    """SQLite table of per-call records; safe to share between threads of one process and between Slurm jobs."""
+
+    def __init__(self, path: str = DEFAULT_TELEMETRY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS calls (
+                created_at REAL NOT NULL,
+                kind TEXT NOT NULL,
+                experiment TEXT,
+                case_id TEXT,
+                model TEXT NOT NULL,
+                outcome TEXT,
+                latency REAL,
+                queue_wait REAL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                reasoning_tokens INTEGER,
+                cached_input_tokens INTEGER,
+                cache_write_tokens INTEGER,
+                from_cache INTEGER NOT NULL,
+                retries INTEGER,
+                batch INTEGER NOT NULL,
+                cost REAL
+            )
+        """)
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, model: str, case_id=None, experiment: str = None, outcome: str = None,
+               latency: float = None, queue_wait: float = None, usage: dict = None, from_cache: bool = False,
+               retries: int = 0, batch: bool = False):
+        """Store one call; cost is estimated from `usage` (zero for responses served from the response cache)."""
+        usage = usage or {}
+        cost = 0.0 if from_cache else estimate_cost(model, usage, batch)
+        row = (time.time(), kind, experiment, None if case_id is None else str(case_id), model, outcome, latency,
+               queue_wait, usage.get("input_tokens"), usage.get("output_tokens"), usage.get("reasoning_tokens"),
+               usage.get("cached_input_tokens"), usage.get("cache_write_tokens"), int(from_cache), retries,
+               int(batch), cost)
+        with self.lock:
+            self.conn.execute(f"INSERT INTO calls ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", row)
+            self.conn.commit()
+
+    def record_generation(self, result, model: str, experiment: str = None, batch: bool = False):
+        """Store a GenerationResult from the engine or the batch path."""
+        self.record("generation", model, case_id=result.case_id, experiment=experiment, outcome=result.outcome,
+                    latency=result.latency, queue_wait=result.queue_wait, usage=result.usage,
+                    from_cache=result.from_cache, retries=result.retries, batch=batch)
+
+    def dataframe(self, experiment: str = None, kind: str = None) -> pd.DataFrame:
+        query, args = "SELECT * FROM calls WHERE 1 = 1", []
+        if experiment is not None:
+            query, args = query + " AND experiment = ?", args + [experiment]
+        if kind is not None:
+            query, args = query + " AND kind = ?", args + [kind]
+        with self.lock:
+            return pd.read_sql_query(query, self.conn, params=args)
+
+    def close(self):
+        self.conn.close()
+
+
+def summarize(calls: pd.DataFrame, by_experiment: bool = True) -> pd.DataFrame:
+    """
+    Latency percentiles, tokens and cost per (kind, experiment, model), or per (kind, model) across experiments.
+    Cache hits are counted but not timed.
+    """
+    keys = ["kind", "experiment", "model"] if by_experiment else ["kind", "model"]
+    rows = []
+    for values, group in calls.groupby(keys, dropna=False):
+        live = group[group["from_cache"] == 0]  # Cache hits have no latency and would drag the percentiles down
+        latency = live["latency"].dropna()
+        rows.append({
+            **dict(zip(keys, values)),
+            "calls": len(live),
+            "cache_hits": int(group["from_cache"].sum()),
+            "latency_p50": latency.quantile(0.50) if len(latency) else None,
+            "latency_p95": latency.quantile(0.95) if len(latency) else None,
+            "latency_p99": latency.quantile(0.99) if len(latency) else None,
+            "queue_wait_p95": live["queue_wait"].dropna().quantile(0.95) if live["queue_wait"].notna().any() else None,
+            "input_tokens": int(live["input_tokens"].fillna(0).sum()),
+            "cached_input_tokens": int(live["cached_input_tokens"].fillna(0).sum()),
+            "output_tokens": int(live["output_tokens"].fillna(0).sum()),
+            "retries": int(live["retries"].fillna(0).sum()),
+            "cost_usd": live["cost"].sum(min_count=1),
+            "cost_per_call_usd": live["cost"].mean(),
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Summarize per-call latency, tokens and cost")
+    ap.add_argument("command", choices=["report"])
+    ap.add_argument("--telemetry-path", default=DEFAULT_TELEMETRY_PATH)
+    ap.add_argument("--experiment", help="Only calls recorded under this experiment label")
+    ap.add_argument("--kind", choices=["generation", "judge"], help="Only generation or only judge calls")
+    ap.add_argument("--per-model", action="store_true", help="Aggregate over experiments (one row per model)")
+    ap.add_argument("--csv", help="Also write the summary table to this CSV file")
+    args = ap.parse_args()
+
+    store = TelemetryStore(args.telemetry_path)
+    calls = store.dataframe(experiment=args.experiment, kind=args.kind)
+    store.close()
+    if calls.empty:
+        print("No calls recorded.")
+        return
+    summary = summarize(calls, by_experiment=not args.per_model)
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(summary.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    if args.csv:
+        summary.to_csv(args.csv, index=False)
+        print(f"Saved summary to '{args.csv}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Fuzzy-threshold sensitivity sweep for the hybrid accuracy evaluation
+# A cell (true i, pred j) of a case matches at threshold T when its token_set_ratio is at least T, or, below T, when
+# the later tiers (diagnosis index, judge cache, embeddings, LLM judge) say so. evaluate_accuracy.py --threshold-sweep
+# therefore scores every case once: the raw fuzzy score matrix plus the verdict of the later tiers for every cell below
+# the highest threshold. Top-1, top-5, recall@5 and MRR for every threshold (with the judge on, and with the fuzzy
+# tier alone) are then derived from those arrays, without further scoring or LLM calls.
+#
+# Re-plot a saved sweep with:
+#   python -m llm_pipeline.threshold_sweep <summarized_results>/threshold_sweep.csv --output-dir <folder>
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_THRESHOLDS = list(range(70, 101))
+
+# Metric keys (as in evaluate_accuracy.py --metrics) -> names used in the summary CSVs
+METRIC_LABELS = {
+    "top1": "Top-1 Accuracy",
+    "hit_rate": "Top-5 Accuracy",
+    "recall": "Recall@5",
+    "mrr": "Mean Reciprocal Rank",
+}
+
+
+def case_arrays(cases: list):
+    """
+    Pad per-case (fuzzy score matrix, verdict matrix) pairs into (cases, true, pred) arrays: scores (-inf padding),
+    verdicts (False padding) and the number of true diagnoses per case.
+    """
+    n_true = np.array([len(scores) for scores, _ in cases])
+    max_true = max(n_true, default=1)
+    max_pred = max([len(row) for scores, _ in cases for row in scores], default=0) or 1  # One empty column if no predictions
+    scores = np.full((len(cases), max_true, max_pred), -np.inf)
+    verdicts = np.zeros(scores.shape, dtype=bool)
+    for c, (case_scores, case_verdicts) in enumerate(cases):
+        for i, (score_row, verdict_row) in enumerate(zip(case_scores, case_verdicts)):
+            scores[c, i, :len(score_row)] = score_row
+            verdicts[c, i, :len(verdict_row)] = [bool(v) for v in verdict_row]
+    return scores, verdicts, n_true
+
+
+def sweep_metrics(scores: np.ndarray, verdicts: np.ndarray, n_true: np.ndarray, thresholds, judge: bool = True) -> dict:
+    """
+    {metric: per-case scores of shape (thresholds, cases)}, with the same definitions as evaluate_case: the matches of
+    every threshold are one broadcast comparison, so no case or threshold is looped over in Python.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    matches = scores[None] >= thresholds[:, None, None, None]  # (thresholds, cases, true, pred)
+    if judge:
+        matches |= verdicts[None]
+    pred_correct = matches.any(axis=2)  # (thresholds, cases, pred): prediction j matches any true diagnosis
+    hit = pred_correct.any(axis=2)
+    first_rank = pred_correct.argmax(axis=2) + 1
+    return {
+        "top1": pred_correct[..., 0].astype(np.float64),
+        "hit_rate": hit.astype(np.float64),
+        "recall": matches.any(axis=3).sum(axis=2) / n_true,
+        "mrr": np.where(hit, 1.0 / first_rank, 0.0),
+    }
+
+
+def sweep_table(model: str, cases: list, thresholds=DEFAULT_THRESHOLDS, labels: dict = None) -> pd.DataFrame:
+    """Tidy table (model, judge, fuzzy_threshold, metric, score, n_cases) of one model's mean metrics."""
+    labels = METRIC_LABELS if labels is None else labels
+    scores, verdicts, n_true = case_arrays(cases)
+    frames = []
+    for judge in (True, False):
+        per_case = sweep_metrics(scores, verdicts, n_true, thresholds, judge=judge)
+        for metric, label in labels.items():
+            frames.append(pd.DataFrame({
+                "model": model,
+                "judge": "on" if judge else "off",
+                "fuzzy_threshold": thresholds,
+                "metric": label,
+                "score": per_case[metric].mean(axis=1),
+                "n_cases": len(cases),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def plot_sweep(table: pd.DataFrame, path: str, current_threshold: float = None) -> bool:
+    """
+    One model's metrics against the fuzzy threshold (solid: judge on, dashed: fuzzy tier alone), saved to path.
+    Needs the optional matplotlib package; returns False (with a message) when it is unavailable.
+    """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")  # Files only; works without a display
+        import matplotlib.pyplot as plt
+    except ImportError as e:
+        print(f"Threshold sweep plot skipped ({e}); the table is saved regardless.")
+        return False
+
+    fig, ax = plt.subplots(figsize=(9, 4.5))
+    for color, (metric, rows) in zip(plt.rcParams["axes.prop_cycle"].by_key()["color"], table.groupby("metric", sort=False)):
+        for judge, style in (("on", "-"), ("off", "--")):
+            line = rows[rows["judge"] == judge]
+            ax.plot(line["fuzzy_threshold"], line["score"], style, color=color,
+                    label=f"{metric} (judge {judge})")
+    if current_threshold is not None:
+        ax.axvline(current_threshold, color="grey", linewidth=0.8, linestyle=":")
+    ax.set_xlabel("Fuzzy threshold (token_set_ratio)")
+    ax.set_ylabel("Score")
+    ax.set_ylim(0, 1)
+    ax.set_title(table["model"].iloc[0], fontsize=9)
+    ax.legend(fontsize=7, loc="upper left", bbox_to_anchor=(1.01, 1))  # Outside, so no line is hidden
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Plot a saved fuzzy-threshold sweep, one figure per model")
+    ap.add_argument("table", help="threshold_sweep.csv written by evaluate_accuracy.py --threshold-sweep")
+    ap.add_argument("--output-dir", help="Where to write the plots (default: next to the table)")
+    ap.add_argument("--current-threshold", type=float, default=90, help="Threshold to mark in the plots")
+    args = ap.parse_args()
+
+    table = pd.read_csv(args.table)
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.table))
+    for model, rows in table.groupby("model", sort=False):
+        path = os.path.join(output_dir, f"{model}_threshold_sweep.png")
+        if plot_sweep(rows, path, args.current_threshold):
+            print(f"Saved threshold sweep plot to '{path}'")
+
+
+if __name__ == "__main__":
+    main()